@@ -2,10 +2,15 @@ from django.shortcuts import render
 from rest_framework import generics
 from .models import *
 from rest_framework import permissions
+from core.conditional import ConditionalGetMixin
 from .serializers import *
 # Create your views here.
 
-class BrandListView(generics.ListAPIView):
+class BrandListView(ConditionalGetMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
+    user_overlay = False
+
+    def get_version_scopes(self, request, *args, **kwargs):
+        return ['brands']
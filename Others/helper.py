@@ -2,9 +2,11 @@
 import stripe
 from django.conf import settings
 from django.urls import reverse
+from core.metrics import timed
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
+@timed('stripe.create_checkout_session')
 def create_checkout_session(request, orders = None , payments = None, price = None ):
 
     if not orders or not price or not payments:
@@ -38,6 +40,7 @@ def create_checkout_session(request, orders = None , payments = None, price = No
 
     return session.url
 
+@timed('stripe.create_payment_intent_data')
 def create_payment_intent_data(request, orders=None, payments=None, price=None, customer_email=None):
     if not orders or not price:
         raise Exception("No orders or price provided")
@@ -1,9 +1,11 @@
+import bisect
 from Products.models import PartnerProduct
 from django.db import models
 from cloudinary_storage.storage import MediaCloudinaryStorage
 from Products.models import Product
 from datetime import datetime
 from Products.models import *
+from django.db.models import Q
 
 class FAQ(models.Model):
     question_de = models.CharField(max_length=200 , verbose_name ="Question (German)")
@@ -122,47 +124,44 @@ class FootScan(models.Model):
         return float(max(self.left_width, self.right_width))
 
     # --- IMPROVED Category mappings ---
-    def width_category(self):
+    def width_category(self, thresholds=None):
         """
         Improved width categorization using width-to-length ratio.
         More accurate than absolute width values.
+        Thresholds come from the active MatchModel unless given.
         Returns: 0=Narrow, 1=Narrow-Normal, 2=Normal, 3=Normal-Wide, 4=Wide
         """
+        if thresholds is None:
+            from Products.matching import active_scoring
+            thresholds = active_scoring().width_ratio_thresholds
+
         length = self.max_length()
         width = self.max_width()
         
         # Calculate width-to-length ratio (typical range: 0.35 - 0.45)
         ratio = width / length if length > 0 else 0
         
-        # Refined thresholds based on biomechanical research
-        if ratio < 0.37:
-            return 0  # Narrow
-        elif ratio < 0.39:
-            return 1  # Narrow-Normal
-        elif ratio < 0.41:
-            return 2  # Normal
-        elif ratio < 0.43:
-            return 3  # Normal-Wide
-        else:
-            return 4  # Wide
+        # Default thresholds (biomechanical research): 0.37 / 0.39 / 0.41 / 0.43
+        return bisect.bisect_right(thresholds, ratio)
 
-    def toe_box_category(self):
+    def toe_box_category(self, thresholds=None):
         """
         Improved toe box categorization.
+        Thresholds come from the active MatchModel unless given.
         Returns: "narrow", "normal", "wide"
         """
+        if thresholds is None:
+            from Products.matching import active_scoring
+            thresholds = active_scoring().toe_box_ratio_thresholds
+
         length = self.max_length()
         width = self.max_width()
         
         # Use ratio for better accuracy
         ratio = width / length if length > 0 else 0
         
-        if ratio < 0.38:
-            return "narrow"
-        elif ratio < 0.42:
-            return "normal"
-        else:
-            return "wide"
+        # Default thresholds: 0.38 / 0.42
+        return ["narrow", "normal", "wide"][bisect.bisect_right(thresholds, ratio)]
     
     def get_width_label(self):
         """Get human-readable width label."""
@@ -221,6 +220,12 @@ class Order(models.Model):
     tracking = models.CharField(max_length=100, verbose_name="Tracking ID",blank=True,null=True)
     net_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Net amount after fees and charges")
     created_at = models.DateTimeField(auto_now_add=True,verbose_name="Created at (UTC)")
+
+    class Meta:
+        indexes = [
+            # Keyset pages of a partner's order history
+            models.Index(fields=['partner', '-created_at', '-id']),
+        ]
     
     def save(self, *args, **kwargs):
         if self.price is not None:
@@ -259,6 +264,12 @@ class Payment(models.Model):
     transaction_id = models.CharField(max_length=100, verbose_name="Transaction ID",blank=True,null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pages of a partner's income
+            models.Index(fields=['payment_to', '-created_at', '-id']),
+        ]
+
     def save(self, *args, **kwargs):
         if self.amount is not None:
             try:
@@ -384,6 +395,15 @@ class Accessories(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['partner', 'eanc'],
+                condition=Q(eanc__isnull=False) & ~Q(eanc=''),
+                name='unique_partner_accessory_ean',
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         if self.price is not None:
             self.price = round(self.price, 2)
@@ -2,7 +2,8 @@
 from rest_framework import serializers
 from .models import *
 from Accounts.serializers import AddressSerializer
-from django.db.models import Sum
+from django.db.models import Prefetch, Sum, prefetch_related_objects
+from core.fieldsets import SparseFieldsetMixin, sparse_fields
 
 class FAQSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,7 +20,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = ("user", "amount", "created_at")
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     customer = serializers.SerializerMethodField()
     product = serializers.CharField(source="product.name", read_only=True)
     product_id = serializers.ReadOnlyField(source='product.id')
@@ -75,6 +76,119 @@ class OrderSerializer(serializers.ModelSerializer):
             "address" : AddressSerializer(address).data,
         }
 
+# Order columns read by order_rows()
+ORDER_ROW_FIELDS = (
+    'pk', 'id', 'order_id', 'user_id', 'user__name', 'user__email', 'partner_id',
+    'product_id', 'product__name', 'product__sub_category__slug', 'status', 'price',
+    'net_amount', 'tracking', 'created_at', 'color', 'size_id', 'quantity',
+)
+order_price_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+order_net_amount_field = serializers.DecimalField(max_digits=12, decimal_places=2)
+order_created_at_field = serializers.DateTimeField()
+
+def order_rows(rows, scan=None, fields=None):
+    """
+    OrderSerializer output for Order .values() rows, built as plain dicts.
+    Partner variants, addresses, images, size labels and scores are looked
+    up once for the page instead of once per order, and only for the
+    fields of the sparse fieldset `fields` (None for all).
+    """
+    from Products.matching import match_products
+    from Products.tasks import PRODUCT_FIELDS
+
+    def wants(name):
+        return fields is None or name in fields
+
+    rows = list(rows)
+    user_ids = {row['user_id'] for row in rows}
+    product_ids = {row['product_id'] for row in rows}
+
+    # .first() of each lookup below, in the models' default ordering
+    partner_products = {}
+    if wants('partner_product_id'):
+        for partner_id, product_id, pp_id in PartnerProduct.objects.filter(
+            partner_id__in={row['partner_id'] for row in rows}, product_id__in=product_ids,
+        ).values_list('partner_id', 'product_id', 'id'):
+            partner_products.setdefault((partner_id, product_id), pp_id)
+
+    address_data, image_urls = {}, {}
+    if wants('details'):
+        addresses = {}
+        for address in Address.objects.filter(user_id__in=user_ids).order_by('user_id', '-created_at', '-pk'):
+            addresses.setdefault(address.user_id, address)
+        address_data = {user_id: AddressSerializer(addresses.get(user_id)).data for user_id in user_ids}
+
+        image_field = ProductImage._meta.get_field('image')
+        image_names = {}
+        for product_id, name in ProductImage.objects.filter(product_id__in=product_ids).values_list('product_id', 'image'):
+            image_names.setdefault(product_id, name)
+        image_urls = {
+            product_id: image_field.attr_class(None, image_field, name).url
+            for product_id, name in image_names.items()
+        }
+
+    size_labels = {}
+    if wants('details') or wants('match_data'):
+        size_labels = {
+            size.id: str(size.size)
+            for size in PartnerProductSize.objects.filter(id__in={row['size_id'] for row in rows}).select_related('size')
+        }
+
+    scans, matches = {}, {}
+    if wants('match_data'):
+        if scan:
+            scans = {user_id: scan for user_id in user_ids}
+        else:
+            scans = {foot_scan.user_id: foot_scan for foot_scan in FootScan.objects.filter(user_id__in=user_ids)}
+        scored = {}
+        for row in rows:
+            if row['user_id'] in scans and row['size_id']:
+                scored.setdefault(scans[row['user_id']].pk, set()).add(row['product_id'])
+        products = {}
+        if scored:
+            products = Product.objects.filter(id__in=set().union(*scored.values())).only(*PRODUCT_FIELDS).in_bulk()
+        matches = {
+            foot_scan.pk: match_products(foot_scan, [products[pid] for pid in scored[foot_scan.pk] if pid in products])
+            for foot_scan in {foot_scan.pk: foot_scan for foot_scan in scans.values()}.values()
+            if foot_scan.pk in scored
+        }
+
+    data = []
+    for row in rows:
+        size_label = size_labels.get(row['size_id'])
+        match_data = None
+        user_scan = scans.get(row['user_id'])
+        if user_scan and row['size_id']:
+            size_scores = (matches[user_scan.pk].get(row['product_id']) or {}).get('size_scores', [])
+            match_data = {
+                'score': next((item['score'] for item in size_scores if item['size'] == size_label), None),
+            }
+        item = {
+            "id": row['id'],
+            "order_id": row['order_id'],
+            "customer": row['user__name'] if row['user__name'] else row['user__email'],
+            "product": row['product__name'],
+            "product_id": row['product_id'],
+            "partner_product_id": partner_products.get((row['partner_id'], row['product_id'])),
+            "status": row['status'],
+            "price": order_price_field.to_representation(row['price']),
+            "net_amount": order_net_amount_field.to_representation(row['net_amount']),
+            "tracking": row['tracking'],
+            "created_at": order_created_at_field.to_representation(row['created_at']),
+            "details": {
+                "color": row['color'],
+                "image": image_urls.get(row['product_id']),
+                "size": size_label,
+                "size_id": row['size_id'],
+                "quantity": row['quantity'],
+                "address": address_data.get(row['user_id']),
+            },
+            "match_data": match_data,
+            "sub_category": row['product__sub_category__slug'],
+        }
+        data.append(item if fields is None else {name: item[name] for name in fields})
+    return data
+
 class WarehouseSerializer(serializers.ModelSerializer):
     stock = serializers.SerializerMethodField()
     item = serializers.SerializerMethodField()
@@ -99,7 +213,7 @@ class WarehouseSerializer(serializers.ModelSerializer):
     def get_item(self, obj):
         return obj.product.count()
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='partner_product.product.name', read_only=True)
     product_image = serializers.SerializerMethodField()
     price = serializers.DecimalField(source='partner_product.price', max_digits=12, decimal_places=2, read_only=True)
@@ -126,7 +240,7 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
     count = serializers.SerializerMethodField()
@@ -140,6 +254,23 @@ class CartSerializer(serializers.ModelSerializer):
         return obj.items.aggregate(total=Sum('quantity')).get('total')
 
 
+def prefetch_cart(cart, request):
+    """
+    Load the cart's items with the relations the requested fields read
+    (items and total_price), in a fixed number of queries.
+    """
+    params = request.query_params
+    cart_fields = sparse_fields(params, CartSerializer.Meta.fields)
+    if cart_fields is not None and not {'items', 'total_price'} & set(cart_fields):
+        return cart
+    item_fields = sparse_fields(params, CartItemSerializer.Meta.fields, 'items.')
+    items = CartItem.objects.select_related('partner_product__product', 'size__size')
+    if item_fields is None or 'product_image' in item_fields:
+        items = items.prefetch_related('partner_product__product__images')
+    prefetch_related_objects([cart], Prefetch('items', queryset=items))
+    return cart
+
+
 class AccessoriesSerializer(serializers.ModelSerializer):
     brand = serializers.CharField(source='brand.name', read_only=True)
     warehouse = serializers.CharField(source='warehouse.name', read_only=True)
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, post_save, post_delete
 from django.dispatch import receiver
-from .models import Question, Answer
-from django.db import OperationalError
+from .models import Question, Answer, FAQ, News
+from django.db import OperationalError, transaction
+from core.versioning import bump_versions
 
 @receiver(post_migrate)
 def populate_questions(sender, **kwargs):
@@ -377,3 +378,16 @@ def populate_questions(sender, **kwargs):
                 )
     except OperationalError:
         pass
+
+
+# --- CONDITIONAL GET VERSIONS ---
+@receiver(post_save, sender=FAQ)
+@receiver(post_delete, sender=FAQ)
+def bump_faq_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_versions('faq'))
+
+
+@receiver(post_save, sender=News)
+@receiver(post_delete, sender=News)
+def bump_news_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_versions('news'))
@@ -1,3 +1,27 @@
+from datetime import timedelta
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
+from Accounts.models import Address
+from Brands.models import Brand
+from Products.models import Product
+from .models import Order
+from .serializers import ORDER_ROW_FIELDS, order_rows
 
-# Create your tests here.
+User = get_user_model()
+
+
+class OrderRowsTests(TestCase):
+    """order_rows() must render what OrderSerializer renders."""
+
+    def test_details_use_the_newest_address(self):
+        customer = User.objects.create(email="rows-customer@example.com", role="customer", is_active=True)
+        old = Address.objects.create(user=customer, first_name="Old", street_address="1 Old St", postal_code="1000", city="Berlin", phone_number="1", country="DE")
+        new = Address.objects.create(user=customer, first_name="New", street_address="2 New St", postal_code="2000", city="Munich", phone_number="2", country="DE")
+        Address.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=1))
+        product = Product.objects.create(name="Rows Runner", brand=Brand.objects.create(name="Rows"), description="d", gender="male")
+        Order.objects.create(user=customer, name="Rows Runner", product=product, color="Black")
+
+        rows = order_rows(Order.objects.values(*ORDER_ROW_FIELDS), fields=["details"])
+        self.assertEqual(rows[0]["details"]["address"]["first_name"], new.first_name)
+        self.assertEqual(Address.objects.filter(user=customer).first(), new)
@@ -1,6 +1,7 @@
 # views.py
 from rest_framework import generics, permissions, views, status
 from rest_framework.response import Response
+from rest_framework.renderers import BrowsableAPIRenderer
 from django.db.models import Sum, F, DecimalField, Case, When, Q
 from django.db.models.functions import ExtractMonth, ExtractYear
 from django.utils import timezone
@@ -9,25 +10,38 @@ from decimal import Decimal
 from .models import *
 from .serializers import *
 from core.permission import *
+from core.pagination import KeysetPaginationMixin
+from core.conditional import ConditionalGetMixin
+from core.fieldsets import SparseFieldsetViewMixin
+from core.renderers import ORJSONRenderer
 from Products.views import CustomLimitPagination
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from Products.models import PartnerProduct, PartnerProductSize
+from Products.barcodes import ean_in_use
 from Accounts.models import Address
 from .helper import *
 import stripe
 import ast
 
-class FAQAPIView(generics.ListAPIView):
+class FAQAPIView(ConditionalGetMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]  
     queryset = FAQ.objects.all()
     serializer_class = FAQSerializer
+    user_overlay = False
 
+    def get_version_scopes(self, request, *args, **kwargs):
+        return ['faq']
 
-class NewsAPIView(generics.ListAPIView):
+
+class NewsAPIView(ConditionalGetMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]  
     queryset = News.objects.all()
     serializer_class = NewsSerializer
+    user_overlay = False
+
+    def get_version_scopes(self, request, *args, **kwargs):
+        return ['news']
 
 
 class DashboardAPIView(views.APIView):
@@ -390,16 +404,25 @@ class DashboardAPIView(views.APIView):
         })
 
 
-class OrderPageAPIView(generics.ListAPIView):
+class OrderPageAPIView(SparseFieldsetViewMixin, KeysetPaginationMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated,IsPartner] 
     serializer_class = OrderSerializer
     pagination_class = CustomLimitPagination
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['status']
     search_fields = ['order_id', 'name', 'product__name','product__brand__name','product__sub_category__name']
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
 
     def get_queryset(self):
-        return Order.objects.filter(partner=self.request.user).select_related('user', 'product').order_by('-created_at')
+        return Order.objects.filter(partner=self.request.user).order_by('-created_at')
+
+    def list(self, request, *args, **kwargs):
+        """Page over .values() rows and build OrderSerializer's output with order_rows()."""
+        rows = self.filter_queryset(self.get_queryset()).values(*ORDER_ROW_FIELDS)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(order_rows(rows, fields=self.get_sparse_fields()))
+        return self.get_paginated_response(order_rows(page, fields=self.get_sparse_fields()))
 
 
 class OrderAnalyticsAPIView(views.APIView):
@@ -439,7 +462,7 @@ class CartAPIView(views.APIView):
 
     def get(self, request, *args, **kwargs):
         cart, created = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(prefetch_cart(cart, request), context={'request': request})
         return Response(serializer.data)
 
     def post(self, request, *args, **kwargs):
@@ -509,7 +532,7 @@ class CartAPIView(views.APIView):
         cart_item.quantity = new_quantity
         cart_item.save()
 
-        return Response({"message": "Item added to cart", "cart": CartSerializer(cart).data}, status=status.HTTP_200_OK)
+        return Response({"message": "Item added to cart", "cart": CartSerializer(prefetch_cart(cart, request), context={'request': request}).data}, status=status.HTTP_200_OK)
 
 
 class CartItemUpdateDeleteView(views.APIView):
@@ -544,14 +567,14 @@ class CartItemUpdateDeleteView(views.APIView):
         cart_item.quantity = quantity
         cart_item.save()
         
-        return Response({"message": "Cart updated", "cart": CartSerializer(cart_item.cart).data}, status=status.HTTP_200_OK)
+        return Response({"message": "Cart updated", "cart": CartSerializer(prefetch_cart(cart_item.cart, request), context={'request': request}).data}, status=status.HTTP_200_OK)
 
     def delete(self, request, pk, *args, **kwargs):
         try:
             cart_item = CartItem.objects.get(pk=pk, cart__user=request.user)
             cart = cart_item.cart
             cart_item.delete()
-            return Response({"message": "Item removed from cart", "cart": CartSerializer(cart).data}, status=status.HTTP_200_OK)
+            return Response({"message": "Item removed from cart", "cart": CartSerializer(prefetch_cart(cart, request), context={'request': request}).data}, status=status.HTTP_200_OK)
         except CartItem.DoesNotExist:
              return Response({"error": "Cart Item not found."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -1034,26 +1057,31 @@ class FinanceDashboardView(views.APIView):
         return result
 
 
-class PartnerIncomeView(views.APIView):
+class PartnerIncomeView(KeysetPaginationMixin, views.APIView):
     permission_classes = [permissions.IsAuthenticated, IsPartner]
     pagination_class = CustomLimitPagination
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
 
     def get(self, request):
         partner = request.user
-        payments = Payment.objects.filter(payment_to=partner,transaction_id__isnull=False).order_by('-created_at')
+        payments = (
+            Payment.objects.filter(payment_to=partner,transaction_id__isnull=False)
+            .order_by('-created_at')
+            .values('pk', 'created_at', 'transaction_id', 'amount', 'net_amount')
+        )
 
-        # Initialize paginator
-        paginator = self.pagination_class()
-        page = paginator.paginate_queryset(payments, request)
+        # Initialize paginator (keyset when ?cursor= is sent)
+        paginator = self.paginator
+        page = paginator.paginate_queryset(payments, request, view=self)
 
         data = [
             {
-                "date": payment.created_at.strftime('%Y-%m-%d'),
-                "tnx_id": payment.transaction_id,
-                "amount": payment.amount,
+                "date": payment['created_at'].strftime('%Y-%m-%d'),
+                "tnx_id": payment['transaction_id'],
+                "amount": payment['amount'],
                 "fees": partner.fees,
                 "other": partner.other_charges,
-                "revenue": payment.net_amount,
+                "revenue": payment['net_amount'],
                 "status": "Bestätigt"
             }
             for payment in page
@@ -1067,7 +1095,7 @@ class OrderView(views.APIView):
     def get(self, request):
         scan = FootScan.objects.filter(user=request.user).first()
         orders = Order.objects.filter(user=request.user).exclude(status='pending').select_related('product', 'size__size')
-        return Response(OrderSerializer(orders, many=True, context={'scan': scan}).data, status=status.HTTP_200_OK)
+        return Response(OrderSerializer(orders, many=True, context={'request': request, 'scan': scan}).data, status=status.HTTP_200_OK)
 
 
 class ClearCartView(views.APIView):
@@ -1104,6 +1132,10 @@ class AccessoriesAPIView(views.APIView):
             if not brand:
                 brand = Brand.objects.create(name=brand_name)
 
+            existing = Accessories.objects.filter(partner=request.user, name=name, brand=brand).first()
+            if not existing and ean_in_use(Accessories, request.user, eanc):
+                return Response({"error": "This EAN is already used by another of your accessories."}, status=status.HTTP_400_BAD_REQUEST)
+
             # 2. Resolve or Create Product
             product, created = Accessories.objects.get_or_create(
                 partner=request.user,
@@ -1183,6 +1215,8 @@ class AccessoriesAPIView(views.APIView):
                 accessories.price = request.data.get('price')
             
             if 'eanc' in request.data:
+                if ean_in_use(Accessories, request.user, request.data.get('eanc'), exclude_pk=accessories.pk):
+                    return Response({"error": "This EAN is already used by another of your accessories."}, status=status.HTTP_400_BAD_REQUEST)
                 accessories.eanc = request.data.get('eanc')
             
             if 'article' in request.data:
@@ -231,3 +231,47 @@ class PartnerProductAdmin(ModelAdmin):
         return obj.total_stock_quantity
     total_stock_quantity.short_description = 'Total Stock'
 
+
+@admin.register(MatchModel)
+class MatchModelAdmin(ModelAdmin):
+    list_display = ('version', 'status', 'length_weight', 'width_weight', 'toe_box_weight', 'activated_at')
+    readonly_fields = ('status', 'pending_batches', 'created_at', 'activated_at')
+    # Scores and caches are keyed on the version, only drafts can change it
+    config_fields = ('version', 'length_weight', 'width_weight', 'toe_box_weight',
+                     'length_bands_mm', 'width_ratio_thresholds', 'toe_box_ratio_thresholds')
+    actions = ['activate_version', 'abort_warming']
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly = super().get_readonly_fields(request, obj)
+        if obj is not None and obj.status != MatchModel.Status.DRAFT:
+            return (*readonly, *self.config_fields)
+        return readonly
+
+    @admin.action(description="Activate selected version (re-scores in the background)")
+    def activate_version(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, "Select exactly one version to activate.", level='error')
+            return
+        model = queryset.get()
+        if model.status not in (MatchModel.Status.DRAFT, MatchModel.Status.FAILED):
+            self.message_user(request, f"Version {model.version} is already {model.get_status_display().lower()}.", level='error')
+            return
+        model.activate()
+        self.message_user(request, f"Version {model.version} is warming up and goes live once re-scoring finishes.")
+
+    @admin.action(description="Abort warming of selected versions (mark them failed)")
+    def abort_warming(self, request, queryset):
+        aborted = 0
+        for model in queryset.filter(status=MatchModel.Status.WARMING):
+            model.abort_warming()
+            aborted += 1
+        self.message_user(request, f"{aborted} warming version(s) marked failed, activate them again to restart.")
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(ModelAdmin):
+    list_display = ('file_name', 'partner', 'status', 'processed_rows', 'total_rows', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('file_name', 'partner__email', 'file_hash')
+    readonly_fields = ('partner', 'warehouse', 'file', 'file_name', 'file_hash', 'status', 'total_rows', 'processed_rows',
+                       'matched_columns', 'summary', 'skipped_details', 'report', 'error', 'created_at', 'updated_at', 'finished_at')
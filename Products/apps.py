@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 from django.db.utils import OperationalError, ProgrammingError
 
 
@@ -7,6 +8,8 @@ class ProductsConfig(AppConfig):
     name = 'Products'
     def ready(self):
         import Products.signal
+        from .search import ensure_search_schema
+        post_migrate.connect(ensure_search_schema, sender=self)
         from .models import Category, SubCategory
         # categories.py
 
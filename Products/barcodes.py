@@ -0,0 +1,201 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from Others.models import Accessories
+from .listing import schedule_listing_refresh
+from .models import PartnerProduct, PartnerProductSize, ProductImage, Size
+
+
+def parse_size(label):
+    """(type, value) of a size label: "EU 42", "USM 9.5", or a bare "42" for EU."""
+    parts = str(label).split()
+    if len(parts) >= 2:
+        return parts[0].upper(), " ".join(parts[1:])
+    return "EU", str(label).strip()
+
+
+def ean_in_use(model, partner, eanc, exclude_pk=None):
+    """Whether another of the partner's PartnerProduct/Accessories rows has this EAN."""
+    if not eanc:
+        return False
+    return model.objects.filter(partner=partner, eanc=eanc).exclude(pk=exclude_pk).exists()
+
+
+def shifted(field, deltas):
+    """field + deltas[pk] for every row of one UPDATE, never below 0."""
+    whens = [When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()]
+    return Greatest(F(field) + Case(*whens, default=Value(0), output_field=IntegerField()), Value(0))
+
+
+def apply_barcode_scans(partner, scans):
+    """
+    Apply a batch of barcode scans {"ean", "size", "delta"} to the partner's
+    stock in one transaction. The EAN picks a shoe variant, whose scans need
+    a size ("EU 42" or "42"), or an accessory. Deltas hitting the same stock
+    are summed and applied relative to the stored quantity (F()), one UPDATE
+    per table, so concurrent tills never overwrite each other; stock never
+    goes below 0. A size missing from a variant is added by positive deltas,
+    like the stock upload would.
+
+    Returns the stock after the batch for every applied scan, and the
+    rejected scans with the reason.
+    """
+    rejected = []
+    accepted = []
+    for index, scan in enumerate(scans):
+        if not isinstance(scan, dict):
+            rejected.append({"index": index, "ean": None, "error": "Scan must be an object."})
+            continue
+        ean = str(scan.get('ean') or '').strip()
+        size = str(scan.get('size') or '').strip()
+        try:
+            delta = int(scan.get('delta'))
+        except (TypeError, ValueError):
+            delta = 0
+        if not ean:
+            rejected.append({"index": index, "ean": None, "error": "EAN is required."})
+        elif isinstance(scan.get('delta'), bool) or not delta:
+            rejected.append({"index": index, "ean": ean, "error": "delta must be a non-zero integer."})
+        else:
+            accepted.append((index, ean, size, delta))
+    if not accepted:
+        return [], rejected
+
+    eans = {ean for _, ean, _, _ in accepted}
+    with transaction.atomic():
+        variants = {
+            eanc: (pp_id, product_id, brand_id)
+            for eanc, pp_id, product_id, brand_id in PartnerProduct.objects.filter(
+                partner=partner, eanc__in=eans,
+            ).values_list('eanc', 'id', 'product_id', 'product__brand_id')
+        }
+        accessories = {}
+        if eans - variants.keys():
+            accessories = dict(Accessories.objects.filter(
+                partner=partner, eanc__in=eans - variants.keys(),
+            ).values_list('eanc', 'id'))
+
+        # ("size", partner product id, type, value) or ("accessory", id) -> summed delta
+        deltas = {}
+        targets = []
+        for index, ean, size, delta in accepted:
+            if ean in variants:
+                if not size:
+                    rejected.append({"index": index, "ean": ean, "error": "Size is required for this product."})
+                    continue
+                key = ("size", variants[ean][0]) + parse_size(size)
+            elif ean in accessories:
+                key = ("accessory", accessories[ean])
+            else:
+                rejected.append({"index": index, "ean": ean, "error": "Unknown EAN."})
+                continue
+            deltas[key] = deltas.get(key, 0) + delta
+            targets.append((index, ean, size, key))
+
+        stock = {}
+        failed = {}
+        size_keys = [key for key in deltas if key[0] == "size"]
+        if size_keys:
+            stock = size_stock(size_keys)
+            missing = [key for key in size_keys if key not in stock]
+            for key in missing:
+                if deltas[key] < 0:
+                    failed[key] = "Size is not in stock."
+            new_keys = [key for key in missing if key not in failed]
+            if new_keys:
+                products = {pp_id: (product_id, brand_id) for pp_id, product_id, brand_id in variants.values()}
+                stock.update(add_sizes(new_keys, products, failed))
+
+        quantities = {}
+        size_deltas = {stock[key]: delta for key, delta in deltas.items() if key in stock}
+        if size_deltas:
+            PartnerProductSize.objects.filter(pk__in=size_deltas).update(quantity=shifted('quantity', size_deltas))
+            size_quantities = dict(PartnerProductSize.objects.filter(pk__in=size_deltas).values_list('id', 'quantity'))
+            quantities.update((key, size_quantities[pps_id]) for key, pps_id in stock.items() if key in deltas)
+            # Queryset updates send no post_save, refresh the listing like the signals would
+            product_ids = {pp_id: product_id for pp_id, product_id, _ in variants.values()}
+            schedule_listing_refresh({product_ids[key[1]] for key in quantities})
+
+        accessory_deltas = {key[1]: delta for key, delta in deltas.items() if key[0] == "accessory"}
+        if accessory_deltas:
+            Accessories.objects.filter(pk__in=accessory_deltas).update(
+                stock=shifted('stock', accessory_deltas), updated_at=timezone.now(),
+            )
+            quantities.update(
+                (("accessory", pk), quantity)
+                for pk, quantity in Accessories.objects.filter(pk__in=accessory_deltas).values_list('id', 'stock')
+            )
+
+    results = []
+    for index, ean, size, key in targets:
+        if key in failed:
+            rejected.append({"index": index, "ean": ean, "error": failed[key]})
+        else:
+            results.append({"index": index, "ean": ean, "size": size or None, "quantity": quantities[key]})
+    rejected.sort(key=lambda item: item["index"])
+    return results, rejected
+
+
+def size_stock(keys):
+    """PartnerProductSize id per ("size", partner product id, type, value) key that has one."""
+    wanted = set(keys)
+    stock = {}
+    for pps_id, pp_id, s_type, value in PartnerProductSize.objects.filter(
+        partner_product_id__in={key[1] for key in keys},
+    ).order_by('pk').values_list('id', 'partner_product_id', 'size__type', 'size__value'):
+        key = ("size", pp_id, s_type, value)
+        if key in wanted:
+            stock.setdefault(key, pps_id)
+    return stock
+
+
+def add_sizes(keys, products, failed):
+    """
+    Create empty PartnerProductSize rows for new sizes of variants, products
+    giving (product id, brand id) per partner product id. Sizes come from the
+    product's size tables, otherwise from its brand's tables, which makes
+    the variant local only as in the stock upload. Keys without a size are
+    added to failed.
+    """
+    # Another batch may be adding the same sizes
+    list(PartnerProduct.objects.select_for_update().filter(pk__in={key[1] for key in keys}).order_by('pk').values_list('pk'))
+    stock = size_stock(keys)
+    keys = [key for key in keys if key not in stock]
+    if not keys:
+        return stock
+
+    product_tables = {}
+    for product_id, table_id in ProductImage.sizes.through.objects.filter(
+        productimage__product_id__in={products[key[1]][0] for key in keys},
+    ).values_list('productimage__product_id', 'sizetable_id'):
+        product_tables.setdefault(product_id, set()).add(table_id)
+
+    # (type, value) -> [(table id, brand id, size id)], in the order the upload picks them
+    sizes = {}
+    for size_id, table_id, brand_id, s_type, value in Size.objects.filter(
+        type__in={key[2] for key in keys}, value__in={key[3] for key in keys},
+    ).order_by('type', 'insole_min_mm', 'pk').values_list('id', 'table_id', 'table__brand_id', 'type', 'value'):
+        sizes.setdefault((s_type, value), []).append((table_id, brand_id, size_id))
+
+    created = {}
+    local_only = set()
+    for key in keys:
+        _, pp_id, s_type, value = key
+        product_id, brand_id = products[pp_id]
+        candidates = sizes.get((s_type, value), [])
+        tables = product_tables.get(product_id, set())
+        size_id = next((size_id for table_id, _, size_id in candidates if table_id in tables), None)
+        if size_id is None:
+            size_id = next((size_id for _, table_brand_id, size_id in candidates if table_brand_id == brand_id), None)
+            if size_id is None:
+                failed[key] = f"Unknown size {s_type} {value} for this product."
+                continue
+            local_only.add(pp_id)
+        created[key] = PartnerProductSize(partner_product_id=pp_id, size_id=size_id, quantity=0)
+
+    PartnerProductSize.objects.bulk_create(created.values())
+    if local_only:
+        PartnerProduct.objects.filter(pk__in=local_only).update(online=False, updated_at=timezone.now())
+    stock.update((key, pps.pk) for key, pps in created.items())
+    return stock
@@ -0,0 +1,56 @@
+import logging
+from types import SimpleNamespace
+from django.core.cache import cache
+from core.versioning import get_versions, product_scope
+from .match_cache import match_cache
+from .matching import ScanProfile
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+DETAIL_CACHE_TIMEOUT = 60 * 60 * 24
+# Fields of the detail payload that differ per user, merged in per request
+USER_FIELDS = ('match_data', 'favourite')
+
+
+def cached_product_detail(product_id, load):
+    """
+    The user-independent part of a product's detail payload as
+    {"data": ..., "fit_version": ...}, cached under the product version,
+    which partner variant, stock, image, fit and Q&A changes bump.
+    `load()` builds it on a miss and returns None for a missing product.
+    """
+    versions = get_versions([product_scope(product_id)])
+    key = f"product-detail:{product_id}:{versions[product_scope(product_id)]}" if versions else None
+
+    if key:
+        try:
+            entry = cache.get(key)
+        except Exception as e:
+            logger.warning(f"Product detail cache read failed: {e}")
+            entry = None
+        if entry is not None:
+            return entry
+
+    entry = load()
+    if entry is not None and key:
+        try:
+            cache.set(key, entry, timeout=DETAIL_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Product detail cache write failed: {e}")
+    return entry
+
+
+def product_match_result(scan, product_id, fit_version):
+    """
+    Engine result of the product for the scan. Served from the match cache
+    without loading the product when it has been scored at this fit version.
+    """
+    if not scan:
+        return None
+    key = match_cache.key(SimpleNamespace(id=product_id, fit_version=fit_version), ScanProfile(scan))
+    result = match_cache.get(key)
+    if result is None:
+        product = Product.objects.filter(id=product_id).first()
+        result = product.match_with_scan(scan) if product else None
+    return result
@@ -0,0 +1,111 @@
+import json
+import logging
+import hashlib
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from .listing import catalog_version, size_sort_key
+from .models import Width
+
+logger = logging.getLogger(__name__)
+
+FACETS_TIMEOUT = 60 * 15
+# Query parameters that page or sort the listing without changing its rows
+NON_FILTER_PARAMS = {'limit', 'page', 'cursor', 'total', 'match'}
+FACETS = ('brand', 'gender', 'sub_category', 'color', 'width', 'size')
+
+
+# Rows of a JSON array column, as a FROM item named "elem" with a "value" column
+ARRAY_ELEMENTS = {
+    'postgresql': 'jsonb_array_elements_text(listing_rows.{column}) AS elem(value)',
+    'sqlite': 'json_each(listing_rows.{column}) AS elem',
+}
+
+
+def facet_counts(queryset):
+    """
+    Product counts per brand, gender, sub category, color, width and
+    in-stock EU size over the filtered ProductListing rows. Every facet is
+    a GROUP BY over the filtered rows, the array columns unnested, all in
+    one query, so only the counts leave the database.
+    """
+    counts = {facet: {} for facet in FACETS}
+    total = 0
+    try:
+        sql, params = queryset.order_by().values(
+            'brand_name', 'gender', 'sub_category_slug', 'color_names', 'width', 'eu_sizes'
+        ).query.sql_with_params()
+    except EmptyResultSet:
+        sql = None
+
+    if sql is not None:
+        connection = connections[queryset.db]
+        elements = ARRAY_ELEMENTS[connection.vendor]
+        q = connection.ops.quote_name
+        grouped = [
+            ('brand', q('brand_name'), 'listing_rows', None),
+            ('gender', q('gender'), 'listing_rows', None),
+            ('sub_category', q('sub_category_slug'), 'listing_rows', f"{q('sub_category_slug')} IS NOT NULL"),
+            ('color', 'elem.value', f"listing_rows, {elements.format(column=q('color_names'))}", None),
+            ('width', q('width'), 'listing_rows', None),
+            ('size', 'elem.value', f"listing_rows, {elements.format(column=q('eu_sizes'))}", None),
+        ]
+        selects = [
+            f"SELECT '{facet}', CAST({column} AS TEXT), COUNT(*) FROM {source}"
+            + (f" WHERE {where}" if where else "") + f" GROUP BY {column}"
+            for facet, column, source, where in grouped
+        ]
+        selects.append("SELECT 'count', NULL, COUNT(*) FROM listing_rows")
+        with connection.cursor() as cursor:
+            cursor.execute(f"WITH listing_rows AS ({sql}) " + " UNION ALL ".join(selects), params)
+            for facet, value, count in cursor.fetchall():
+                if facet == 'count':
+                    total = count
+                else:
+                    counts[facet][int(value) if facet == 'width' else value] = count
+
+    facets = {
+        facet: [{"value": value, "count": count} for value, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))]
+        for facet, counter in counts.items()
+    }
+    facets['width'] = [
+        {"value": width, "label": Width(width).label, "count": counts['width'][width]}
+        for width in sorted(counts['width'])
+    ]
+    facets['size'] = [
+        {"value": size, "count": counts['size'][size]}
+        for size in sorted(counts['size'], key=size_sort_key)
+    ]
+    return {"count": total, "facets": facets}
+
+
+def facet_signature(params):
+    """Stable hash of the filter state in the query parameters."""
+    items = sorted(
+        (key, value) for key in params if key not in NON_FILTER_PARAMS for value in params.getlist(key)
+    )
+    return hashlib.sha1(json.dumps(items).encode()).hexdigest()
+
+
+def cached_facet_counts(queryset, params):
+    """
+    facet_counts cached per filter signature under the catalog version, so
+    any listing refresh orphans every cached facet set at once.
+    """
+    version = catalog_version()
+    if version is None:
+        return facet_counts(queryset)
+
+    key = f"facets:v{version}:{facet_signature(params)}"
+    try:
+        result = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Facet cache read failed: {e}")
+        result = None
+    if result is None:
+        result = facet_counts(queryset)
+        try:
+            cache.set(key, result, timeout=FACETS_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Facet cache write failed: {e}")
+    return result
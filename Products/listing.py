@@ -0,0 +1,161 @@
+import threading
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+from .models import PartnerProduct, PartnerProductSize, Product, ProductImage, ProductListing
+from .search import search_backend
+from core.versioning import bump_versions, get_versions, product_scope
+
+LISTING_CHUNK_SIZE = 500
+CATALOG_SCOPE = 'catalog'
+
+
+def size_sort_key(value):
+    # EU sizes are strings like "42" or "42.5", anything else sorts last
+    try:
+        return (0, float(value.replace(',', '.')), value)
+    except ValueError:
+        return (1, 0, value)
+
+
+def bump_catalog_version(product_ids=()):
+    """Invalidate everything validated against the listing (facets, ETags), and the given products."""
+    bump_versions(CATALOG_SCOPE, *(product_scope(pid) for pid in product_ids))
+
+
+def catalog_version():
+    versions = get_versions([CATALOG_SCOPE])
+    return versions[CATALOG_SCOPE] if versions else None
+
+
+def build_listing_rows(product_ids):
+    """
+    ProductListing rows for the given products in five grouped queries.
+    Products that are inactive or have no active online variant get none.
+    """
+    from .serializers import ProductImageSerializer
+
+    products = Product.objects.filter(id__in=product_ids, is_active=True).select_related('brand', 'sub_category')
+    products = {p.id: p for p in products}
+    if not products:
+        return []
+
+    # Cheapest active online variant and color names per product
+    cheapest = {}
+    colors = {}
+    variants = PartnerProduct.objects.filter(
+        product_id__in=products, is_active=True, online=True
+    ).order_by('price', 'id').values_list('id', 'product_id', 'price', 'color__color')
+    for variant_id, product_id, price, color in variants:
+        cheapest.setdefault(product_id, (variant_id, price))
+        names = colors.setdefault(product_id, [])
+        if color not in names:
+            names.append(color)
+
+    stock = dict(PartnerProductSize.objects.filter(
+        partner_product__product_id__in=cheapest,
+        partner_product__is_active=True,
+        partner_product__online=True,
+    ).values('partner_product__product_id').annotate(total=Sum('quantity')).values_list(
+        'partner_product__product_id', 'total'
+    ))
+
+    eu_sizes = {}
+    in_stock = PartnerProductSize.objects.filter(
+        partner_product__product_id__in=cheapest,
+        partner_product__is_active=True,
+        partner_product__online=True,
+        quantity__gt=0,
+        size__type='EU',
+    ).values_list('partner_product__product_id', 'size__value').distinct()
+    for product_id, value in in_stock:
+        eu_sizes.setdefault(product_id, set()).add(value)
+
+    first_image_sq = ProductImage.objects.filter(
+        product=OuterRef('product')
+    ).order_by('created_at', 'id').values('id')[:1]
+    images = {
+        image.product_id: ProductImageSerializer(image).data
+        for image in ProductImage.objects.filter(
+            product_id__in=cheapest, id=Subquery(first_image_sq)
+        ).select_related('color')
+    }
+
+    rows = []
+    for product_id, (variant_id, price) in cheapest.items():
+        product = products[product_id]
+        rows.append(ProductListing(
+            product=product,
+            cheapest_variant_id=variant_id,
+            name=product.name,
+            gender=product.gender,
+            brand=product.brand,
+            brand_name=product.brand.name,
+            brand_image=product.brand.image.url if product.brand.image else None,
+            sub_category_slug=product.sub_category.slug if product.sub_category else None,
+            min_price=price,
+            color_names=sorted(colors[product_id]),
+            primary_image=images.get(product_id),
+            total_stock=stock.get(product_id) or 0,
+            width=product.width,
+            eu_sizes=sorted(eu_sizes.get(product_id, ()), key=size_sort_key),
+        ))
+    return rows
+
+
+def refresh_product_listings(product_ids):
+    """Rewrite the listing rows of the given products, dropping unlisted ones."""
+    product_ids = list(set(product_ids))
+    written = 0
+    for start in range(0, len(product_ids), LISTING_CHUNK_SIZE):
+        chunk = product_ids[start:start + LISTING_CHUNK_SIZE]
+        rows = build_listing_rows(chunk)
+        ProductListing.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=[
+                'cheapest_variant', 'name', 'gender', 'brand', 'brand_name', 'brand_image',
+                'sub_category_slug', 'min_price', 'color_names', 'primary_image', 'total_stock',
+                'width', 'eu_sizes', 'updated_at',
+            ],
+        )
+        listed = {row.product_id for row in rows}
+        ProductListing.objects.filter(product_id__in=chunk).exclude(product_id__in=listed).delete()
+        search_backend().index(chunk)
+        written += len(rows)
+    bump_catalog_version(product_ids)
+    return written
+
+
+def rebuild_product_listings():
+    """Rebuild the whole read model; returns (rows written, stale rows removed)."""
+    product_ids = list(Product.objects.filter(is_active=True).values_list('id', flat=True))
+    written = refresh_product_listings(product_ids)
+    removed, _ = ProductListing.objects.exclude(product_id__in=Product.objects.filter(is_active=True)).delete()
+    return written, removed
+
+
+# --- INCREMENTAL UPDATES ---
+_pending = threading.local()
+
+
+def schedule_listing_refresh(product_ids):
+    """
+    Refresh the listing rows of the products once the current transaction
+    commits; repeated changes to one product inside it refresh it once.
+    """
+    product_ids = {pid for pid in product_ids if pid}
+    if not product_ids:
+        return
+    if getattr(_pending, 'product_ids', None) is None:
+        _pending.product_ids = set()
+    _pending.product_ids.update(product_ids)
+    # The first callback to run takes the whole set, the others find it empty
+    transaction.on_commit(_flush_listing_refresh)
+
+
+def _flush_listing_refresh():
+    product_ids = getattr(_pending, 'product_ids', None)
+    _pending.product_ids = None
+    if product_ids:
+        refresh_product_listings(product_ids)
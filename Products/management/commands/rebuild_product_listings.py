@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from Products.listing import rebuild_product_listings
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized ProductListing table from products and partner variants."
+
+    def handle(self, *args, **options):
+        written, removed = rebuild_product_listings()
+        self.stdout.write(self.style.SUCCESS(f"{written} product listings written, {removed} stale removed."))
@@ -0,0 +1,84 @@
+import math
+import logging
+import threading
+from cachetools import LRUCache
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+LOCAL_CACHE_SIZE = 20000
+SHARED_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def scan_signature(profile):
+    """
+    Reduce a scan to what the scoring can actually tell apart.
+    Insole ranges and length bands are whole millimetres, so every length
+    strictly between n and n+1 scores the same; only an exact n differs.
+    """
+    length = profile.foot_length
+    whole = math.floor(length)
+    bucket = whole if length == whole else whole + 0.5
+    return f"{bucket}:{profile.width_category}:{profile.toe_box_category}"
+
+
+class MatchCache:
+    """
+    Two-tier cache for engine results keyed by (scoring model version,
+    product id, product fit_version, scan signature): an in-process LRU in
+    front of the shared Django cache (Redis). Bumping Product.fit_version or
+    activating a new MatchModel orphans old entries.
+    """
+
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE, timeout=SHARED_CACHE_TIMEOUT):
+        self.local = LRUCache(maxsize=maxsize)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    def key(self, product, profile):
+        return f"match:v{profile.scoring.version}:{product.id}:{product.fit_version}:{scan_signature(profile)}"
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                value = self.local.get(key)
+                if value is not None:
+                    found[key] = value
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            try:
+                shared = cache.get_many(missing)
+            except Exception as e:
+                logger.warning(f"Match cache read failed: {e}")
+                shared = {}
+            with self.lock:
+                for key, value in shared.items():
+                    self.local[key] = value
+            found.update(shared)
+        return found
+
+    def set_many(self, mapping):
+        if not mapping:
+            return
+        with self.lock:
+            for key, value in mapping.items():
+                self.local[key] = value
+        try:
+            cache.set_many(mapping, timeout=self.timeout)
+        except Exception as e:
+            logger.warning(f"Match cache write failed: {e}")
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def clear_local(self):
+        with self.lock:
+            self.local.clear()
+
+
+match_cache = MatchCache()
@@ -0,0 +1,74 @@
+from django.db.models import Case, When, Value, F, FloatField, OuterRef, Subquery
+from django.db.models.functions import Abs, Coalesce, Greatest
+from django.db.models.lookups import Exact, LessThanOrEqual
+from .matching import ScanProfile
+from .models import Size
+
+
+def length_points_expression(foot_length, scoring):
+    """Length points of a Size row, a step function of the deviation."""
+    deviation = Greatest(
+        F('insole_min_mm') - Value(foot_length),
+        Value(foot_length) - F('insole_max_mm'),
+        Value(0.0),
+        output_field=FloatField(),
+    )
+    return Case(
+        *[
+            When(LessThanOrEqual(deviation, float(band)), then=Value(float(points)))
+            for band, points in zip(scoring.length_bands, scoring.length_points)
+        ],
+        default=Value(float(scoring.length_points[-1])),
+        output_field=FloatField(),
+    )
+
+
+def best_length_subquery(foot_length, scoring, product_ref):
+    """Best length points over every size reachable from the product's images."""
+    sizes = Size.objects.filter(
+        table__product_images__product=product_ref
+    ).annotate(length_points=length_points_expression(foot_length, scoring))
+    return Subquery(sizes.order_by('-length_points').values('length_points')[:1], output_field=FloatField())
+
+
+def width_points_expression(width_category, scoring, width_field):
+    """Width points by distance between the foot and shoe width category."""
+    width_diff = Abs(F(width_field) - Value(width_category))
+    return Case(
+        *[
+            When(Exact(width_diff, diff), then=Value(float(points)))
+            for diff, points in enumerate(scoring.width_points)
+        ],
+        default=Value(float(scoring.width_points[-1])),
+        output_field=FloatField(),
+    )
+
+
+def toe_box_points_expression(toe_box_category, scoring, toe_box_field):
+    """Toe box points: all or nothing."""
+    return Case(
+        When(**{toe_box_field: toe_box_category}, then=Value(scoring.toe_box_points)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def match_score_expression(scan, product_field='product', scoring=None):
+    """
+    The match score (0-100) of a row's product as an ORM expression, the SQL
+    counterpart of Product.match_with_scan's "score". The best length points
+    come from a correlated subquery over sizes; products without any size
+    data score 0, like the Python scorer. Pass product_field=None for a
+    Product queryset.
+    """
+    profile = ScanProfile(scan, scoring)
+    scoring = profile.scoring
+    prefix = f'{product_field}__' if product_field else ''
+    best_length = best_length_subquery(profile.foot_length, scoring, OuterRef(product_field or 'pk'))
+    return Coalesce(
+        best_length
+        + width_points_expression(profile.width_category, scoring, f'{prefix}width')
+        + toe_box_points_expression(profile.toe_box_category, scoring, f'{prefix}toe_box'),
+        Value(0.0),
+        output_field=FloatField(),
+    )
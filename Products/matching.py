@@ -0,0 +1,457 @@
+import time
+import bisect
+import logging
+import numpy as np
+from django.core.cache import cache
+from .models import (
+    MatchModel, MatchScore, Product, ProductImage, Size,
+    default_length_bands, default_width_ratio_thresholds, default_toe_box_ratio_thresholds,
+)
+from .match_cache import match_cache, scan_signature
+from .size_index import size_index
+
+logger = logging.getLogger(__name__)
+
+MATERIALIZE_CHUNK_SIZE = 500
+
+ACTIVE_MODEL_KEY = 'match-model-active'
+ACTIVE_MODEL_CHECK_INTERVAL = 5  # seconds a process trusts its copy of the active model
+
+TOE_BOX_CODES = {"narrow": 0, "normal": 1, "wide": 2}
+TOE_BOX_CATEGORIES = ["narrow", "normal", "wide"]
+
+
+class Scoring:
+    """
+    Array form of one MatchModel version, the defaults being version 0:
+    Length (50%): full points inside the insole range, then one equal step
+    down per deviation band (4/8/12/16mm), 0 past the last band.
+    Width (30%): one equal step down per category between foot and shoe.
+    Toe box (20%): all or nothing.
+    """
+
+    def __init__(self, version=0, length_weight=50, width_weight=30, toe_box_weight=20,
+                 length_bands_mm=None, width_ratio_thresholds=None, toe_box_ratio_thresholds=None):
+        self.version = version
+        self.length_weight = float(length_weight)
+        self.width_weight = float(width_weight)
+        self.toe_box_weight = float(toe_box_weight)
+        self.length_bands_mm = list(length_bands_mm or default_length_bands())
+        self.width_ratio_thresholds = list(width_ratio_thresholds or default_width_ratio_thresholds())
+        self.toe_box_ratio_thresholds = list(toe_box_ratio_thresholds or default_toe_box_ratio_thresholds())
+
+        # Points are kept to one decimal like the reported scores, so the
+        # engine and the SQL expression add up exactly the same values.
+        # bands [0, 4, 8, 12, 16] -> points [50, 40, 30, 20, 10, 0]
+        self.length_bands = np.array([0, *self.length_bands_mm], dtype=np.float64)
+        steps = len(self.length_bands)
+        self.length_points = np.round(self.length_weight * np.arange(steps, -1, -1) / steps, 1)
+        # width distance 0..4 -> points [30, 22.5, 15, 7.5, 0]
+        categories = len(self.width_ratio_thresholds)
+        self.width_points = np.round(self.width_weight * np.arange(categories, -1, -1) / categories, 1)
+        self.toe_box_points = round(self.toe_box_weight, 1)
+
+    @property
+    def reach_mm(self):
+        """Deviation past which a size scores no length points."""
+        return float(self.length_bands[-1])
+
+    def width_category(self, ratio):
+        return bisect.bisect_right(self.width_ratio_thresholds, ratio)
+
+    def toe_box_category(self, ratio):
+        return TOE_BOX_CATEGORIES[bisect.bisect_right(self.toe_box_ratio_thresholds, ratio)]
+
+    def as_dict(self):
+        return {
+            "version": self.version,
+            "length_weight": self.length_weight,
+            "width_weight": self.width_weight,
+            "toe_box_weight": self.toe_box_weight,
+            "length_bands_mm": self.length_bands_mm,
+            "width_ratio_thresholds": self.width_ratio_thresholds,
+            "toe_box_ratio_thresholds": self.toe_box_ratio_thresholds,
+        }
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(
+            version=model.version,
+            length_weight=model.length_weight,
+            width_weight=model.width_weight,
+            toe_box_weight=model.toe_box_weight,
+            length_bands_mm=model.length_bands_mm,
+            width_ratio_thresholds=model.width_ratio_thresholds,
+            toe_box_ratio_thresholds=model.toe_box_ratio_thresholds,
+        )
+
+
+_active = {"scoring": None, "checked_at": 0}
+
+
+def active_scoring():
+    """
+    The live scoring model. Each process re-reads it from the shared cache
+    every few seconds and falls back to the database (or the defaults).
+    """
+    now = time.monotonic()
+    if _active["scoring"] is not None and now - _active["checked_at"] < ACTIVE_MODEL_CHECK_INTERVAL:
+        return _active["scoring"]
+
+    try:
+        config = cache.get(ACTIVE_MODEL_KEY)
+    except Exception as e:
+        logger.warning(f"Active match model read failed: {e}")
+        config = None
+    if config is None:
+        model = MatchModel.objects.filter(status=MatchModel.Status.ACTIVE).first()
+        config = (Scoring.from_model(model) if model else Scoring()).as_dict()
+        publish_scoring(config)
+
+    scoring = _active["scoring"]
+    if scoring is None or scoring.as_dict() != config:
+        scoring = Scoring(**config)
+    _active.update(scoring=scoring, checked_at=now)
+    return scoring
+
+
+def publish_scoring(config):
+    try:
+        cache.set(ACTIVE_MODEL_KEY, config, timeout=None)
+    except Exception as e:
+        logger.warning(f"Active match model write failed: {e}")
+
+
+def live_scorings():
+    """The active model plus a version being warmed up, if any."""
+    scorings = [active_scoring()]
+    for model in MatchModel.objects.filter(status=MatchModel.Status.WARMING):
+        if model.version != scorings[0].version:
+            scorings.append(Scoring.from_model(model))
+    return scorings
+
+
+class ScanProfile:
+    """The scan values the scoring depends on, derived once per scan and model."""
+
+    def __init__(self, scan, scoring=None):
+        self.scoring = scoring or active_scoring()
+        self.foot_length = scan.max_length()
+        self.width_category = scan.width_category(self.scoring.width_ratio_thresholds)
+        self.toe_box_category = scan.toe_box_category(self.scoring.toe_box_ratio_thresholds)
+
+    @property
+    def toe_box_code(self):
+        return TOE_BOX_CODES.get(self.toe_box_category, -1)
+
+
+class FitMatrix:
+    """
+    Insole ranges of a whole candidate set laid out in contiguous arrays.
+    Rows of one product are adjacent and keep the order match_with_scan
+    walks them in (images -> size tables -> sizes), so ties rank the same.
+    """
+
+    def __init__(self):
+        self.product_ids = []
+        self.offsets = [0]
+        self.labels = []
+        self._widths = []
+        self._toe_boxes = []
+        self._mins = []
+        self._maxs = []
+
+    def add_product(self, product, sizes):
+        self.product_ids.append(product.id)
+        self._widths.append(product.width)
+        self._toe_boxes.append(TOE_BOX_CODES.get(product.toe_box, -1))
+        for size_type, size_value, min_mm, max_mm in sizes:
+            self.labels.append((size_type, size_value))
+            self._mins.append(min_mm)
+            self._maxs.append(max_mm)
+        self.offsets.append(len(self.labels))
+
+    def freeze(self):
+        counts = np.diff(np.asarray(self.offsets, dtype=np.int64))
+        self.owner = np.repeat(np.arange(len(self.product_ids)), counts)
+        self.widths = np.asarray(self._widths, dtype=np.int64)
+        self.toe_boxes = np.asarray(self._toe_boxes, dtype=np.int64)
+        self.mins = np.asarray(self._mins, dtype=np.float64)
+        self.maxs = np.asarray(self._maxs, dtype=np.float64)
+        return self
+
+    @classmethod
+    def from_product(cls, product):
+        """Build a single-product matrix from its stored fit profile."""
+        return cls.from_products([product])
+
+    @classmethod
+    def from_products(cls, products):
+        """Build the matrix from stored fit profiles, no size queries once built."""
+        products = list({p.id: p for p in products}.values())
+        ensure_fit_profiles(products)
+        matrix = cls()
+        for product in products:
+            matrix.add_product(product, [size[1:] for size in product.fit_profile])
+        return matrix.freeze()
+
+
+# --- FIT PROFILES ---
+def build_fit_profiles(product_ids):
+    """
+    Walk images -> size tables -> sizes for many products in two queries.
+    Returns {product_id: [[size_id, type, value, min_mm, max_mm], ...]} in
+    image order, with repeated size tables and identical sizes dropped.
+    """
+    links = ProductImage.sizes.through.objects.filter(
+        productimage__product_id__in=product_ids
+    ).order_by(
+        'productimage__product_id', 'productimage__created_at', 'productimage_id', 'id'
+    ).values_list('productimage__product_id', 'sizetable_id')
+
+    tables_by_product = {}
+    for product_id, table_id in links:
+        tables = tables_by_product.setdefault(product_id, [])
+        if table_id not in tables:
+            tables.append(table_id)
+
+    table_ids = {t for tables in tables_by_product.values() for t in tables}
+    sizes_by_table = {}
+    if table_ids:
+        rows = Size.objects.filter(table_id__in=table_ids).values_list(
+            'table_id', 'id', 'type', 'value', 'insole_min_mm', 'insole_max_mm'
+        )
+        for table_id, *size in rows:
+            sizes_by_table.setdefault(table_id, []).append(size)
+
+    profiles = {}
+    for product_id in product_ids:
+        profile = []
+        seen = set()
+        for table_id in tables_by_product.get(product_id, []):
+            for size in sizes_by_table.get(table_id, []):
+                if tuple(size[1:]) not in seen:
+                    seen.add(tuple(size[1:]))
+                    profile.append(size)
+        profiles[product_id] = profile
+    return profiles
+
+
+def refresh_fit_profiles(product_ids):
+    """Rebuild and store the fit profile of the given products."""
+    profiles = build_fit_profiles(list(product_ids))
+    Product.objects.bulk_update(
+        [Product(id=product_id, fit_profile=profile) for product_id, profile in profiles.items()],
+        ['fit_profile'],
+        batch_size=MATERIALIZE_CHUNK_SIZE,
+    )
+    return profiles
+
+
+def ensure_fit_profiles(products):
+    """Build the profiles of products stored before fit profiles existed."""
+    missing = [p for p in products if p.fit_profile is None]
+    if missing:
+        profiles = refresh_fit_profiles([p.id for p in missing])
+        for product in missing:
+            product.fit_profile = profiles[product.id]
+
+
+def score_matrix(matrix, profile):
+    """Return the total score (0-100) of every size row in the matrix."""
+    # 1. LENGTH per size, 2. WIDTH and 3. TOE BOX per product, broadcast to its sizes
+    length_points = _length_points(matrix.mins, matrix.maxs, profile)
+    product_points = _product_points(matrix.widths, matrix.toe_boxes, profile)
+    return length_points + product_points[matrix.owner]
+
+
+def _length_points(mins, maxs, profile):
+    """Step down from the distance to the nearest edge of the insole range, 0 inside it."""
+    foot_length = profile.foot_length
+    scoring = profile.scoring
+    deviation = np.maximum(np.maximum(mins - foot_length, foot_length - maxs), 0)
+    return scoring.length_points[np.searchsorted(scoring.length_bands, deviation, side='left')]
+
+
+def _product_points(widths, toe_boxes, profile):
+    scoring = profile.scoring
+    width_diff = np.minimum(np.abs(widths - profile.width_category), len(scoring.width_points) - 1)
+    return scoring.width_points[width_diff] + np.where(
+        toe_boxes == profile.toe_box_code, scoring.toe_box_points, 0
+    )
+
+
+def rank_matrix(matrix, profile, top=3):
+    """
+    Score every size and rank them per product.
+    Returns {product_id: {"score", "recommended_sizes", "size_scores"}}.
+    """
+    results = {}
+    if not matrix.product_ids:
+        return results
+
+    points = score_matrix(matrix, profile)
+    # Group by product, best score first, original order breaks ties
+    order = np.lexsort((np.arange(len(points)), -points, matrix.owner))
+    scores = points[order].tolist()
+    rows = order.tolist()
+
+    for index, product_id in enumerate(matrix.product_ids):
+        start, end = matrix.offsets[index], matrix.offsets[index + 1]
+        size_scores = []
+        recommended = []
+        for position in range(start, end):
+            size_type, size_value = matrix.labels[rows[position]]
+            score = round(scores[position], 1)
+            size_scores.append({"size": f"{size_type} {size_value}", "score": score})
+            if position - start < top:
+                recommended.append({
+                    'size_value': size_value,
+                    'size_type': size_type,
+                    'total_score': score
+                })
+        results[product_id] = {
+            "score": size_scores[0]["score"] if size_scores else 0,
+            "recommended_sizes": recommended,
+            "size_scores": size_scores,
+        }
+    return results
+
+
+def match_products(scan, products):
+    """
+    Batch counterpart of Product.match_with_scan for a candidate set.
+    Cached results are reused, only the misses are loaded and scored.
+    """
+    if not scan:
+        return {}
+    profile = ScanProfile(scan)
+    products = list({p.id: p for p in products}.values())
+    keys = {p.id: match_cache.key(p, profile) for p in products}
+
+    cached = match_cache.get_many(list(keys.values()))
+    results = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+
+    missing = [p for p in products if p.id not in results]
+    if missing:
+        computed = rank_matrix(FitMatrix.from_products(missing), profile)
+        match_cache.set_many({keys[product_id]: result for product_id, result in computed.items()})
+        results.update(computed)
+    return results
+
+
+def best_scores(scan, products):
+    """
+    Best match score per product, computed only from the sizes the insole
+    range index says can reach the foot length. Sizes further than the last
+    length band score the same length points (0) everywhere, so the best
+    size always comes from the reachable set unless it is empty.
+    """
+    if not scan:
+        return {}
+    profile = ScanProfile(scan)
+    products = list({p.id: p for p in products}.values())
+    if not products:
+        return {}
+
+    index = size_index.fresh()
+    product_ids, _, mins, maxs = index.reachable(profile.foot_length, profile.scoring.reach_mm)
+    length_points = _length_points(mins, maxs, profile)
+
+    # Best reachable length points per product
+    reachable_ids, owner = np.unique(product_ids, return_inverse=True)
+    best_length = np.zeros(len(reachable_ids), dtype=np.float64)
+    np.maximum.at(best_length, owner, length_points)
+    best_length = dict(zip(reachable_ids.tolist(), best_length.tolist()))
+
+    widths = np.asarray([p.width for p in products], dtype=np.int64)
+    toe_boxes = np.asarray([TOE_BOX_CODES.get(p.toe_box, -1) for p in products], dtype=np.int64)
+    product_points = _product_points(widths, toe_boxes, profile).tolist()
+
+    results = {}
+    for product, points in zip(products, product_points):
+        if product.id in best_length:
+            results[product.id] = round(best_length[product.id] + points, 1)
+        elif index.has_sizes(product.id):
+            results[product.id] = round(points, 1)
+        else:
+            results[product.id] = 0
+    return results
+
+
+# --- MATERIALIZED SCORES ---
+def _match_score_rows(scan, results, profile):
+    return [
+        MatchScore(
+            foot_scan=scan,
+            product_id=product_id,
+            model_version=profile.scoring.version,
+            score=result["score"],
+            recommended_sizes=result["recommended_sizes"],
+            size_scores=result["size_scores"],
+        )
+        for product_id, result in results.items()
+    ]
+
+
+def _upsert_match_scores(rows):
+    MatchScore.objects.bulk_create(
+        rows,
+        batch_size=MATERIALIZE_CHUNK_SIZE,
+        update_conflicts=True,
+        unique_fields=['foot_scan', 'product', 'model_version'],
+        update_fields=['score', 'recommended_sizes', 'size_scores', 'updated_at'],
+    )
+
+
+def materialize_scan(scan, products, scoring=None):
+    """(Re)write the MatchScore rows of one scan for the given products."""
+    profile = ScanProfile(scan, scoring)
+    written = 0
+    chunk = []
+    for product in products:
+        chunk.append(product)
+        if len(chunk) == MATERIALIZE_CHUNK_SIZE:
+            written += _materialize_chunk(scan, profile, chunk)
+            chunk = []
+    if chunk:
+        written += _materialize_chunk(scan, profile, chunk)
+    return written
+
+
+def _materialize_chunk(scan, profile, products):
+    results = rank_matrix(FitMatrix.from_products(products), profile)
+    rows = _match_score_rows(scan, results, profile)
+    _upsert_match_scores(rows)
+    return len(rows)
+
+
+def materialize_products(products, scans, scoring=None, warm_cache=False):
+    """
+    Re-score the given products for every scan, loading their sizes once.
+    With warm_cache the results also go to the match cache, once per
+    distinct scan signature.
+    """
+    scoring = scoring or active_scoring()
+    products = list({p.id: p for p in products}.values())
+    matrix = FitMatrix.from_products(products)
+    warmed = set()
+    written = 0
+    rows = []
+    for scan in scans:
+        profile = ScanProfile(scan, scoring)
+        results = rank_matrix(matrix, profile)
+        rows.extend(_match_score_rows(scan, results, profile))
+        if warm_cache and scan_signature(profile) not in warmed:
+            warmed.add(scan_signature(profile))
+            match_cache.set_many({
+                match_cache.key(product, profile): results[product.id] for product in products
+            })
+        if len(rows) >= MATERIALIZE_CHUNK_SIZE:
+            _upsert_match_scores(rows)
+            written += len(rows)
+            rows = []
+    if rows:
+        _upsert_match_scores(rows)
+        written += len(rows)
+    return written
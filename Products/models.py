@@ -1,11 +1,16 @@
 import uuid
 from django.db import models
+from django.db.models import Q
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth import get_user_model
 from django.forms import ValidationError
 User = get_user_model()
 from cloudinary_storage.storage import MediaCloudinaryStorage
 from Accounts.models import *
 from Brands.models import Brand
+from core.metrics import timed
 
 # Create your models here.
 
@@ -106,6 +111,12 @@ class Product(models.Model):
     # Commerce    # stock_quantity = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
 
+    # Bumped whenever size tables, sizes, width or toe box change (match cache key)
+    fit_version = models.PositiveIntegerField(default=0, editable=False)
+    # Deduplicated [size_id, type, value, insole_min_mm, insole_max_mm] rows
+    # reachable through the images, kept in sync by signals (None = not built)
+    fit_profile = models.JSONField(null=True, blank=True, editable=False)
+
     features = models.ManyToManyField(Features, help_text="Type text to search features",null=True,blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -116,7 +127,15 @@ class Product(models.Model):
     def __str__(self):
         return f"{self.brand.name} - {self.name}"
 
+    def get_fit_profile(self):
+        """Size rows of the product, built on first use for older products."""
+        if self.fit_profile is None:
+            from .matching import ensure_fit_profiles
+            ensure_fit_profiles([self])
+        return self.fit_profile
+
     # --- IMPROVED MATCHING LOGIC ---   
+    @timed('match_with_scan')
     def match_with_scan(self, scan):
         if not scan:
             return {
@@ -127,134 +146,37 @@ class Product(models.Model):
                 "warnings": ["No foot scan data available"]
             }
 
-        # Use the larger foot for sizing
-        foot_length = scan.max_length()
-        foot_width = scan.max_width()
-        
-        warnings = []
-        size_recommendations = []
-        all_size_scores = []  # Store scores for ALL sizes
-        
-        # --- GET ALL SIZES ---
-        all_sizes = []
-        seen_size_tables = set()
-        
-        # Use ProductImage sizes instead
-        for image in self.images.all():
-            for size_table in image.sizes.all():
-                if size_table.id in seen_size_tables:
-                    continue
-                seen_size_tables.add(size_table.id)
-                
-                sizes = size_table.sizes.all()
-                for size in sizes:
-                    all_sizes.append({
-                        'size': size,
-                        'table': size_table,
-                        'min_length': size.insole_min_mm,
-                        'max_length': size.insole_max_mm,
-                    })
+        # Scoring runs on the vectorized engine, see Products/matching.py
+        from .matching import FitMatrix, ScanProfile, rank_matrix
+        from .match_cache import match_cache
+
+        profile = ScanProfile(scan)
+        cache_key = match_cache.key(self, profile)
+        result = match_cache.get(cache_key)
+        if result is None:
+            matrix = FitMatrix.from_product(self)
+            result = rank_matrix(matrix, profile)[self.id]
+            match_cache.set(cache_key, result)
         
-        if not all_sizes:
-            warnings.append("No size data available for this product")
+        if not result["size_scores"]:
             return {
                 "score": 0,
                 "recommended_sizes": [],
                 "size_scores": [],
                 "fit_analysis": {},
-                "warnings": warnings
-            }
-        
-        # --- CALCULATE SCORE FOR EACH SIZE ---
-        for size_info in all_sizes:
-            size_min = size_info['min_length']
-            size_max = size_info['max_length']
-            size_value = size_info['size'].value
-            size_type = size_info['size'].type
-            
-            # 1. LENGTH SCORING (50%)
-            if size_min <= foot_length <= size_max:
-                length_score = 1.0  # 100%
-            else:
-                if foot_length < size_min:
-                    deviation = size_min - foot_length
-                else:
-                    deviation = foot_length - size_max
-                
-                if deviation <= 4:
-                    length_score = 0.8  # 80%
-                elif deviation <= 8:
-                    length_score = 0.6  # 60%
-                elif deviation <= 12:
-                    length_score = 0.4  # 40%
-                elif deviation <= 16:
-                    length_score = 0.2  # 20%
-                else:
-                    length_score = 0.0  # 0%
-            
-            # 2. WIDTH SCORING (30%)
-            foot_width_category = scan.width_category()
-            product_width = self.width
-            width_diff = abs(foot_width_category - product_width)
-            
-            if width_diff == 0:
-                width_score = 1.0   # 100%
-            elif width_diff == 1:
-                width_score = 0.75  # 75%
-            elif width_diff == 2:
-                width_score = 0.5   # 50%
-            elif width_diff == 3:
-                width_score = 0.25  # 25%
-            else:
-                width_score = 0.0   # 0%
-            
-            # 3. TOE BOX SCORING (20%)
-            foot_toe_box = scan.toe_box_category()
-            product_toe_box = self.toe_box
-            
-            if foot_toe_box == product_toe_box:
-                toe_box_score = 1.0  # 100%
-            else:
-                toe_box_score = 0.0  # 0%
-            
-            # CALCULATE TOTAL SCORE FOR THIS SIZE
-            total_size_score = (length_score * 50) + (width_score * 30) + (toe_box_score * 20)
-            
-            # ✅ STORE ONLY SIZE AND SCORE
-            size_score_info = {
-                "size": f"{size_type} {size_value}",
-                "score": round(total_size_score, 1)
+                "warnings": ["No size data available for this product"]
             }
-            
-            all_size_scores.append(size_score_info)
-            
-            # Also add to recommendations for top 3
-            size_rec = {
-                'size_value': size_value,
-                'size_type': size_type,
-                'total_score': round(total_size_score, 1)
-            }
-            
-            size_recommendations.append(size_rec)
-        
-        # --- FINAL CALCULATIONS ---
-        # Sort by score (highest first)
-        all_size_scores.sort(key=lambda x: -x['score'])
-        size_recommendations.sort(key=lambda x: -x['total_score'])
-        
-        # Get top 3 recommendations
-        top_recommendations = size_recommendations[:3]
-        
-        # Overall product score = best size score
-        overall_score = all_size_scores[0]['score'] if all_size_scores else 0
-        
-        # Build fit analysis
+
+        return self.build_match_result(scan, profile, result)
+
+    def build_match_result(self, scan, profile, result):
+        """Wrap an engine result with the fit analysis shown to the customer."""
         fit_analysis = {
             'foot_measurements': {
-                'length': f"{foot_length:.1f}mm",
-                'width': f"{foot_width:.1f}mm",
-                'width_category': Width(scan.width_category()).label,
-                'toe_box_category': scan.toe_box_category().capitalize()
+                'length': f"{profile.foot_length:.1f}mm",
+                'width': f"{scan.max_width():.1f}mm",
+                'width_category': Width(profile.width_category).label,
+                'toe_box_category': profile.toe_box_category.capitalize()
             },
             'shoe_specs': {
                 'width': Width(self.width).label,
@@ -263,11 +185,11 @@ class Product(models.Model):
         }
         
         return {
-            "score": overall_score,  # Overall product score
-            "recommended_sizes": top_recommendations,  # Top 3 sizes
-            "size_scores": all_size_scores,  # ✅ ONLY size and score for all sizes
+            "score": result["score"],  # Overall product score = best size score
+            "recommended_sizes": result["recommended_sizes"],  # Top 3 sizes
+            "size_scores": result["size_scores"],  # ✅ ONLY size and score for all sizes
             "fit_analysis": fit_analysis,
-            "warnings": warnings if warnings else ["Excellent match!"]
+            "warnings": ["Excellent match!"]
         }
 
 class ProductImage(models.Model):
@@ -322,6 +244,18 @@ class PartnerProduct(models.Model):
     class Meta:
         unique_together = ('partner', 'product', 'color')
         ordering = ['-created_at']
+        constraints = [
+            # One variant per EAN and partner, the barcode scans look them up by it
+            models.UniqueConstraint(
+                fields=['partner', 'eanc'],
+                condition=Q(eanc__isnull=False) & ~Q(eanc=''),
+                name='unique_partner_product_ean',
+            ),
+        ]
+        indexes = [
+            # EAN lookups across partners, see ProductNameMatcher.match_eans()
+            models.Index(fields=['eanc'], condition=Q(eanc__isnull=False), name='partner_product_ean_idx'),
+        ]
     
     @property
     def total_stock_quantity(self):
@@ -349,4 +283,207 @@ class Favorite(models.Model):
         ordering = ['-added_at']
 
     def __str__(self):
-        return f"{self.user.email}'s favorites"
\ No newline at end of file
+        return f"{self.user.email}'s favorites"
+
+class MatchScore(models.Model):
+    """Materialized match_with_scan result for one foot scan and product"""
+    foot_scan = models.ForeignKey('Others.FootScan', on_delete=models.CASCADE, related_name='match_scores')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='match_scores')
+    model_version = models.PositiveIntegerField(default=0, help_text="MatchModel version that produced the score")
+    score = models.FloatField(default=0)
+    recommended_sizes = models.JSONField(default=list, blank=True)
+    size_scores = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('foot_scan', 'product', 'model_version')
+        indexes = [models.Index(fields=['foot_scan', 'model_version', '-score'])]
+
+    def __str__(self):
+        return f"{self.foot_scan_id} - {self.product_id} - {self.score}"
+
+
+def default_length_bands():
+    return [4, 8, 12, 16]
+
+def default_width_ratio_thresholds():
+    return [0.37, 0.39, 0.41, 0.43]
+
+def default_toe_box_ratio_thresholds():
+    return [0.38, 0.42]
+
+class MatchModel(models.Model):
+    """
+    Versioned scoring configuration for foot scan matching.
+    Activating a version re-scores materialized and cached results in the
+    background; the previous version keeps serving until that is done.
+    """
+    class Status(models.TextChoices):
+        DRAFT = "draft", "Draft"
+        WARMING = "warming", "Warming"
+        ACTIVE = "active", "Active"
+        RETIRED = "retired", "Retired"
+        FAILED = "failed", "Failed"
+
+    version = models.PositiveIntegerField(unique=True)
+    notes = models.CharField(max_length=200, blank=True)
+
+    length_weight = models.FloatField(default=50, help_text="Points for a size whose insole range fits the foot")
+    width_weight = models.FloatField(default=30, help_text="Points for an exact width category match")
+    toe_box_weight = models.FloatField(default=20, help_text="Points for a matching toe box")
+    length_bands_mm = models.JSONField(
+        default=default_length_bands,
+        help_text="Deviation steps in mm, each one costs an equal share of the length points, e.g. [4, 8, 12, 16]"
+    )
+    width_ratio_thresholds = models.JSONField(
+        default=default_width_ratio_thresholds,
+        help_text="Four width/length ratios splitting Narrow .. Wide, e.g. [0.37, 0.39, 0.41, 0.43]"
+    )
+    toe_box_ratio_thresholds = models.JSONField(
+        default=default_toe_box_ratio_thresholds,
+        help_text="Two width/length ratios splitting narrow / normal / wide toe box, e.g. [0.38, 0.42]"
+    )
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.DRAFT, editable=False)
+    pending_batches = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped by every activation, re-score batches of an earlier one are ignored
+    warming_run = models.PositiveIntegerField(default=0, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-version']
+
+    def clean(self):
+        bands = self.length_bands_mm
+        # Whole millimetres like the insole ranges, scan_signature() relies on it
+        if not bands or any(not isinstance(b, int) or isinstance(b, bool) or b <= 0 for b in bands) or bands != sorted(bands):
+            raise ValidationError({"length_bands_mm": "Give increasing positive whole millimetre values."})
+        if len(self.width_ratio_thresholds or []) != len(Width.values) - 1 or self.width_ratio_thresholds != sorted(self.width_ratio_thresholds):
+            raise ValidationError({"width_ratio_thresholds": f"Give {len(Width.values) - 1} increasing ratios."})
+        if len(self.toe_box_ratio_thresholds or []) != len(ToeBox.values) - 1 or self.toe_box_ratio_thresholds != sorted(self.toe_box_ratio_thresholds):
+            raise ValidationError({"toe_box_ratio_thresholds": f"Give {len(ToeBox.values) - 1} increasing ratios."})
+
+    def activate(self):
+        """
+        Start re-scoring with this version; it goes live once that finishes.
+        A failed version can be activated again, which starts over.
+        """
+        from django.db import transaction
+        from django.db.models import F
+        from .tasks import activate_match_model
+
+        MatchModel.objects.filter(pk=self.pk).update(
+            status=self.Status.WARMING, pending_batches=0, warming_run=F('warming_run') + 1
+        )
+        self.refresh_from_db(fields=['status', 'pending_batches', 'warming_run'])
+        model_id, run = self.pk, self.warming_run
+        transaction.on_commit(lambda: activate_match_model.delay(model_id, run))
+
+    def abort_warming(self):
+        """Mark a warming version failed, e.g. when a worker died during its re-score."""
+        MatchModel.objects.filter(pk=self.pk, status=self.Status.WARMING).update(
+            status=self.Status.FAILED, pending_batches=0
+        )
+        self.refresh_from_db(fields=['status', 'pending_batches'])
+
+    def __str__(self):
+        return f"Match model v{self.version} ({self.get_status_display()})"
+
+class ProductListing(models.Model):
+    """
+    Denormalized catalog row per active product with at least one active
+    online variant, read by the customer listing. Kept in sync by signals,
+    rebuilt with `manage.py rebuild_product_listings`.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='listing')
+    cheapest_variant = models.ForeignKey(PartnerProduct, on_delete=models.SET_NULL, null=True, related_name='+')
+    name = models.CharField(max_length=200)
+    gender = models.CharField(max_length=20)
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name='+')
+    brand_name = models.CharField(max_length=100)
+    brand_image = models.URLField(max_length=500, blank=True, null=True)
+    sub_category_slug = models.SlugField(blank=True, null=True)
+    min_price = models.DecimalField(max_digits=12, decimal_places=2)
+    color_names = models.JSONField(default=list, blank=True)
+    primary_image = models.JSONField(null=True, blank=True)
+    total_stock = models.PositiveIntegerField(default=0)
+    width = models.IntegerField(choices=Width.choices, default=Width.NORMAL)
+    eu_sizes = models.JSONField(default=list, blank=True, help_text="EU sizes in stock online")
+    # name, brand and description for full-text search, see Products/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-product']
+        indexes = [
+            models.Index(fields=['sub_category_slug', 'gender']),
+            models.Index(fields=['brand_name']),
+        ]
+
+    def __str__(self):
+        return f"Listing of {self.name}"
+
+def stock_import_storage():
+    return FileSystemStorage(location=settings.STOCK_IMPORT_ROOT)
+
+class ImportJob(models.Model):
+    """
+    A partner stock upload processed in the background by run_import_job.
+    Progress, summary counters and the first skipped rows are saved after
+    every chunk; the report lists every skipped row once the job ends.
+    """
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        COMPLETED = "completed", "Completed"
+        FAILED = "failed", "Failed"
+
+    partner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    warehouse = models.ForeignKey('Others.Warehouse', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    file = models.FileField(upload_to='uploads/', storage=stock_import_storage)
+    file_name = models.CharField(max_length=255)
+    file_hash = models.CharField(max_length=64, help_text="SHA-256 of the uploaded file")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    total_rows = models.PositiveIntegerField(null=True, blank=True)
+    processed_rows = models.PositiveIntegerField(default=0)
+    matched_columns = models.JSONField(default=dict, blank=True)
+    summary = models.JSONField(default=dict, blank=True)
+    skipped_details = models.JSONField(default=list, blank=True)
+    report = models.FileField(upload_to='reports/', storage=stock_import_storage, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['partner', 'warehouse', 'file_hash']),
+        ]
+        # One unfinished job per file and warehouse against concurrent uploads,
+        # finished ones are left out so a deleted warehouse (SET_NULL) never collides
+        constraints = [
+            models.UniqueConstraint(
+                fields=['partner', 'warehouse', 'file_hash'],
+                condition=Q(warehouse__isnull=False, status__in=['pending', 'running']),
+                name='unique_unfinished_import_per_warehouse',
+            ),
+            models.UniqueConstraint(
+                fields=['partner', 'file_hash'],
+                condition=Q(warehouse__isnull=True, status__in=['pending', 'running']),
+                name='unique_unfinished_import',
+            ),
+        ]
+
+    @property
+    def progress(self):
+        """Percentage of rows processed, None while the row count is unknown."""
+        if self.status == self.Status.COMPLETED:
+            return 100
+        if not self.total_rows:
+            return None
+        return min(100, round(self.processed_rows * 100 / self.total_rows))
+
+    def __str__(self):
+        return f"Import {self.file_name} ({self.get_status_display()})"
@@ -0,0 +1,138 @@
+import re
+import math
+import unicodedata
+from collections import defaultdict
+from django.db.models import Q
+from .models import PartnerProduct, Product
+
+# Lowest trigram similarity accepted for a fuzzy name match
+FUZZY_MATCH_THRESHOLD = 0.6
+
+
+def normalize_name(name):
+    """Case, accent, punctuation and spacing insensitive form of a product name."""
+    name = unicodedata.normalize('NFKD', str(name)).casefold()
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[^\W_]+', name))
+
+
+def name_trigrams(normalized):
+    """Trigrams of each word, padded the way pg_trgm pads them."""
+    trigrams = set()
+    for word in normalized.split():
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def number_tokens(normalized):
+    """Words with digits: model numbers, which a fuzzy match must not change ("Shoe 1" is not "Shoe 10")."""
+    return frozenset(word for word in normalized.split() if any(c.isdigit() for c in word))
+
+
+class ProductNameMatcher:
+    """
+    In-memory product matcher for stock imports, built once per import.
+    Names match exactly on their normalized form, otherwise on trigram
+    similarity (as pg_trgm computes it) over the products of the partner's
+    brands: the best score at or above the threshold wins, ties go to the
+    product added first, so results do not depend on query order.
+    Products are identified by the keys they were added with.
+
+    Fuzzy candidates only come from products with the same model numbers,
+    and from the rarest trigrams of the name: a product sharing none of
+    them cannot reach the threshold, so common trigrams are never scanned.
+    """
+
+    def __init__(self, partner=None, threshold=FUZZY_MATCH_THRESHOLD):
+        self.partner = partner
+        self.threshold = threshold
+        self.exact = {}
+        # (key, trigrams) per fuzzy-matchable product
+        self.entries = []
+        # number tokens -> trigram -> entry indexes
+        self.postings = defaultdict(lambda: defaultdict(list))
+
+    @classmethod
+    def for_partner(cls, partner, threshold=FUZZY_MATCH_THRESHOLD):
+        """
+        Matcher over the active catalog and the products the partner already
+        carries. Fuzzy matches are limited to the brands the partner carries,
+        or open to the whole catalog for a partner without products yet.
+        """
+        matcher = cls(partner, threshold)
+        carried = PartnerProduct.objects.filter(partner=partner).values('product_id')
+        brand_ids = set(Product.objects.filter(id__in=carried).values_list('brand_id', flat=True))
+        others = []
+        for product_id, name, brand_id in Product.objects.filter(
+            Q(is_active=True) | Q(id__in=carried),
+        ).order_by('id').values_list('id', 'name', 'brand_id').iterator(chunk_size=2000):
+            if not brand_ids or brand_id in brand_ids:
+                matcher.add(product_id, name)
+            else:
+                others.append((product_id, name))
+        # Exact names of other brands still match, after the partner's own
+        for product_id, name in others:
+            matcher.add(product_id, name, fuzzy=False)
+        return matcher
+
+    def add(self, key, name, fuzzy=True):
+        normalized = normalize_name(name)
+        if not normalized:
+            return
+        self.exact.setdefault(normalized, key)
+        if fuzzy:
+            trigrams = frozenset(name_trigrams(normalized))
+            index = len(self.entries)
+            self.entries.append((key, trigrams))
+            postings = self.postings[number_tokens(normalized)]
+            for trigram in trigrams:
+                postings[trigram].append(index)
+
+    def match(self, name):
+        """(key, "exact" or "fuzzy", score) of the best product for a name, or None."""
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+        if normalized in self.exact:
+            return self.exact[normalized], 'exact', 1.0
+
+        trigrams = name_trigrams(normalized)
+        postings = self.postings.get(number_tokens(normalized))
+        if not postings:
+            return None
+
+        # A product scoring >= threshold shares at least this many trigrams,
+        # so it has one of the len - min_shared + 1 rarest ones
+        min_shared = math.ceil(self.threshold * len(trigrams) - 1e-9)
+        rarest = sorted(trigrams, key=lambda trigram: (len(postings.get(trigram, ())), trigram))
+        candidates = set()
+        for trigram in rarest[:len(trigrams) - min_shared + 1]:
+            candidates.update(postings.get(trigram, ()))
+
+        best_index, best_score = None, 0
+        for index in candidates:
+            entry_trigrams = self.entries[index][1]
+            shared = len(trigrams & entry_trigrams)
+            score = shared / (len(trigrams) + len(entry_trigrams) - shared)
+            if score < self.threshold:
+                continue
+            if score > best_score or (score == best_score and index < best_index):
+                best_index, best_score = index, score
+        if best_index is None:
+            return None
+        return self.entries[best_index][0], 'fuzzy', round(best_score, 3)
+
+    def match_eans(self, eans):
+        """Product id per EAN of a known variant, preferring the partner's own variants."""
+        found = {}
+        if not eans:
+            return found
+        partner_id = self.partner.id if self.partner else None
+        for ean, variant_partner_id, product_id in PartnerProduct.objects.filter(
+            eanc__in=eans,
+        ).order_by('product_id').values_list('eanc', 'partner_id', 'product_id'):
+            own = variant_partner_id == partner_id
+            if ean not in found or (own and not found[ean][0]):
+                found[ean] = (own, product_id)
+        return {ean: product_id for ean, (_, product_id) in found.items()}
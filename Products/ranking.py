@@ -0,0 +1,69 @@
+import json
+import heapq
+import base64
+import binascii
+from .matching import best_scores, match_products
+
+RANK_CHUNK_SIZE = 500
+
+
+def encode_cursor(rank, pk):
+    """Opaque cursor for the position right after (rank, pk)."""
+    raw = json.dumps([list(rank), pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """Return (rank tuple, pk) or None; raises ValueError on a tampered cursor."""
+    if not value:
+        return None
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        rank, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return tuple(float(part) for part in rank), int(pk)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def score_rank(partner_product, result):
+    """Default ranking: best match score first."""
+    return (result.get("score", 0),)
+
+
+def stream_top_k(scan, queryset, k, after=None, rank=score_rank, chunk_size=RANK_CHUNK_SIZE):
+    """
+    Rank partner products by match without materializing the candidate set.
+    Candidates are streamed in chunks and ranked on their best score from the
+    insole range index, only the best k are kept in a bounded heap; full
+    per-size results are loaded (through the match cache) for those k only.
+    Rows ranked at or above the `after` cursor were emitted by earlier pages
+    and are skipped.
+
+    Returns (rows, match_scores): rows best first as (rank, pk, obj) tuples.
+    """
+    heap = []
+    chunk = []
+
+    def consume(chunk):
+        scores = best_scores(scan, [pp.product for pp in chunk])
+        for pp in chunk:
+            position = (rank(pp, {"score": scores.get(pp.product_id, 0)}), pp.pk)
+            if after is not None and position >= after:
+                continue
+            # positions are unique (pk), so entries never compare past them
+            if len(heap) < k:
+                heapq.heappush(heap, (position, pp))
+            elif position > heap[0][0]:
+                heapq.heapreplace(heap, (position, pp))
+
+    for pp in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(pp)
+        if len(chunk) == chunk_size:
+            consume(chunk)
+            chunk = []
+    if chunk:
+        consume(chunk)
+
+    heap.sort(key=lambda entry: entry[0], reverse=True)
+    rows = [(position[0], position[1], pp) for position, pp in heap]
+    return rows, match_products(scan, [pp.product for _, pp in heap])
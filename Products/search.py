@@ -0,0 +1,131 @@
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connections, router
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from .models import Product, ProductListing
+
+SEARCH_CONFIGS = ('german', 'english')
+
+
+class ProductSearch:
+    """Search backend for ProductListing rows on the database alias `using`."""
+
+    def __init__(self, using):
+        self.using = using
+
+
+class PostgresProductSearch(ProductSearch):
+    """
+    Full-text search on ProductListing.search_vector: name and brand
+    (weight A) and description (weight C) in the German and English configs,
+    served by a GIN index and ranked with ts_rank. Names and brands within
+    trigram distance of the term also match, so typos still find products.
+    """
+    vector_index = 'products_listing_search_gin'
+    trigram_indexes = {'name': 'products_listing_name_trgm', 'brand_name': 'products_listing_brand_trgm'}
+
+    def ensure_schema(self, connection):
+        table = connection.ops.quote_name(ProductListing._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.vector_index} ON {table} USING gin (search_vector)")
+            for field, name in self.trigram_indexes.items():
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({field} gin_trgm_ops)")
+
+    def index(self, product_ids):
+        description = Subquery(Product.objects.filter(id=OuterRef('product')).values('description')[:1])
+        vector = SearchVector('brand_name', config='simple', weight='A')
+        for config in SEARCH_CONFIGS:
+            vector += SearchVector('name', config=config, weight='A')
+            vector += SearchVector(description, config=config, weight='C')
+        ProductListing.objects.using(self.using).filter(product_id__in=product_ids).update(search_vector=vector)
+
+    def search(self, queryset, term):
+        query = SearchQuery(term, config=SEARCH_CONFIGS[0], search_type='websearch')
+        for config in SEARCH_CONFIGS[1:]:
+            query |= SearchQuery(term, config=config, search_type='websearch')
+        return queryset.filter(
+            Q(search_vector=query) | Q(name__trigram_similar=term) | Q(brand_name__trigram_similar=term)
+        ).annotate(
+            search_rank=SearchRank(F('search_vector'), query) + TrigramSimilarity('name', term)
+        )
+
+
+class SqliteProductSearch(ProductSearch):
+    """
+    The same interface on an SQLite FTS5 table, so search works in tests and
+    local setups without Postgres. Terms match as prefixes, ranked by bm25;
+    there is no typo tolerance.
+    """
+    table = 'products_listing_fts'
+
+    def ensure_schema(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "name, brand_name, description, product_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def index(self, product_ids):
+        product_ids = list(product_ids)
+        rows = ProductListing.objects.using(self.using).filter(product_id__in=product_ids).values_list(
+            'name', 'brand_name', 'product__description', 'product_id'
+        )
+        with connections[self.using].cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE product_id = %s", [(pid,) for pid in product_ids])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (name, brand_name, description, product_id) VALUES (%s, %s, %s, %s)",
+                list(rows),
+            )
+
+    def search(self, queryset, term):
+        match = ' '.join(f'"{token}"*' for token in re.findall(r'\w+', term))
+        if not match:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+        quote_name = connections[queryset.db].ops.quote_name
+        outer = f"{quote_name(ProductListing._meta.db_table)}.{quote_name('product_id')}"
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT product_id FROM {self.table} WHERE {self.table} MATCH %s", [match])
+        ).annotate(search_rank=RawSQL(
+            f"SELECT -bm25({self.table}) FROM {self.table} WHERE {self.table} MATCH %s AND product_id = {outer}",
+            [match], output_field=FloatField(),
+        ))
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresProductSearch,
+    'sqlite': SqliteProductSearch,
+}
+
+
+def search_backend(using=None):
+    """The product search backend for `using`, by default the database ProductListing is written to."""
+    if using is None:
+        using = router.db_for_write(ProductListing)
+    return SEARCH_BACKENDS[connections[using].vendor](using)
+
+
+def ensure_search_schema(using='default', **kwargs):
+    """post_migrate hook: indexes and extension (Postgres) or FTS5 table (SQLite)."""
+    db = connections[using]
+    if db.vendor in SEARCH_BACKENDS:
+        SEARCH_BACKENDS[db.vendor](using).ensure_schema(db)
+
+
+class ProductSearchFilter(filters.BaseFilterBackend):
+    """
+    ?search= over ProductListing through the search backend. Results are
+    ranked by relevance unless the view already sorts them by match score.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        queryset = search_backend(queryset.db).search(queryset, term)
+        if 'match_score' in queryset.query.annotations:
+            return queryset
+        return queryset.order_by('-search_rank', '-pk')
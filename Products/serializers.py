@@ -1,7 +1,10 @@
 from rest_framework import serializers
+from django.db.models import OuterRef, Subquery
+from django.urls import reverse
 from Brands.serializers import *
 from .models import *
 from Others.models import *
+from core.fieldsets import SparseFieldsetMixin
 
 class ProductImageSerializer(serializers.ModelSerializer):
     color = serializers.CharField(source='color.color', read_only=True)
@@ -61,16 +64,14 @@ class ProductSerializer(serializers.ModelSerializer):
         sizes_list = []
         seen_labels = set()
 
-        for image in obj.images.all():
-            for size_table in image.sizes.all():
-                for size in size_table.sizes.all():
-                    label = f"{size.type} {size.value}"
-                    if label not in seen_labels:
-                        sizes_list.append({
-                            "id": size.id,
-                            "size": label
-                        })
-                        seen_labels.add(label)
+        for size_id, size_type, size_value, _, _ in obj.get_fit_profile():
+            label = f"{size_type} {size_value}"
+            if label not in seen_labels:
+                sizes_list.append({
+                    "id": size_id,
+                    "size": label
+                })
+                seen_labels.add(label)
         return sizes_list
     
     def get_brand(self, obj):
@@ -164,12 +165,10 @@ class ProductDetailsSerializer(serializers.ModelSerializer):
         # Returns flattened unique sizes across all tables
         unique_sizes_by_type = {} # type -> set of values
         
-        for image in obj.images.all():
-            for size_table in image.sizes.all():
-                for size in size_table.sizes.all():
-                    if size.type not in unique_sizes_by_type:
-                        unique_sizes_by_type[size.type] = set()
-                    unique_sizes_by_type[size.type].add(size.value)
+        for _, size_type, size_value, _, _ in obj.get_fit_profile():
+            if size_type not in unique_sizes_by_type:
+                unique_sizes_by_type[size_type] = set()
+            unique_sizes_by_type[size_type].add(size_value)
         
         # Format for response: list of { "table_name": "EU", "size": ["40", "41"] }
         return [
@@ -332,7 +331,57 @@ class PartnerProductSerializer(serializers.ModelSerializer):
     def get_stock_status(self, obj):
         return "In Stock" if obj.total_stock_quantity > 0 else "Out of Stock"
 
-class PartnerProductListSerializer(serializers.ModelSerializer):
+def load_listing_aggregates(partner_products):
+    """
+    Online colors, lowest online price and primary image of every product on
+    a listing page, in two grouped queries whatever the page size.
+    Returns {product_id: {"colors", "min_price", "image"}}.
+    """
+    product_ids = {pp.product_id for pp in partner_products}
+    aggregates = {pid: {"colors": [], "min_price": None, "image": None} for pid in product_ids}
+    if not product_ids:
+        return aggregates
+
+    # Global view: colors and prices from ALL active partners of each product
+    rows = PartnerProduct.objects.filter(
+        product_id__in=product_ids,
+        is_active=True,
+        online=True
+    ).values('product_id', 'color__color').annotate(
+        min_price=models.Min('price')
+    ).order_by('product_id', 'color__color')
+    for row in rows:
+        entry = aggregates[row['product_id']]
+        entry["colors"].append(row['color__color'])
+        if entry["min_price"] is None or row['min_price'] < entry["min_price"]:
+            entry["min_price"] = row['min_price']
+
+    first_image_sq = ProductImage.objects.filter(
+        product=OuterRef('product')
+    ).order_by('created_at', 'id').values('id')[:1]
+    images = ProductImage.objects.filter(
+        product_id__in=product_ids,
+        id=Subquery(first_image_sq)
+    ).select_related('color')
+    for image in images:
+        aggregates[image.product_id]["image"] = image
+    return aggregates
+
+
+class PartnerProductListPageSerializer(serializers.ListSerializer):
+    """Loads the per-product aggregates of the whole page before serializing it."""
+
+    def to_representation(self, data):
+        rows = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        aggregates = self.context.setdefault("listing_aggregates", {})
+        missing = [pp for pp in rows if pp.product_id not in aggregates]
+        # Only colors, price and image read the aggregates
+        if missing and {'color', 'price', 'image'} & set(self.child.fields):
+            aggregates.update(load_listing_aggregates(missing))
+        return super().to_representation(rows)
+
+
+class PartnerProductListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for customer-facing product listings (multi-vendor system)"""
     id = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
@@ -342,23 +391,28 @@ class PartnerProductListSerializer(serializers.ModelSerializer):
     sub_category = serializers.SerializerMethodField()
     name = serializers.CharField(source='product.name')
     gender = serializers.CharField(source='product.gender')
+    price = serializers.SerializerMethodField()
     color = serializers.SerializerMethodField()
 
     
     class Meta:
         model = PartnerProduct
+        list_serializer_class = PartnerProductListPageSerializer
         fields = [
             'id', 'image', 'name', 'gender', 'price', 
             'match_data', 'brand', 'sub_category', 'favourite', 'color'
         ]
 
+    def get_aggregates(self, obj):
+        # Filled page-wide by PartnerProductListPageSerializer, loaded here for a single object
+        aggregates = self.context.get("listing_aggregates") or {}
+        if obj.product_id not in aggregates:
+            aggregates = load_listing_aggregates([obj])
+        return aggregates[obj.product_id]
+
     def get_color(self, obj):
         # Global view: show color NAMES from ALL active partners for this product
-        return list(PartnerProduct.objects.filter(
-            product=obj.product, 
-            is_active=True,
-            online=True
-        ).values_list('color__color', flat=True).distinct())
+        return self.get_aggregates(obj)["colors"]
     
     def get_id(self, obj):
         # Return main Product ID instead of PartnerProduct ID
@@ -366,12 +420,8 @@ class PartnerProductListSerializer(serializers.ModelSerializer):
     
     def get_price(self, obj):
         # Global view: show the minimum price available for this product
-        min_price = PartnerProduct.objects.filter(
-            product=obj.product,
-            is_active=True,
-            online=True
-        ).aggregate(models.Min('price'))['price__min']
-        return min_price or obj.price
+        min_price = self.get_aggregates(obj)["min_price"]
+        return serializers.DecimalField(max_digits=12, decimal_places=2).to_representation(min_price or obj.price)
     
     def get_sub_category(self, obj):
         try:
@@ -381,7 +431,7 @@ class PartnerProductListSerializer(serializers.ModelSerializer):
     
     def get_image(self, obj):
         # Use primary image of the product
-        primary = obj.product.images.first()
+        primary = self.get_aggregates(obj)["image"]
         if primary:
             return ProductImageSerializer(primary).data
         return None
@@ -398,7 +448,9 @@ class PartnerProductListSerializer(serializers.ModelSerializer):
         """Return match analysis based on foot scan"""
         scan = self.context.get("scan")
         if scan:
-            match_result = obj.product.match_with_scan(scan)
+            # Views batch-score their rows up front, fall back to scalar scoring
+            match_scores = self.context.get("match_scores") or {}
+            match_result = match_scores.get(obj.product_id) or obj.product.match_with_scan(scan)
             if match_result:
                 return {
                     'score': match_result.get('score'),
@@ -416,7 +468,105 @@ class PartnerProductListSerializer(serializers.ModelSerializer):
             
         return Favorite.objects.filter(user=request.user, products=obj.product).exists()
 
-class PartnerProductDetailSerializer(serializers.ModelSerializer):
+class ProductListingSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Customer-facing product listing read straight from the ProductListing table"""
+    id = serializers.IntegerField(source='product_id')
+    image = serializers.JSONField(source='primary_image')
+    price = serializers.DecimalField(source='min_price', max_digits=12, decimal_places=2)
+    match_data = serializers.SerializerMethodField()
+    brand = serializers.SerializerMethodField()
+    sub_category = serializers.CharField(source='sub_category_slug')
+    favourite = serializers.SerializerMethodField()
+    color = serializers.JSONField(source='color_names')
+
+    class Meta:
+        model = ProductListing
+        fields = [
+            'id', 'image', 'name', 'gender', 'price',
+            'match_data', 'brand', 'sub_category', 'favourite', 'color'
+        ]
+
+    def get_brand(self, obj):
+        return {"name": obj.brand_name, "image": obj.brand_image}
+
+    def get_match_data(self, obj):
+        scan = self.context.get("scan")
+        if scan:
+            match_scores = self.context.get("match_scores") or {}
+            match_result = match_scores.get(obj.product_id) or obj.product.match_with_scan(scan)
+            if match_result:
+                return {
+                    'score': match_result.get('score'),
+                }
+        return None
+
+    def get_favourite(self, obj):
+        request = self.context.get("request")
+        if not request or not request.user.is_authenticated:
+            return False
+
+        favorite_ids = self.context.get("favorite_ids")
+        if favorite_ids is not None:
+            return obj.product_id in favorite_ids
+
+        return Favorite.objects.filter(user=request.user, products=obj.product_id).exists()
+
+# ProductListing columns read by listing_rows()
+LISTING_ROW_FIELDS = (
+    'product_id', 'primary_image', 'name', 'gender', 'min_price',
+    'brand_name', 'brand_image', 'sub_category_slug', 'color_names',
+)
+listing_price_field = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+def listing_rows(rows, context, fields=None):
+    """
+    ProductListingSerializer output for ProductListing .values() rows,
+    built as plain dicts. Match scores come from context["match_scores"]
+    only, so the view must score the page first. `fields` restricts the
+    keys to a sparse fieldset.
+    """
+    request = context.get("request")
+    authenticated = bool(request and request.user.is_authenticated)
+    favorite_ids = context.get("favorite_ids") or set()
+    match_scores = (context.get("match_scores") or {}) if context.get("scan") else None
+    to_price = listing_price_field.to_representation
+
+    data = []
+    for row in rows:
+        product_id = row['product_id']
+        match_result = match_scores.get(product_id) if match_scores is not None else None
+        data.append({
+            'id': product_id,
+            'image': row['primary_image'],
+            'name': row['name'],
+            'gender': row['gender'],
+            'price': to_price(row['min_price']) if row['min_price'] is not None else None,
+            'match_data': {'score': match_result.get('score')} if match_result else None,
+            'brand': {"name": row['brand_name'], "image": row['brand_image']},
+            'sub_category': row['sub_category_slug'],
+            'favourite': authenticated and product_id in favorite_ids,
+            'color': row['color_names'],
+        })
+    if fields is not None:
+        data = [{name: item[name] for name in fields} for item in data]
+    return data
+
+def size_score_map(match_result):
+    """Per-size scores of a match result keyed by size without its system, e.g. {"42": "87.5"}."""
+    score_dict = {}
+    for size_score in (match_result or {}).get('size_scores', []):
+        size_name = size_score.get('size', '')
+        score_value = size_score.get('score', 0)
+        size_parts = size_name.split()
+        if len(size_parts) >= 2:
+            size_key = ' '.join(size_parts[1:])
+        else:
+            size_key = size_name
+        score_dict[size_key] = f"{score_value}"
+    return score_dict
+
+
+class PartnerProductDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for detailed product view in multi-vendor system"""
     id = serializers.SerializerMethodField()
     colors = serializers.SerializerMethodField()
@@ -464,7 +614,7 @@ class PartnerProductDetailSerializer(serializers.ModelSerializer):
             online=True
         ).values_list('color_id', flat=True)
         
-        images = ProductImage.objects.filter(product=obj.product, color_id__in=active_color_ids)
+        images = ProductImage.objects.filter(product=obj.product, color_id__in=active_color_ids).select_related('color')
         return ProductImageSerializer(images, many=True).data
     
     def get_sub_category(self, obj):
@@ -503,7 +653,7 @@ class PartnerProductDetailSerializer(serializers.ModelSerializer):
             product=obj.product, 
             is_active=True,
             online=True
-        ).select_related('color').prefetch_related('size_quantities__size')
+        ).select_related('color').prefetch_related('size_quantities__size', 'size_quantities__color')
         
         results = []
         for variant in active_variants:
@@ -531,20 +681,7 @@ class PartnerProductDetailSerializer(serializers.ModelSerializer):
         """Return detailed match analysis"""
         scan = self.context.get("scan")
         if scan:
-            match_result = obj.product.match_with_scan(scan)
-            if match_result:
-                score_dict = {}
-                size_scores = match_result.get('size_scores', [])
-                for size_score in size_scores:
-                    size_name = size_score.get('size', '')
-                    score_value = size_score.get('score', 0)
-                    size_parts = size_name.split()
-                    if len(size_parts) >= 2:
-                        size_key = ' '.join(size_parts[1:])
-                    else:
-                        size_key = size_name
-                    score_dict[size_key] = f"{score_value}"
-                return score_dict
+            return size_score_map(obj.product.match_with_scan(scan))
         return {}
     
     def get_favourite(self, obj):
@@ -594,4 +731,21 @@ class FavoriteSerializer(serializers.ModelSerializer):
             'product', 'product__brand', 'product__sub_category'
         ).prefetch_related('product__images')
 
-        return PartnerProductListSerializer(partner_products, many=True, context=self.context).data
\ No newline at end of file
+        return PartnerProductListSerializer(partner_products, many=True, context=self.context).data
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source='id', read_only=True)
+    progress = serializers.ReadOnlyField()
+    report_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ['job_id', 'status', 'file_name', 'total_rows', 'processed_rows', 'progress', 'summary', 'skipped_details', 'matched_columns', 'error', 'report_url', 'created_at', 'finished_at']
+
+    def get_report_url(self, obj):
+        if not obj.report:
+            return None
+        request = self.context.get('request')
+        url = reverse('partner_product_upload_report', args=[obj.id])
+        return request.build_absolute_uri(url) if request else url
@@ -1,6 +1,14 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from .models import *
+from .tasks import refresh_scan_match_scores, rescore_products
+from .matching import refresh_fit_profiles
+from .size_index import bump_size_index
+from .listing import bump_catalog_version, schedule_listing_refresh
+from Others.models import FootScan, ProductQuestionAnswer
+from core.versioning import bump_versions, favorites_scope, product_scope, scan_scope
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
@@ -9,3 +17,195 @@ def create_favorite_for_new_user(sender, instance, created, **kwargs):
     if created and instance.role == 'customer':
         Favorite.objects.create(user=instance)
 
+
+# --- MATCH SCORE MAINTENANCE ---
+def products_for_size_tables(table_ids):
+    """Products whose images link any of the given size tables."""
+    return set(ProductImage.objects.filter(sizes__id__in=table_ids).values_list('product_id', flat=True))
+
+
+def schedule_rescore(product_ids, sizes_changed=True):
+    """Invalidate cached match results of the products and re-score them."""
+    product_ids = sorted(set(product_ids))
+    if product_ids:
+        if sizes_changed:
+            refresh_fit_profiles(product_ids)
+            transaction.on_commit(bump_size_index)
+        Product.objects.filter(id__in=product_ids).update(fit_version=F('fit_version') + 1)
+        transaction.on_commit(lambda: rescore_products.delay(product_ids))
+        transaction.on_commit(lambda: bump_catalog_version(product_ids))
+
+
+@receiver(post_save, sender=FootScan)
+def refresh_scores_for_scan(sender, instance, **kwargs):
+    scan_id = instance.id
+    transaction.on_commit(lambda: refresh_scan_match_scores.delay(scan_id))
+
+
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+def rescore_on_size_change(sender, instance, **kwargs):
+    schedule_rescore(products_for_size_tables([instance.table_id]))
+
+
+@receiver(post_save, sender=SizeTable)
+def rescore_on_size_table_change(sender, instance, **kwargs):
+    schedule_rescore(products_for_size_tables([instance.id]))
+
+
+@receiver(pre_delete, sender=SizeTable)
+def remember_size_table_products(sender, instance, **kwargs):
+    # The image links are gone once the table is deleted
+    instance._fit_products = products_for_size_tables([instance.id])
+
+
+@receiver(post_delete, sender=SizeTable)
+def rescore_on_size_table_delete(sender, instance, **kwargs):
+    schedule_rescore(getattr(instance, '_fit_products', ()))
+
+
+@receiver(m2m_changed, sender=ProductImage.sizes.through)
+def rescore_on_image_sizes_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        # instance is a ProductImage
+        if action != 'pre_clear':
+            schedule_rescore([instance.product_id])
+    elif action == 'pre_clear':
+        # instance is a SizeTable losing all of its images, re-score after the clear
+        instance._fit_products = products_for_size_tables([instance.id])
+    elif action == 'post_clear':
+        schedule_rescore(getattr(instance, '_fit_products', ()))
+    elif pk_set:
+        schedule_rescore(ProductImage.objects.filter(id__in=pk_set).values_list('product_id', flat=True))
+
+
+@receiver(post_delete, sender=ProductImage)
+def rescore_on_image_delete(sender, instance, **kwargs):
+    schedule_rescore([instance.product_id])
+
+
+@receiver(pre_save, sender=Product)
+def track_product_fit_change(sender, instance, **kwargs):
+    if not instance.pk:
+        instance._fit_changed = False
+        return
+    previous = Product.objects.filter(pk=instance.pk).values_list('width', 'toe_box', 'fit_version', 'fit_profile').first()
+    if previous is None:
+        instance._fit_changed = False
+        return
+    instance._fit_changed = previous[:2] != (instance.width, instance.toe_box)
+    # Never write back an older fit_version or fit_profile from a stale instance
+    instance.fit_version = max(instance.fit_version, previous[2])
+    instance.fit_profile = previous[3]
+
+
+@receiver(post_save, sender=Product)
+def rescore_on_product_fit_change(sender, instance, created, **kwargs):
+    if getattr(instance, '_fit_changed', False):
+        schedule_rescore([instance.id], sizes_changed=False)
+
+
+# --- PRODUCT LISTING READ MODEL ---
+@receiver(post_save, sender=Product)
+def refresh_listing_on_product_change(sender, instance, **kwargs):
+    schedule_listing_refresh([instance.id])
+
+
+@receiver(post_save, sender=PartnerProduct)
+@receiver(post_delete, sender=PartnerProduct)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_listing_on_variant_or_image_change(sender, instance, **kwargs):
+    schedule_listing_refresh([instance.product_id])
+
+
+@receiver(post_save, sender=PartnerProductSize)
+@receiver(post_delete, sender=PartnerProductSize)
+def refresh_listing_on_stock_change(sender, instance, **kwargs):
+    product_id = PartnerProduct.objects.filter(id=instance.partner_product_id).values_list('product_id', flat=True).first()
+    schedule_listing_refresh([product_id])
+
+
+@receiver(post_save, sender=Brand)
+def refresh_listing_on_brand_change(sender, instance, created, **kwargs):
+    if not created:
+        # Full refresh so the search index picks up the new brand name too
+        schedule_listing_refresh(ProductListing.objects.filter(brand=instance).values_list('product_id', flat=True))
+
+
+@receiver(post_save, sender=SubCategory)
+def refresh_listing_on_sub_category_change(sender, instance, created, **kwargs):
+    if not created:
+        schedule_listing_refresh(Product.objects.filter(sub_category=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Color)
+def refresh_listing_on_color_change(sender, instance, created, **kwargs):
+    if not created:
+        schedule_listing_refresh(
+            set(PartnerProduct.objects.filter(color=instance).values_list('product_id', flat=True))
+            | set(ProductImage.objects.filter(color=instance).values_list('product_id', flat=True))
+        )
+
+
+# --- CONDITIONAL GET VERSIONS ---
+@receiver(post_save, sender=FootScan)
+@receiver(post_delete, sender=FootScan)
+def bump_scan_version(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_versions(scan_scope(user_id)))
+
+
+@receiver(m2m_changed, sender=Favorite.products.through)
+def bump_favorites_version(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Product.favorited_by changed, pk_set holds Favorite ids (None on clear)
+        favorites = Favorite.objects.filter(id__in=pk_set) if pk_set else Favorite.objects.all()
+        user_ids = list(favorites.values_list('user_id', flat=True))
+    else:
+        user_ids = [instance.user_id]
+    transaction.on_commit(lambda: bump_versions(*(favorites_scope(uid) for uid in user_ids)))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def bump_brands_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_versions('brands'))
+
+
+def bump_product_versions(product_ids):
+    product_ids = [pid for pid in set(product_ids) if pid]
+    if product_ids:
+        transaction.on_commit(lambda: bump_versions(*(product_scope(pid) for pid in product_ids)))
+
+
+@receiver(post_save, sender=Features)
+def bump_versions_on_feature_change(sender, instance, **kwargs):
+    bump_product_versions(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=Product.features.through)
+def bump_versions_on_product_features_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('post_'):
+        bump_product_versions((pk_set or ()) if reverse else [instance.id])
+
+
+@receiver(post_save, sender=ProductQuestionAnswer)
+@receiver(post_delete, sender=ProductQuestionAnswer)
+def bump_versions_on_qna_change(sender, instance, **kwargs):
+    bump_product_versions([instance.product_id])
+
+
+@receiver(m2m_changed, sender=ProductQuestionAnswer.answers.through)
+def bump_versions_on_qna_answers_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        qna = ProductQuestionAnswer.objects.filter(answers__id__in=pk_set) if pk_set else ProductQuestionAnswer.objects.none()
+        bump_product_versions(qna.values_list('product_id', flat=True))
+    else:
+        bump_product_versions([instance.product_id])
@@ -0,0 +1,118 @@
+import time
+import logging
+import threading
+import numpy as np
+from django.core.cache import cache
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'size-index-version'
+VERSION_CHECK_INTERVAL = 5  # seconds between shared version checks
+MAX_AGE = 60 * 10  # rebuild at least this often if the shared cache is down
+
+
+def bump_size_index():
+    """Tell every process that size data changed and the index must be rebuilt."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+    except Exception as e:
+        logger.warning(f"Size index version bump failed: {e}")
+
+
+def _shared_version():
+    try:
+        return cache.get(VERSION_KEY, 0)
+    except Exception as e:
+        logger.warning(f"Size index version read failed: {e}")
+        return None
+
+
+class SizeIntervals:
+    """
+    One build of the index: every (product, size) insole range reachable
+    through ProductImage.sizes, kept as arrays sorted by the lower bound.
+    A stabbing query for a foot length bisects the window of lower bounds
+    that can still reach it and filters on the upper bound, so it costs
+    O(log n + k) instead of a scan over the catalog. Never modified after
+    it is built, so readers need no lock.
+    """
+
+    def __init__(self, data):
+        data = data[np.argsort(data[:, 2], kind='stable')]
+        self.product_ids = data[:, 0]
+        self.size_ids = data[:, 1]
+        self.mins = data[:, 2].astype(np.int32)
+        self.maxs = data[:, 3].astype(np.int32)
+        self.max_span = int((self.maxs - self.mins).max()) if len(data) else 0
+        self.sized_products = frozenset(self.product_ids.tolist())
+
+    def reachable(self, foot_length, reach_mm):
+        """
+        (product_ids, size_ids, mins, maxs) of every size whose insole range
+        is at most reach_mm away from foot_length.
+        """
+        low = np.searchsorted(self.mins, foot_length - reach_mm - self.max_span, side='left')
+        high = np.searchsorted(self.mins, foot_length + reach_mm, side='right')
+        window = slice(low, high)
+        mask = self.maxs[window] >= foot_length - reach_mm
+        return (
+            self.product_ids[window][mask],
+            self.size_ids[window][mask],
+            self.mins[window][mask],
+            self.maxs[window][mask],
+        )
+
+    def has_sizes(self, product_id):
+        return product_id in self.sized_products
+
+
+class SizeIntervalIndex:
+    """
+    Process-wide SizeIntervals, rebuilt when size data changes in any
+    process. A rebuild publishes the new build with a single assignment,
+    so a reader holds either the old or the new one, never a mix.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.intervals = None
+        self.version = None
+        self.built_at = None
+        self.checked_at = 0
+
+    def build(self):
+        rows = ProductImage.sizes.through.objects.filter(
+            sizetable__sizes__isnull=False
+        ).values_list(
+            'productimage__product_id',
+            'sizetable__sizes__id',
+            'sizetable__sizes__insole_min_mm',
+            'sizetable__sizes__insole_max_mm',
+        ).distinct()
+
+        self.intervals = SizeIntervals(np.array(list(rows), dtype=np.int64).reshape(-1, 4))
+        self.built_at = time.monotonic()
+
+    def fresh(self):
+        """Return the current SizeIntervals, rebuilt when size data changed anywhere."""
+        with self.lock:
+            now = time.monotonic()
+            if self.built_at is not None and now - self.checked_at < VERSION_CHECK_INTERVAL:
+                return self.intervals
+            self.checked_at = now
+            version = _shared_version()
+            stale = (
+                self.built_at is None
+                or version != self.version
+                or (version is None and now - self.built_at > MAX_AGE)
+            )
+            if stale:
+                self.build()
+                self.version = version
+            return self.intervals
+
+
+size_index = SizeIntervalIndex()
@@ -0,0 +1,678 @@
+import io
+import re
+import csv
+import json
+import hashlib
+import tempfile
+import operator
+import functools
+import itertools
+from decimal import Decimal
+import openpyxl
+from django.db.models import Q
+from django.utils import timezone
+from Brands.models import Brand
+from .barcodes import shifted
+from .listing import schedule_listing_refresh
+from .name_matcher import ProductNameMatcher, normalize_name
+from .models import Category, Color, PartnerProduct, PartnerProductSize, Product, ProductImage, Size, SizeTable, SubCategory
+
+IMPORT_CHUNK_SIZE = 500
+# Skipped rows kept in full for the response, the rest are only counted
+MAX_SKIPPED_DETAILS = 50
+
+# Column patterns for mapping different manufacturer formats
+COLUMN_PATTERNS = {
+    'item_name': [r'item[_\s]?name', r'product[_\s]?name', r'^name$', r'^item$'],
+    'color_name': [r'color[_\s]?name', r'^color$', r'variant', r'shade'],
+    'price': [r'amount[_\s]?incl[_\s]?vat', r'selling[_\s]?price', r'^price$', r'^amount$'],
+    'buy_price': [r'buy[_\s]?price', r'purchase[_\s]?price', r'cost[_\s]?price', r'^cost$', r'buying[_\s]?price'],
+    'ean': [r'^ean$', r'^eanc$', r'barcode', r'upc', r'article[_\s]?no'],
+    'quantity': [r'^qty$', r'^quantity$', r'stock', r'inventory', r'amount'],
+    'size_eu': [r'size[_\s]?eu', r'^eu[_\s]?size$', r'^eu$', r'sizes[_\s]?eu'],
+    'size_usm': [r'size[_\s]?usm', r'size[_\s]?us[_\s]?m', r'usm'],
+    'size_usw': [r'size[_\s]?usw', r'size[_\s]?us[_\s]?w', r'usw'],
+    'size_us': [r'size[_\s]?us', r'^us[_\s]?size$', r'^us$'],
+}
+
+
+class UploadFormatError(ValueError):
+    pass
+
+
+class UploadReadError(ValueError):
+    """The upload could not be parsed, raised while iterating its rows."""
+
+
+def read_csv_rows(file):
+    """Rows of an uploaded CSV as dicts, decoded incrementally from the upload stream."""
+    stream = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    try:
+        yield from csv.DictReader(stream)
+    finally:
+        # Leave the upload itself open for Django to clean up
+        stream.detach()
+
+
+def read_xlsx_rows(file):
+    """Rows of the active sheet of an uploaded workbook as dicts keyed by the first row."""
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if headers is None:
+            return
+        for row in rows:
+            yield dict(zip(headers, row))
+    finally:
+        workbook.close()
+
+
+def upload_format(name):
+    """Format of a stock file by its name: csv or xlsx. Anything else is an UploadFormatError."""
+    name = name or ''
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith('.xlsx') or name.endswith('.xls'):
+        return 'xlsx'
+    raise UploadFormatError("Unsupported file format. Please upload CSV or XLSX.")
+
+
+def read_upload_rows(file):
+    """
+    Lazily read the rows of an uploaded stock file, so memory stays flat
+    whatever the file size. Parsing errors surface while iterating, as
+    UploadReadError.
+    """
+    if upload_format(file.name) == 'csv':
+        return _reading(read_csv_rows(file), "CSV")
+    return _reading(read_xlsx_rows(file), "Excel")
+
+
+def count_upload_rows(file):
+    """
+    Number of data rows in a stock file, for progress reporting. Workbooks
+    answer from their stored dimensions when they have them. Leaves the
+    file rewound.
+    """
+    try:
+        if upload_format(file.name) == 'xlsx':
+            workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+            try:
+                max_row = workbook.active.max_row
+            finally:
+                workbook.close()
+            if max_row is not None:
+                return max(max_row - 1, 0)
+            file.seek(0)
+        return sum(1 for _ in read_upload_rows(file))
+    finally:
+        file.seek(0)
+
+
+def file_sha256(file):
+    """Hex SHA-256 of an uploaded file, read chunk by chunk. Leaves the file rewound."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _reading(rows, file_type):
+    # Only failures of the reader itself, not of the code consuming the rows
+    try:
+        yield from rows
+    except Exception as e:
+        raise UploadReadError(f"Error reading {file_type}: {str(e)}") from e
+
+
+def chunked(iterable, size=IMPORT_CHUNK_SIZE):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def find_column(headers, patterns):
+    for pattern in patterns:
+        for header in headers:
+            if re.search(pattern, str(header), re.IGNORECASE):
+                return header
+    return None
+
+
+def any_of(lookup, values):
+    """Q matching rows for which `lookup` holds with any of the values."""
+    return functools.reduce(operator.or_, (Q(**{lookup: value}) for value in values))
+
+
+def clean_price(price_str):
+    if not price_str: return Decimal('0.00')
+    # Remove currency symbols and spaces
+    cleaned = "".join(c for c in str(price_str) if c.isdigit() or c in '.,')
+    if not cleaned: return Decimal('0.00')
+
+    # Consistent decimal separator
+    if ',' in cleaned and '.' in cleaned:
+        cleaned = cleaned.replace(',', '')
+    elif ',' in cleaned:
+        cleaned = cleaned.replace(',', '.')
+
+    try:
+        return Decimal(cleaned)
+    except:
+        return Decimal('0.00')
+
+
+def clean_quantity(quantity_val):
+    try:
+        return int(quantity_val) if quantity_val is not None else 0
+    except:
+        return 0
+
+
+def relevant_size_types(gender):
+    relevant_types = ['EU']
+    if gender == 'male':
+        relevant_types.append('USM')
+    elif gender == 'female':
+        relevant_types.append('USW')
+    else: # unisex or others
+        relevant_types.extend(['USM', 'USW'])
+    return relevant_types
+
+
+class ImportReport:
+    """
+    CSV report of every skipped row of an import, spooled to a temporary
+    file as the import runs. Pass it as StockImport's `on_skip`.
+    """
+    headers = ["line", "item", "reason", "row"]
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.headers)
+
+    def __call__(self, row_number, detail):
+        row = detail.get("row")
+        self.writer.writerow([
+            # Line in the file, after the header line
+            row_number + 1,
+            detail.get("item", ""),
+            detail["reason"],
+            json.dumps(row, default=str) if row is not None else "",
+        ])
+
+    def carry_over(self, file, last_row):
+        """Copy the lines of an earlier report (binary file) up to row `last_row`, for a resumed import."""
+        reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8', newline=''))
+        next(reader, None)
+        for line in reader:
+            if line and int(line[0]) <= last_row + 1:
+                self.writer.writerow(line)
+
+    def close(self):
+        self.file.close()
+
+
+class StockImport:
+    """
+    One partner stock upload, fed chunk by chunk with process_chunk().
+    Columns are resolved once from the headers of the first row; the
+    summary counters accumulate across chunks. `on_skip(row_number, detail)`
+    is called for every skipped row, including those past MAX_SKIPPED_DETAILS.
+
+    Each chunk is imported set-based: the products, colors, images, sizes,
+    partner products and stock rows it references are read with a few IN
+    queries, resolved in memory in file order, and written back in bulk.
+    The summary counters and the stock written are the same as importing
+    the rows one at a time.
+
+    Rows are matched to products by the EAN of a known variant first, then
+    by name with a ProductNameMatcher built once for the import (exact,
+    then fuzzy above FUZZY_MATCH_THRESHOLD); unmatched names get a local
+    product that later rows match.
+    """
+
+    def __init__(self, partner, headers, warehouse=None, on_skip=None):
+        self.partner = partner
+        self.warehouse = warehouse
+        self.on_skip = on_skip
+        # 1-based number of the last row read
+        self.row_number = 0
+        # Resolved column names found in the uploaded file
+        self.cols = {key: find_column(headers, patterns) for key, patterns in COLUMN_PATTERNS.items()}
+        self.summary = {
+            "total_rows": 0,
+            "matched_products": 0,
+            "created_products": 0,
+            "new_partner_products": 0,
+            "updated_partner_products": 0,
+            "size_updates": 0,
+            "color_updates": 0,
+            "local_only_count": 0,
+            "skipped_rows": 0,
+            # Rows whose EAN another of the partner's variants already has
+            "ean_conflicts": 0,
+            # Matched rows per way of matching, see resolve_products()
+            "match_confidence": {
+                "ean": 0,
+                "exact": 0,
+                "fuzzy": 0,
+                "fuzzy_score_min": None,
+                "fuzzy_score_avg": None
+            }
+        }
+        self.skipped_details = []
+        self.fuzzy_score_total = 0
+        self.matcher = ProductNameMatcher.for_partner(partner)
+        # (product key, match method, score) per item name
+        self.product_cache = {}
+        # Product id of each local product created, by its matcher key
+        self.created_products = {}
+        # Product key of each EAN, from the first row of the file carrying it
+        self.ean_keys = {}
+        # (product id, color id) of the partner's variant holding each EAN seen
+        self.ean_owners = {}
+        self.local_catalog = None
+        self.local_size_tables = {}
+
+    def resume(self, processed_rows, summary, skipped_details):
+        """Carry on after the rows and counters a failed run of the same upload committed."""
+        self.row_number = processed_rows
+        self.summary.update(summary)
+        self.skipped_details = list(skipped_details)
+        confidence = self.summary["match_confidence"]
+        self.fuzzy_score_total = (confidence["fuzzy_score_avg"] or 0) * confidence["fuzzy"]
+
+    def skip(self, row_number, detail):
+        self.summary["skipped_rows"] += 1
+        if len(self.skipped_details) < MAX_SKIPPED_DETAILS:
+            self.skipped_details.append(detail)
+        if self.on_skip:
+            self.on_skip(row_number, detail)
+
+    def value(self, row, key):
+        return row.get(self.cols[key]) if self.cols[key] else None
+
+    def process_chunk(self, rows):
+        self.summary["total_rows"] += len(rows)
+        lines = [{"number": self.row_number + index, "row": row, "skip": None} for index, row in enumerate(rows, 1)]
+        self.row_number += len(rows)
+
+        self.resolve_products(lines)
+        self.resolve_colors([line for line in lines if not line["skip"]])
+        imported = [line for line in lines if not line["skip"]]
+        self.resolve_sizes(imported)
+        self.write_partner_products(imported)
+        self.write_stock(imported)
+
+        # Bulk writes send no post_save, refresh the listing like the signals would
+        schedule_listing_refresh({line["product"].id for line in lines if "product" in line})
+        for line in lines:
+            if line["skip"]:
+                self.skip(line["number"], line["skip"])
+
+    # --- 1. Resolve Product ---
+    def resolve_products(self, lines):
+        eans = set()
+        for line in lines:
+            item_name = self.value(line["row"], 'item_name')
+            # Names without a letter or digit would only match arbitrarily
+            if not item_name or not normalize_name(item_name):
+                line["skip"] = {"row": line["row"], "reason": "Missing item name column or value"}
+                continue
+            line["item"] = str(item_name).strip()
+            ean_val = self.value(line["row"], 'ean')
+            line["ean"] = str(ean_val).strip() if ean_val else None
+            if line["ean"]:
+                eans.add(line["ean"])
+        # EANs met earlier in the file keep their product, whatever the chunking
+        ean_matches = self.matcher.match_eans(eans - self.ean_keys.keys())
+
+        max_length = Product._meta.get_field('name').max_length
+        created = {}
+        for line in lines:
+            if line["skip"]:
+                continue
+            item_name = line["item"]
+            line["local"] = False
+            if line["ean"] in self.ean_keys:
+                key, method, score = self.ean_keys[line["ean"]], 'ean', 1.0
+            elif line["ean"] in ean_matches:
+                key, method, score = ean_matches[line["ean"]], 'ean', 1.0
+            elif item_name in self.product_cache:
+                key, method, score = self.product_cache[item_name]
+            else:
+                match = self.matcher.match(item_name)
+                if match:
+                    key, method, score = self.product_cache[item_name] = match
+                elif len(item_name) > max_length:
+                    line["skip"] = {"item": item_name, "reason": f"Failed to create local product: name is longer than {max_length} characters"}
+                    continue
+                else:
+                    # Product not found -> Create a "Local" product, matched by the rows after this one
+                    line["local"] = True
+                    key = -len(self.created_products) - len(created) - 1
+                    created[key] = Product(
+                        name=item_name,
+                        **self.get_local_catalog(),
+                        description=f"Auto-generated local product for {item_name}",
+                        gender="unisex",
+                        is_active=False # Keep it inactive for global search maybe?
+                    )
+                    self.matcher.add(key, item_name)
+                    self.product_cache[item_name] = (key, 'exact', 1.0)
+                    self.summary["created_products"] += 1
+
+            if not line["local"]:
+                self.summary["matched_products"] += 1
+                self.count_match(method, score)
+            line["product_key"] = key
+            if line["ean"]:
+                self.ean_keys.setdefault(line["ean"], key)
+
+        if created:
+            Product.objects.bulk_create(created.values())
+            # Local products get negative keys until they are saved
+            self.created_products.update((key, product.pk) for key, product in created.items())
+        products = {product.pk: product for product in created.values()}
+        for line in lines:
+            if not line["skip"]:
+                line["product_id"] = self.created_products.get(line["product_key"], line["product_key"])
+        products.update(Product.objects.only('id', 'name', 'gender', 'brand').in_bulk(
+            {line["product_id"] for line in lines if not line["skip"]} - products.keys()
+        ))
+        for line in lines:
+            if not line["skip"]:
+                line["product"] = products[line["product_id"]]
+
+    def count_match(self, method, score):
+        confidence = self.summary["match_confidence"]
+        confidence[method] += 1
+        if method == 'fuzzy':
+            self.fuzzy_score_total += score
+            confidence["fuzzy_score_min"] = min(score, confidence["fuzzy_score_min"] or score)
+            confidence["fuzzy_score_avg"] = round(self.fuzzy_score_total / confidence["fuzzy"], 3)
+
+    def get_local_catalog(self):
+        """Brand and categories of auto-created local products."""
+        if self.local_catalog is None:
+            local_brand, _ = Brand.objects.get_or_create(name="Local")
+            local_cat, _ = Category.objects.get_or_create(name="Local", defaults={'slug': 'local-cat'})
+            local_subcat, _ = SubCategory.objects.get_or_create(
+                name="Local",
+                category=local_cat,
+                defaults={'slug': 'local-subcat'}
+            )
+            self.local_catalog = {'brand': local_brand, 'main_category': local_cat, 'sub_category': local_subcat}
+        return self.local_catalog
+
+    # --- 2. Resolve Color ---
+    def resolve_colors(self, lines):
+        color_names = set()
+        color_ids = set()
+        for line in lines:
+            color_name = self.value(line["row"], 'color_name')
+            if color_name:
+                color_names.add(str(color_name).strip())
+            try:
+                color_ids.add(Color._meta.pk.get_prep_value(line["row"].get('color_id') or None))
+            except (TypeError, ValueError):
+                # Raised again below if the row gets to use it
+                pass
+
+        # Images of the products, to match colors of the global catalog (Online mode)
+        images = {}
+        for image_id, product_id, color_id in ProductImage.objects.filter(
+            product_id__in={line["product"].id for line in lines},
+        ).values_list('id', 'product_id', 'color_id'):
+            images[image_id] = (product_id, color_id)
+            color_ids.add(color_id)
+        image_colors = set(images.values())
+
+        colors_by_name, colors_by_upper_name = {}, {}
+        if color_names:
+            for color in Color.objects.filter(any_of('color__iexact', color_names)).order_by('pk'):
+                colors_by_name[color.color] = color
+                colors_by_upper_name.setdefault(color.color.upper(), color)
+        colors_by_id = Color.objects.in_bulk(color_ids - {None})
+
+        created = {}
+        for line in lines:
+            row = line["row"]
+            product = line["product"]
+            color_name = self.value(row, 'color_name')
+            color_id_val = row.get('color_id')
+            image_id_val = row.get('image_id')
+
+            color_obj = None
+
+            # Try to match via existing product images first (Online mode)
+            if color_name:
+                target_color = colors_by_upper_name.get(str(color_name).strip().upper())
+                if target_color and (product.id, target_color.id) in image_colors:
+                    color_obj = target_color
+
+            if not color_obj and image_id_val:
+                product_id, color_id = images.get(ProductImage._meta.pk.get_prep_value(image_id_val), (None, None))
+                if product_id == product.id and color_id:
+                    color_obj = colors_by_id[color_id]
+
+            # If still not found, color does not match product's global catalog -> mark as local only
+            if not color_obj:
+                line["local"] = True
+                if color_name:
+                    name = str(color_name).strip()
+                    color_obj = colors_by_name.get(name) or created.get(name)
+                    if not color_obj:
+                        # Default grey for local colors
+                        color_obj = created[name] = Color(color=name, hex_code='#CCCCCC')
+                elif color_id_val:
+                    color_obj = colors_by_id.get(Color._meta.pk.get_prep_value(color_id_val))
+
+            if not color_obj:
+                # Still no color? Pick a default or skip
+                line["skip"] = {"item": line["item"], "reason": "No valid color found and no color name provided"}
+                continue
+            line["color"] = color_obj
+
+        if created:
+            Color.objects.bulk_create(created.values(), ignore_conflicts=True)
+            saved = Color.objects.in_bulk(list(created), field_name='color')
+            for line in lines:
+                if "color" in line and line["color"].pk is None:
+                    line["color"] = saved[line["color"].color]
+
+    # --- 3. Resolve Sizes ---
+    def resolve_sizes(self, lines):
+        # Dymanic size columns based on regex mapping
+        size_mapping = [
+            (self.cols['size_eu'], 'EU'),
+            (self.cols['size_usm'], 'USM'),
+            (self.cols['size_usw'], 'USW'),
+            (self.cols['size_us'], 'USM'),
+            (self.cols['size_us'], 'USW'),
+        ]
+        size_cols = [(c, t) for c, t in size_mapping if c]
+
+        wanted = set()
+        for line in lines:
+            relevant_types = relevant_size_types(line["product"].gender)
+            line["size_values"] = []
+            processed_columns_in_row = set()
+            for col, s_type in size_cols:
+                if s_type not in relevant_types or col in processed_columns_in_row:
+                    continue
+                val = str(line["row"].get(col))
+                if val and val != 'None' and val.strip():
+                    # A column only counts for its first relevant size type
+                    processed_columns_in_row.add(col)
+                    line["size_values"].append((s_type, val))
+                    wanted.add((s_type, val))
+        if not wanted:
+            for line in lines:
+                line["sizes"], line["size_fallback"] = [], False
+            return
+
+        # Size tables linked to each product through its images
+        product_tables = {}
+        for product_id, table_id in ProductImage.sizes.through.objects.filter(
+            productimage__product_id__in={line["product"].id for line in lines},
+        ).values_list('productimage__product_id', 'sizetable_id'):
+            product_tables.setdefault(product_id, set()).add(table_id)
+
+        # (type, value) -> [(table id, size id)], in the order .first() would pick them
+        sizes = {}
+        for size_id, table_id, s_type, value in Size.objects.filter(
+            type__in={s_type for s_type, _ in wanted}, value__in={value for _, value in wanted},
+        ).order_by('type', 'insole_min_mm', 'pk').values_list('id', 'table_id', 'type', 'value'):
+            sizes.setdefault((s_type, value), []).append((table_id, size_id))
+
+        for line in lines:
+            product = line["product"]
+            tables = product_tables.get(product.id, set())
+            line["sizes"] = []
+            line["size_fallback"] = False
+            for s_type, val in line["size_values"]:
+                candidates = sizes.get((s_type, val), [])
+                # Try to find size linked to product tables first
+                matching_size = next((size_id for table_id, size_id in candidates if table_id in tables), None)
+                if not matching_size:
+                    # Sizes outside the product's tables make the variant local only
+                    line["size_fallback"] = True
+                    if candidates:
+                        matching_size = candidates[0][1]
+                    else:
+                        size = Size.objects.create(
+                            table=self.get_local_size_table(product.brand_id),
+                            type=s_type,
+                            value=val,
+                            insole_min_mm=0,
+                            insole_max_mm=0
+                        )
+                        sizes[(s_type, val)] = [(size.table_id, size.id)]
+                        matching_size = size.id
+                line["sizes"].append(matching_size)
+
+    def get_local_size_table(self, brand_id):
+        if brand_id not in self.local_size_tables:
+            self.local_size_tables[brand_id], _ = SizeTable.objects.get_or_create(brand_id=brand_id, name="Local Sizes")
+        return self.local_size_tables[brand_id]
+
+    # --- 4. Resolve/Create PartnerProduct ---
+    def write_partner_products(self, lines):
+        if not lines:
+            return
+        existing = {
+            (pp.product_id, pp.color_id): pp
+            for pp in PartnerProduct.objects.filter(partner=self.partner, product_id__in={line["product"].id for line in lines})
+        }
+        eans = {str(self.value(line["row"], 'ean') or '').strip() for line in lines} - {''} - self.ean_owners.keys()
+        if eans:
+            for eanc, product_id, color_id in PartnerProduct.objects.filter(
+                partner=self.partner, eanc__in=eans,
+            ).values_list('eanc', 'product_id', 'color_id'):
+                self.ean_owners[eanc] = (product_id, color_id)
+
+        created, updated = {}, {}
+        for line in lines:
+            key = (line["product"].id, line["color"].id)
+            price = clean_price(self.value(line["row"], 'price'))
+            buy_price = clean_price(self.value(line["row"], 'buy_price'))
+            is_local_only = line["local"]
+
+            partner_product = existing.get(key) or created.get(key)
+            if partner_product is None:
+                partner_product = created[key] = PartnerProduct(
+                    partner=self.partner,
+                    product=line["product"],
+                    color=line["color"],
+                    price=price,
+                    buy_price=buy_price,
+                    online=not is_local_only,
+                    local=True,
+                    is_active=True
+                )
+                self.summary["new_partner_products"] += 1
+            else:
+                self.summary["updated_partner_products"] += 1
+                partner_product.price = price
+                partner_product.buy_price = buy_price
+                # If it was already online=False, keep it. If now it's newly local, set it.
+                if is_local_only:
+                    partner_product.online = False
+                if key in existing:
+                    updated[key] = partner_product
+
+            if is_local_only:
+                self.summary["local_only_count"] += 1
+
+            self.summary["color_updates"] += 1
+
+            eanc = str(self.value(line["row"], 'ean') or '').strip()
+            if eanc:
+                # EANs are unique per partner, the variant holding one keeps it
+                if self.ean_owners.setdefault(eanc, key) == key:
+                    partner_product.eanc = eanc
+                else:
+                    self.summary["ean_conflicts"] += 1
+
+            if line["size_fallback"]:
+                partner_product.online = False
+            line["partner_product"] = partner_product
+
+        now = timezone.now()
+        for partner_product in itertools.chain(created.values(), updated.values()):
+            # As PartnerProduct.save() does
+            partner_product.price = round(partner_product.price, 2)
+            partner_product.buy_price = round(partner_product.buy_price, 2)
+            partner_product.updated_at = now
+        fields = ['price', 'buy_price', 'online', 'eanc', 'updated_at']
+        PartnerProduct.objects.bulk_update(updated.values(), fields)
+        PartnerProduct.objects.bulk_create(
+            created.values(),
+            update_conflicts=True,
+            unique_fields=['partner', 'product', 'color'],
+            update_fields=fields,
+        )
+
+        if self.warehouse:
+            self.warehouse.product.add(*{line["partner_product"].pk for line in lines})
+
+    # --- 5. Stock per size ---
+    def write_stock(self, lines):
+        if not lines:
+            return
+        stock = self.existing_stock(lines)
+
+        created, increments = {}, {}
+        for line in lines:
+            quantity = clean_quantity(self.value(line["row"], 'quantity'))
+            if quantity <= 0:
+                continue
+            for size_id in line["sizes"]:
+                key = (line["partner_product"].pk, size_id)
+                if key in created:
+                    created[key].quantity += quantity
+                elif key in stock:
+                    # Add to existing quantity instead of overwriting
+                    increments[stock[key]] = increments.get(stock[key], 0) + quantity
+                else:
+                    created[key] = PartnerProductSize(partner_product_id=key[0], size_id=size_id, quantity=quantity)
+                self.summary["size_updates"] += 1
+
+        PartnerProductSize.objects.bulk_create(created.values())
+        if increments:
+            # Relative to the stored quantity, so concurrent barcode scans are kept
+            PartnerProductSize.objects.filter(pk__in=increments).update(quantity=shifted('quantity', increments))
+
+    def existing_stock(self, lines):
+        """PartnerProductSize id per (partner product id, size id) of the lines."""
+        stock = {}
+        for pps_id, pp_id, size_id in PartnerProductSize.objects.filter(
+            partner_product_id__in={line["partner_product"].pk for line in lines},
+        ).order_by('pk').values_list('id', 'partner_product_id', 'size_id'):
+            stock.setdefault((pp_id, size_id), pps_id)
+        return stock
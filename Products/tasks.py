@@ -0,0 +1,202 @@
+import os
+import logging
+import itertools
+from contextlib import closing
+from celery import shared_task
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import ImportJob, MatchModel, MatchScore, Product
+from .matching import (
+    MATERIALIZE_CHUNK_SIZE, Scoring, live_scorings, materialize_products, materialize_scan, publish_scoring,
+)
+from .stock_import import ImportReport, StockImport, UploadReadError, chunked, count_upload_rows, read_upload_rows
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_FIELDS = ('id', 'width', 'toe_box', 'fit_version', 'fit_profile')
+MATCH_MODEL_BATCH_SIZE = 200
+# Attempts after the first before a failing batch fails the whole activation
+MATCH_MODEL_BATCH_RETRIES = 3
+
+
+@shared_task
+def refresh_scan_match_scores(scan_id):
+    """
+    Score every active product for one foot scan.
+    Runs when a FootScan is created or its measurements change.
+    """
+    from Others.models import FootScan
+
+    scan = FootScan.objects.filter(id=scan_id).first()
+    if not scan:
+        return f"FootScan {scan_id} no longer exists"
+
+    written = 0
+    for scoring in live_scorings():
+        products = Product.objects.filter(is_active=True).only(*PRODUCT_FIELDS)
+        written += materialize_scan(scan, products.iterator(chunk_size=MATERIALIZE_CHUNK_SIZE), scoring)
+    logger.info(f"Materialized {written} match scores for FootScan {scan_id}.")
+    return f"Materialized {written} match scores for FootScan {scan_id}"
+
+
+@shared_task
+def rescore_products(product_ids):
+    """
+    Re-score the given products for every foot scan.
+    Runs when size data, size tables or a product's width/toe box change.
+    """
+    from Others.models import FootScan
+
+    products = list(Product.objects.filter(id__in=product_ids).only(*PRODUCT_FIELDS))
+    if not products:
+        return "No products to re-score"
+
+    written = 0
+    for scoring in live_scorings():
+        scans = FootScan.objects.all().iterator(chunk_size=MATERIALIZE_CHUNK_SIZE)
+        written += materialize_products(products, scans, scoring)
+    logger.info(f"Re-scored {len(products)} products, {written} match scores written.")
+    return f"Re-scored {len(products)} products, {written} match scores written"
+
+
+# --- MATCH MODEL ACTIVATION ---
+@shared_task
+def activate_match_model(model_id, run):
+    """
+    Fan the re-score of a newly activated MatchModel out into product
+    batches that workers run in parallel. The version goes live when the
+    last batch finishes, so the cache and MatchScore rows are already warm.
+    A batch that keeps failing marks the version FAILED instead.
+    """
+    model = MatchModel.objects.filter(id=model_id, status=MatchModel.Status.WARMING, warming_run=run).first()
+    if not model:
+        return f"MatchModel {model_id} is not warming"
+
+    product_ids = list(Product.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+    batches = [
+        product_ids[start:start + MATCH_MODEL_BATCH_SIZE]
+        for start in range(0, len(product_ids), MATCH_MODEL_BATCH_SIZE)
+    ]
+    if not batches:
+        finish_match_model_activation(model_id)
+        return f"MatchModel v{model.version} activated, no products to score"
+
+    MatchModel.objects.filter(id=model_id, warming_run=run).update(pending_batches=len(batches))
+    for batch in batches:
+        rescore_match_model_batch.delay(model_id, run, batch)
+    return f"MatchModel v{model.version}: {len(batches)} re-score batches queued"
+
+
+@shared_task(bind=True, max_retries=MATCH_MODEL_BATCH_RETRIES, default_retry_delay=60)
+def rescore_match_model_batch(self, model_id, run, product_ids):
+    from Others.models import FootScan
+
+    warming = MatchModel.objects.filter(id=model_id, status=MatchModel.Status.WARMING, warming_run=run)
+    model = warming.first()
+    if not model:
+        return f"MatchModel {model_id} is not warming"
+
+    try:
+        products = list(Product.objects.filter(id__in=product_ids).only(*PRODUCT_FIELDS))
+        scans = FootScan.objects.all().iterator(chunk_size=MATERIALIZE_CHUNK_SIZE)
+        written = materialize_products(products, scans, Scoring.from_model(model), warm_cache=True)
+    except Exception as e:
+        # Scores are upserted, a retry rewrites the same rows
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        logger.exception(f"MatchModel v{model.version}: re-score batch failed, activation aborted")
+        warming.update(status=MatchModel.Status.FAILED, pending_batches=0)
+        return f"MatchModel v{model.version} failed: {e}"
+
+    warming.update(pending_batches=F('pending_batches') - 1)
+    if warming.filter(pending_batches=0).exists():
+        finish_match_model_activation(model_id)
+    return f"MatchModel v{model.version}: {written} match scores written"
+
+
+def finish_match_model_activation(model_id):
+    """Swap the warmed version in and drop the rows of the old ones."""
+    with transaction.atomic():
+        # Only one of the racing last batches gets to flip the status
+        flipped = MatchModel.objects.filter(id=model_id, status=MatchModel.Status.WARMING).update(
+            status=MatchModel.Status.ACTIVE, activated_at=timezone.now()
+        )
+        if not flipped:
+            return
+        MatchModel.objects.filter(status=MatchModel.Status.ACTIVE).exclude(id=model_id).update(
+            status=MatchModel.Status.RETIRED
+        )
+        model = MatchModel.objects.get(id=model_id)
+        transaction.on_commit(lambda: publish_scoring(Scoring.from_model(model).as_dict()))
+
+    keep = [model.version, *MatchModel.objects.filter(status=MatchModel.Status.WARMING).values_list('version', flat=True)]
+    deleted, _ = MatchScore.objects.exclude(model_version__in=keep).delete()
+    logger.info(f"MatchModel v{model.version} is live, {deleted} old match scores removed.")
+
+
+# --- PARTNER STOCK IMPORTS ---
+@shared_task
+def run_import_job(job_id):
+    """
+    Process an uploaded stock file. Each chunk of rows is saved in its own
+    transaction together with the job's progress, so a failure keeps the
+    chunks before it and the status endpoint only reports committed rows.
+    A failed job queued again resumes after its processed rows.
+    """
+    # Claim the job, so a redelivered task does not import the file twice
+    if not ImportJob.objects.filter(id=job_id, status=ImportJob.Status.PENDING).update(status=ImportJob.Status.RUNNING):
+        return f"ImportJob {job_id} is not pending"
+    job = ImportJob.objects.select_related('partner', 'warehouse').get(id=job_id)
+    resume_at = job.processed_rows
+    previous_report = job.report.name
+
+    report = ImportReport()
+    try:
+        if resume_at and previous_report:
+            with job.report.open('rb') as previous:
+                report.carry_over(previous, resume_at)
+        with job.file.open('rb') as file:
+            job.total_rows = count_upload_rows(file)
+            job.save(update_fields=['total_rows', 'updated_at'])
+
+            # Closed here, before the file, also when a chunk fails
+            with closing(read_upload_rows(file)) as upload_rows:
+                first_row = next(upload_rows, None)
+                if first_row is None:
+                    raise UploadReadError("No data found in file")
+
+                stock_import = StockImport(job.partner, list(first_row.keys()), job.warehouse, on_skip=report)
+                job.matched_columns = stock_import.cols
+                rows = itertools.chain([first_row], upload_rows)
+                if resume_at:
+                    # The rows before are imported already, by the run that failed
+                    stock_import.resume(resume_at, job.summary, job.skipped_details)
+                    rows = itertools.islice(rows, resume_at, None)
+                for chunk in chunked(rows):
+                    with transaction.atomic():
+                        stock_import.process_chunk(chunk)
+                        job.processed_rows = stock_import.summary["total_rows"]
+                        job.summary = stock_import.summary
+                        job.skipped_details = stock_import.skipped_details
+                        job.save(update_fields=['processed_rows', 'matched_columns', 'summary', 'skipped_details', 'updated_at'])
+        job.status = ImportJob.Status.COMPLETED
+    except Exception as e:
+        if not isinstance(e, UploadReadError):
+            logger.exception(f"ImportJob {job_id} failed")
+        job.status = ImportJob.Status.FAILED
+        job.error = str(e)
+
+    try:
+        report.file.seek(0)
+        name = f"{os.path.splitext(os.path.basename(job.file.name))[0]}-report.csv"
+        job.report.save(name, File(report.file), save=False)
+    finally:
+        report.close()
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'report', 'finished_at', 'updated_at'])
+    if previous_report and previous_report != job.report.name:
+        job.report.storage.delete(previous_report)
+    logger.info(f"ImportJob {job_id} {job.status}: {job.processed_rows} rows processed.")
+    return f"ImportJob {job_id} {job.status}, {job.processed_rows} rows processed"
@@ -1,3 +1,621 @@
-from django.test import TestCase
+from io import BytesIO
+from unittest import mock
+from decimal import Decimal
+import openpyxl
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from core.renderers import ORJSONRenderer
+from core.testing import QueryBudgetMixin
+from Brands.models import Brand
+from Others.models import Accessories, FootScan
+from django.contrib.auth import get_user_model
+from .models import *
+from .match_sql import match_score_expression
+from .listing import rebuild_product_listings
+from .name_matcher import ProductNameMatcher
+from .matching import FitMatrix, ScanProfile, Scoring, match_products, rank_matrix
+from .search import search_backend
+from .serializers import ProductListingSerializer
+from .stock_import import StockImport, UploadFormatError, UploadReadError, chunked, read_upload_rows
+from .tasks import run_import_job
 
-# Create your tests here.
+User = get_user_model()
+
+
+class MatchScoreExpressionTests(TestCase):
+    """The SQL match score must agree with Product.match_with_scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="scan@example.com", role="customer", is_active=True)
+        brand = Brand.objects.create(name="Parity")
+        category, _ = Category.objects.get_or_create(slug="everyday-shoes", defaults={"name": "Everyday"})
+        sub_category, _ = SubCategory.objects.get_or_create(
+            slug="casual-sneaker", defaults={"name": "Casual", "category": category}
+        )
+
+        tables = []
+        for name, base in (("Standard", 215), ("Long", 232)):
+            table = SizeTable.objects.create(brand=brand, name=name)
+            for step in range(10):
+                Size.objects.create(
+                    table=table, type="EU", value=str(36 + step),
+                    insole_min_mm=base + step * 7, insole_max_mm=base + step * 7 + 6
+                )
+            tables.append(table)
+
+        # Every width and toe box, with zero, one and two size tables
+        for width in Width.values:
+            for toe_box in ToeBox.values:
+                for linked in (tables[:0], tables[:1], tables):
+                    product = Product.objects.create(
+                        name=f"Shoe {width} {toe_box} {len(linked)}", brand=brand, description="-",
+                        sub_category=sub_category, main_category=category,
+                        width=width, toe_box=toe_box,
+                    )
+                    image = ProductImage.objects.create(product=product, image="shoe.png")
+                    image.sizes.add(*linked)
+
+    def scan(self, length, width):
+        return FootScan(
+            user=self.user, left_length=Decimal(length), right_length=Decimal(length),
+            left_width=Decimal(width), right_width=Decimal(width),
+        )
+
+    def assert_parity(self, scan):
+        products = Product.objects.annotate(match_score=match_score_expression(scan, None))
+        self.assertTrue(products)
+        for product in products:
+            expected = product.match_with_scan(scan)["score"]
+            self.assertAlmostEqual(product.match_score, expected, msg=product.name)
+
+    def test_parity_across_lengths(self):
+        # Inside a range, on its edges, in every deviation band and out of reach
+        for length in ("180", "216", "221", "221.5", "225", "249.3", "260", "300", "400"):
+            scan = FootScan(
+                user=self.user, left_length=Decimal(length), right_length=Decimal(length),
+                left_width=Decimal("98"), right_width=Decimal("97"),
+            )
+            with self.subTest(length=length):
+                self.assert_parity(scan)
+
+    def test_parity_across_widths(self):
+        for width in ("80", "92", "97", "102", "115"):
+            scan = FootScan(
+                user=self.user, left_length=Decimal("251"), right_length=Decimal("250"),
+                left_width=Decimal(width), right_width=Decimal(width),
+            )
+            with self.subTest(width=width):
+                self.assert_parity(scan)
+
+    def test_parity_with_custom_match_model(self):
+        scoring = Scoring(
+            version=7, length_weight=70, width_weight=20, toe_box_weight=10,
+            length_bands_mm=[5, 10], width_ratio_thresholds=[0.36, 0.38, 0.40, 0.42],
+            toe_box_ratio_thresholds=[0.37, 0.43],
+        )
+        products = list(Product.objects.annotate(
+            match_score=match_score_expression(self.scan("240", "95"), None, scoring)
+        ))
+        expected = rank_matrix(FitMatrix.from_products(products), ScanProfile(self.scan("240", "95"), scoring))
+        for product in products:
+            self.assertAlmostEqual(product.match_score, expected[product.id]["score"], msg=product.name)
+
+
+class MatchModelActivationTests(TestCase):
+    """A re-score batch that keeps failing fails the activation instead of leaving it warming."""
+
+    def test_failed_batch_fails_activation_and_restart(self):
+        brand = Brand.objects.create(name="Warming")
+        Product.objects.create(name="Warming Runner", brand=brand, description="d", gender="male")
+        model = MatchModel.objects.create(version=2)
+
+        with mock.patch("Products.tasks.materialize_products", side_effect=RuntimeError("db gone")) as materialize:
+            with self.captureOnCommitCallbacks(execute=True):
+                model.activate()
+        model.refresh_from_db()
+        self.assertEqual((model.status, model.pending_batches), (MatchModel.Status.FAILED, 0))
+        self.assertEqual(materialize.call_count, 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            model.activate()
+        model.refresh_from_db()
+        self.assertEqual((model.status, model.warming_run), (MatchModel.Status.ACTIVE, 2))
+
+    def test_length_bands_are_whole_millimetres(self):
+        MatchModel(version=3, length_bands_mm=[4, 8, 12]).clean()
+        for bands in ([2.5, 5], [True, 4], [4, 0]):
+            with self.assertRaises(ValidationError):
+                MatchModel(version=3, length_bands_mm=bands).clean()
+
+
+class ProductSearchTests(TestCase):
+    """The search backend of the test database (SQLite FTS5) behind ?search=."""
+
+    @classmethod
+    def setUpTestData(cls):
+        partner = User.objects.create(email="partner@example.com", role="partner", is_active=True)
+        brand = Brand.objects.create(name="Lowa")
+        color = Color.objects.create(color="black", hex_code="#000000")
+        category, _ = Category.objects.get_or_create(slug="sports-shoes", defaults={"name": "Sports"})
+        sub_category, _ = SubCategory.objects.get_or_create(
+            slug="running-shoes", defaults={"name": "Running", "category": category}
+        )
+        for name, description in (
+            ("Trailrunner GTX", "Wasserdichter Laufschuh für Trails"),
+            ("City Sneaker", "Leichter Schuh für die Stadt"),
+        ):
+            product = Product.objects.create(
+                name=name, brand=brand, description=description,
+                sub_category=sub_category, main_category=category,
+            )
+            PartnerProduct.objects.create(product=product, partner=partner, color=color, price=Decimal("99"))
+        # Signals refresh listings on commit, which never comes inside a TestCase
+        rebuild_product_listings()
+
+    def search(self, term):
+        return [listing.name for listing in search_backend().search(ProductListing.objects.all(), term)]
+
+    def test_matches_name_prefix_and_description(self):
+        self.assertEqual(self.search("trail"), ["Trailrunner GTX"])
+        self.assertEqual(self.search("stadt"), ["City Sneaker"])
+        self.assertEqual(sorted(self.search("lowa")), ["City Sneaker", "Trailrunner GTX"])
+
+    def test_follows_listing_updates(self):
+        product = Product.objects.get(name="City Sneaker")
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = "Urban Runner"
+            product.save()
+        self.assertEqual(self.search("urban"), ["Urban Runner"])
+        self.assertEqual(self.search("sneaker"), [])
+
+
+class CatalogQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Catalog routes must stay within the query budget their views declare."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="budget@example.com", role="customer", is_active=True)
+        partner = User.objects.create(email="budget-partner@example.com", role="partner", is_active=True)
+        brand = Brand.objects.create(name="Budget")
+        colors = [Color.objects.create(color=name, hex_code="#000000") for name in ("black", "white")]
+        category, _ = Category.objects.get_or_create(slug="everyday-shoes", defaults={"name": "Everyday"})
+        sub_category, _ = SubCategory.objects.get_or_create(
+            slug="casual-sneaker", defaults={"name": "Casual", "category": category}
+        )
+        table = SizeTable.objects.create(brand=brand, name="Standard")
+        sizes = [
+            Size.objects.create(table=table, type="EU", value=str(38 + step), insole_min_mm=240 + step * 7, insole_max_mm=246 + step * 7)
+            for step in range(4)
+        ]
+        for index in range(15):
+            product = Product.objects.create(
+                name=f"Budget Shoe {index}", brand=brand, description="-",
+                sub_category=sub_category, main_category=category,
+            )
+            for color in colors:
+                ProductImage.objects.create(product=product, image="shoe.png", color=color).sizes.add(table)
+                variant = PartnerProduct.objects.create(
+                    product=product, partner=partner, color=color, price=Decimal(50 + index)
+                )
+                for size in sizes:
+                    PartnerProductSize.objects.create(partner_product=variant, size=size, color=color, quantity=2)
+        FootScan.objects.create(
+            user=cls.user, left_length=Decimal("255"), right_length=Decimal("254"),
+            left_width=Decimal("98"), right_width=Decimal("97"),
+        )
+        rebuild_product_listings()
+        cls.product = Product.objects.first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_listing(self):
+        self.assertWithinQueryBudget(self.client, "/api/products/?limit=15")
+        self.assertWithinQueryBudget(self.client, "/api/products/?limit=15&match=true")
+
+    def test_facets(self):
+        data = self.assertWithinQueryBudget(self.client, "/api/products/facets/").data
+        self.assertEqual(data["count"], 15)
+        self.assertEqual(data["facets"]["brand"], [{"value": "Budget", "count": 15}])
+        self.assertEqual(data["facets"]["color"], [{"value": "black", "count": 15}, {"value": "white", "count": 15}])
+        self.assertEqual([(size["value"], size["count"]) for size in data["facets"]["size"]], [("38", 15), ("39", 15), ("40", 15), ("41", 15)])
+        self.assertEqual([(width["value"], width["count"]) for width in data["facets"]["width"]], [(Width.NORMAL, 15)])
+        self.assertEqual(self.client.get("/api/products/facets/?search=zzzz").data["count"], 0)
+
+    def test_detail_cache_hit_runs_no_catalog_queries(self):
+        url = f"/api/products/{self.product.id}/"
+        self.assertWithinQueryBudget(self.client, url)
+        self.assertWithinQueryBudget(self.client, url, budget=2)
+
+
+class ListingRowsTests(TestCase):
+    """The .values()/orjson listing path must render the serializer's exact bytes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="rows@example.com", role="customer", is_active=True)
+        partner = User.objects.create(email="rows-partner@example.com", role="partner", is_active=True)
+        brand = Brand.objects.create(name="Rows")
+        color = Color.objects.create(color="schwarz grün", hex_code="#000000")
+        category, _ = Category.objects.get_or_create(slug="everyday-shoes", defaults={"name": "Everyday"})
+        sub_category, _ = SubCategory.objects.get_or_create(
+            slug="casual-sneaker", defaults={"name": "Casual", "category": category}
+        )
+        table = SizeTable.objects.create(brand=brand, name="Standard")
+        size = Size.objects.create(table=table, type="EU", value="42", insole_min_mm=262, insole_max_mm=268)
+        for index, price in enumerate((Decimal("89.9"), Decimal("120"))):
+            product = Product.objects.create(
+                name=f"Röw Shoe {index}", brand=brand, description="-",
+                sub_category=sub_category, main_category=category,
+            )
+            ProductImage.objects.create(product=product, image="shoe.png", color=color).sizes.add(table)
+            variant = PartnerProduct.objects.create(product=product, partner=partner, color=color, price=price)
+            PartnerProductSize.objects.create(partner_product=variant, size=size, color=color, quantity=1)
+        Favorite.objects.get_or_create(user=cls.user)[0].products.add(Product.objects.first())
+        FootScan.objects.create(
+            user=cls.user, left_length=Decimal("262"), right_length=Decimal("261"),
+            left_width=Decimal("99"), right_width=Decimal("98"),
+        )
+        rebuild_product_listings()
+
+    def test_matches_serializer_bytes(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        scan = FootScan.objects.get(user=self.user)
+        request = client.get("/api/products/").wsgi_request
+        listings = list(ProductListing.objects.select_related('product').order_by('-pk'))
+        context = {
+            "request": request, "scan": scan,
+            "match_scores": match_products(scan, [listing.product for listing in listings]),
+            "favorite_ids": set(Favorite.objects.filter(user=self.user).values_list('products__id', flat=True)),
+        }
+        expected = ProductListingSerializer(listings, many=True, context=context).data
+
+        response = client.get("/api/products/")
+        self.assertEqual(response.content, JSONRenderer().render({
+            "count": len(listings), "next": None, "previous": None, "results": expected,
+        }))
+        self.assertEqual(response.content, ORJSONRenderer().render(response.data))
+
+    def test_sparse_fieldset_skips_scoring_and_favourites(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # count and page only: no scan, favourites or scoring queries
+        with self.assertNumQueries(2):
+            response = client.get("/api/products/?fields=id,name,price")
+        self.assertEqual([sorted(item) for item in response.data["results"]], [["id", "name", "price"]] * 2)
+
+        response = client.get("/api/products/?omit=match_data,color")
+        self.assertNotIn("match_data", response.data["results"][0])
+        self.assertIn("favourite", response.data["results"][0])
+
+
+class StockUploadReaderTests(SimpleTestCase):
+    """Partner stock files are read as row streams, whatever their format."""
+
+    def test_csv_and_xlsx_rows(self):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["Item Name", "Qty"])
+        for index in range(5):
+            workbook.active.append([f"Shoe {index}", index])
+        content = BytesIO()
+        workbook.save(content)
+        csv_content = "Item Name,Qty\n" + "".join(f"Shoe {index},{index}\n" for index in range(5))
+
+        for upload, quantity in (
+            (SimpleUploadedFile("stock.csv", csv_content.encode()), "3"),
+            (SimpleUploadedFile("stock.xlsx", content.getvalue()), 3),
+        ):
+            chunks = list(chunked(read_upload_rows(upload), size=2))
+            self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+            self.assertEqual(chunks[1][1], {"Item Name": "Shoe 3", "Qty": quantity})
+
+    def test_read_errors(self):
+        with self.assertRaises(UploadReadError):
+            list(read_upload_rows(SimpleUploadedFile("stock.csv", b"Item Name\n\xff\n")))
+        with self.assertRaises(UploadReadError):
+            list(read_upload_rows(SimpleUploadedFile("stock.xlsx", b"not a workbook")))
+        with self.assertRaises(UploadFormatError):
+            read_upload_rows(SimpleUploadedFile("stock.pdf", b""))
+
+
+class StockImportQueryTests(TestCase):
+    """Chunks are imported with set-based queries, their number does not grow with the rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name="Import Brand")
+        table = SizeTable.objects.create(brand=brand, name="Standard")
+        for index, value in enumerate(range(38, 46)):
+            Size.objects.create(table=table, type="EU", value=str(value), insole_min_mm=240 + index * 7, insole_max_mm=246 + index * 7)
+        cls.color = Color.objects.create(color="Import Black", hex_code="#000000")
+        cls.products = []
+        for index in range(10):
+            product = Product.objects.create(name=f"Import Runner {index}", brand=brand, description="d", gender="male")
+            image = ProductImage.objects.create(product=product, image="x.png", color=cls.color)
+            image.sizes.add(table)
+            cls.products.append(product)
+
+    def run_import(self, partner, count):
+        rows = [
+            {"Item Name": self.products[index % 10].name, "Color": "import black", "Price": "99,90", "Qty": "2", "Size EU": str(38 + index % 8)}
+            for index in range(count)
+        ]
+        stock_import = StockImport(partner, list(rows[0]))
+        with CaptureQueriesContext(connection) as queries:
+            stock_import.process_chunk(rows)
+        return stock_import.summary, len(queries)
+
+    def test_queries_do_not_grow_with_rows(self):
+        small, small_queries = self.run_import(User.objects.create(email="import-small@example.com", role="partner"), 20)
+        large, large_queries = self.run_import(User.objects.create(email="import-large@example.com", role="partner"), 400)
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(large["matched_products"], 400)
+        self.assertEqual((large["new_partner_products"], large["updated_partner_products"]), (10, 390))
+        self.assertEqual(large["size_updates"], 400)
+        self.assertEqual(large["local_only_count"], 0)
+        # 40 (product, size) pairs, 10 rows of 2 each
+        quantities = PartnerProductSize.objects.filter(partner_product__partner__email="import-large@example.com").values_list("quantity", flat=True)
+        self.assertEqual(sorted(quantities), [20] * 40)
+
+    def test_ean_first_and_match_confidence(self):
+        partner = User.objects.create(email="import-ean@example.com", role="partner")
+        PartnerProduct.objects.create(partner=partner, product=self.products[3], color=self.color, eanc="4006381333931")
+        rows = [
+            {"Item Name": "Renamed by the supplier", "Color": "Import Black", "EAN": "4006381333931", "Qty": "1", "Size EU": "40"},
+            {"Item Name": "IMPORT-RUNNER 5", "Color": "Import Black", "EAN": "", "Qty": "1", "Size EU": "40"},
+            {"Item Name": "Import Runer 6", "Color": "Import Black", "EAN": "", "Qty": "1", "Size EU": "40"},
+            {"Item Name": "Import Runner 60", "Color": "Import Black", "EAN": "", "Qty": "1", "Size EU": "40"},
+        ]
+        stock_import = StockImport(partner, list(rows[0]))
+        stock_import.process_chunk(rows)
+
+        carried = PartnerProduct.objects.filter(partner=partner).values_list("product__name", flat=True)
+        self.assertEqual(sorted(carried), ["Import Runner 3", "Import Runner 5", "Import Runner 6", "Import Runner 60"])
+        self.assertEqual(stock_import.summary["created_products"], 1)
+        confidence = stock_import.summary["match_confidence"]
+        self.assertEqual((confidence["ean"], confidence["exact"], confidence["fuzzy"]), (1, 1, 1))
+        self.assertLess(confidence["fuzzy_score_min"], 1)
+
+
+class ProductNameMatcherTests(SimpleTestCase):
+    """Import name matching is exact on normalized names, then fuzzy above the threshold."""
+
+    def setUp(self):
+        self.matcher = ProductNameMatcher()
+        for key, name in enumerate(["Gel-Kayano 30", "Gel Kayano 29", "Air Max 90", "Cloudrunner X", "Cloudrunner Y"], 1):
+            self.matcher.add(key, name)
+
+    def test_exact_and_fuzzy(self):
+        self.assertEqual(self.matcher.match("  GEL kayano-30 "), (1, "exact", 1.0))
+        self.assertEqual(self.matcher.match("Àir  Max 90"), (3, "exact", 1.0))
+        key, method, score = self.matcher.match("Gel Kayno 29")
+        self.assertEqual((key, method), (2, "fuzzy"))
+        self.assertGreaterEqual(score, 0.6)
+        # As close to two products: the first added wins
+        self.assertEqual(self.matcher.match("Cloudrunner Z")[:2], (4, "fuzzy"))
+
+    def test_model_numbers_and_threshold(self):
+        self.assertIsNone(self.matcher.match("Gel Kayano 31"))
+        self.assertIsNone(self.matcher.match("Air Max"))
+        self.assertIsNone(self.matcher.match("Court Classic"))
+        self.assertIsNone(self.matcher.match(" - "))
+
+
+class ImportJobTests(TestCase):
+    """Stock uploads are queued as import jobs, processed and reported in the background."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.partner = User.objects.create(email="import-partner@example.com", role="partner", is_active=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.partner)
+
+    def tearDown(self):
+        for job in ImportJob.objects.all():
+            job.file.delete(save=False)
+            if job.report:
+                job.report.delete(save=False)
+
+    def upload(self, content, **data):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post("/api/products/partner/upload/", {
+                "file": SimpleUploadedFile("stock.csv", content.encode()), **data,
+            }, format="multipart")
+        self.assertEqual(response.status_code, 202)
+        return response, callbacks
+
+    def test_job_progress_report_and_resubmission(self):
+        content = "Item Name,Color,Price,Qty,Size EU\nRunner,Red,99.90,2,42\n,Blue,10,1,40\nRunner,Red,99.90,3,43\n"
+        response, callbacks = self.upload(content)
+        self.assertEqual(len(callbacks), 1)
+        job_id = response.data["job_id"]
+        self.assertEqual(response.data["status"], ImportJob.Status.PENDING)
+
+        run_import_job(job_id)
+        status_data = self.client.get(f"/api/products/partner/upload/{job_id}/").data
+        self.assertEqual(status_data["status"], ImportJob.Status.COMPLETED)
+        self.assertEqual((status_data["total_rows"], status_data["processed_rows"], status_data["progress"]), (3, 3, 100))
+        self.assertEqual(status_data["summary"]["skipped_rows"], 1)
+        self.assertEqual(status_data["summary"]["size_updates"], 2)
+        self.assertEqual(PartnerProductSize.objects.filter(partner_product__partner=self.partner).count(), 2)
+
+        report = self.client.get(f"/api/products/partner/upload/{job_id}/report/")
+        self.assertEqual(report.status_code, 200)
+        lines = b"".join(report.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "line,item,reason,row")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("3,,Missing item name column or value,"))
+
+        # Same content again: the finished job is returned, nothing is re-imported
+        response, callbacks = self.upload(content)
+        self.assertEqual((response.data["job_id"], response.data["reused"]), (job_id, True))
+        self.assertEqual(len(callbacks), 0)
+        self.assertEqual(ImportJob.objects.count(), 1)
+
+    def test_failed_job_resumes_on_reupload(self):
+        content = "Item Name,Color,Price,Qty,Size EU\n,Blue,10,1,40\nRunner,Red,99.90,2,42\nRunner,Red,99.90,3,43\n"
+        response, _ = self.upload(content)
+        job_id = response.data["job_id"]
+
+        process_chunk = StockImport.process_chunk
+        calls = []
+
+        def dies_on_third_chunk(stock_import, rows):
+            calls.append(rows)
+            if len(calls) == 3:
+                raise RuntimeError("worker lost")
+            process_chunk(stock_import, rows)
+
+        with mock.patch("Products.tasks.chunked", lambda rows: chunked(rows, 1)):
+            with mock.patch.object(StockImport, "process_chunk", dies_on_third_chunk):
+                run_import_job(job_id)
+            job = ImportJob.objects.get(id=job_id)
+            self.assertEqual((job.status, job.processed_rows), (ImportJob.Status.FAILED, 2))
+
+            response, callbacks = self.upload(content)
+            self.assertEqual((response.data["job_id"], response.data["resumed"]), (job_id, True))
+            self.assertEqual(response.data["status"], ImportJob.Status.PENDING)
+            self.assertEqual(len(callbacks), 1)
+            run_import_job(job_id)
+
+        job = ImportJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.processed_rows, job.error), (ImportJob.Status.COMPLETED, 3, ""))
+        self.assertEqual((job.summary["total_rows"], job.summary["skipped_rows"], job.summary["size_updates"]), (3, 1, 2))
+        quantities = PartnerProductSize.objects.filter(partner_product__partner=self.partner).values_list("size__value", "quantity")
+        self.assertEqual(sorted(quantities), [("42", 2), ("43", 3)])
+        # The skipped row of the failed run is still reported
+        report = b"".join(self.client.get(f"/api/products/partner/upload/{job_id}/report/").streaming_content).decode().splitlines()
+        self.assertEqual(len(report), 2)
+        self.assertTrue(report[1].startswith("2,,Missing item name column or value,"))
+
+    def test_concurrent_upload_without_job_conflicts(self):
+        # The competing upload's job is gone by the time this one looks it up
+        with mock.patch.object(ImportJob, "save", side_effect=IntegrityError):
+            response = self.client.post("/api/products/partner/upload/", {
+                "file": SimpleUploadedFile("stock.csv", b"Item Name,Qty\nRunner,1\n"),
+            }, format="multipart")
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_same_file_for_another_warehouse_is_imported(self):
+        from Others.models import Warehouse
+
+        content = "Item Name,Color,Price,Qty,Size EU\nRunner,Red,99.90,2,42\n"
+        first, second = (Warehouse.objects.create(partner=self.partner, name=name, address="-") for name in ("North", "South"))
+        job_ids = []
+        for warehouse, reused in ((first, False), (second, False), (first, True)):
+            response, _ = self.upload(content, warehouse_id=warehouse.id)
+            self.assertEqual(response.data["reused"], reused)
+            job_ids.append(response.data["job_id"])
+        self.assertNotEqual(job_ids[0], job_ids[1])
+        self.assertEqual(job_ids[0], job_ids[2])
+        self.assertEqual(list(ImportJob.objects.order_by('id').values_list('warehouse', flat=True)), [first.id, second.id])
+
+
+class BarcodeScanTests(TestCase):
+    """Barcode scans adjust stock in one transaction, with a fixed number of queries per batch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.partner = User.objects.create(email="scan-partner@example.com", role="partner", is_active=True)
+        brand = Brand.objects.create(name="Scan Brand")
+        table = SizeTable.objects.create(brand=brand, name="Standard")
+        cls.sizes = {
+            value: Size.objects.create(table=table, type="EU", value=value, insole_min_mm=250 + index * 7, insole_max_mm=256 + index * 7)
+            for index, value in enumerate(["40", "41", "42"])
+        }
+        color = Color.objects.create(color="Scan Blue", hex_code="#0000FF")
+        product = Product.objects.create(name="Scan Runner", brand=brand, description="d", gender="male")
+        ProductImage.objects.create(product=product, image="x.png", color=color).sizes.add(table)
+        cls.variant = PartnerProduct.objects.create(partner=cls.partner, product=product, color=color, eanc="4006381333931")
+        cls.stock = PartnerProductSize.objects.create(partner_product=cls.variant, size=cls.sizes["40"], quantity=5)
+        cls.accessory = Accessories.objects.create(partner=cls.partner, name="Laces", brand=brand, eanc="4000000000017", stock=3, image="x.png")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.partner)
+
+    def scan(self, scans):
+        return self.client.post("/api/products/partner/scan/", {"scans": scans}, format="json")
+
+    def test_batch_applies_deltas_and_rejects_bad_scans(self):
+        response = self.scan([
+            {"ean": "4006381333931", "size": "EU 40", "delta": -2},
+            {"ean": "4006381333931", "size": "40", "delta": -1},
+            {"ean": "4006381333931", "size": "EU 41", "delta": 4},
+            {"ean": "4000000000017", "delta": -5},
+            {"ean": "9999999999999", "size": "40", "delta": 1},
+            {"ean": "4006381333931", "delta": 1},
+            {"ean": "4006381333931", "size": "42", "delta": -1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item["index"], item["quantity"]) for item in response.data["results"]], [(0, 2), (1, 2), (2, 4), (3, 0)])
+        self.assertEqual([item["index"] for item in response.data["rejected"]], [4, 5, 6])
+
+        self.stock.refresh_from_db()
+        self.accessory.refresh_from_db()
+        self.assertEqual((self.stock.quantity, self.accessory.stock), (2, 0))
+        self.assertEqual(PartnerProductSize.objects.get(partner_product=self.variant, size=self.sizes["41"]).quantity, 4)
+
+    def test_queries_do_not_grow_with_scans(self):
+        def count_queries(repeat):
+            scans = [
+                {"ean": "4006381333931", "size": "EU 40", "delta": 1},
+                {"ean": "4000000000017", "delta": 1},
+            ] * repeat
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.scan(scans).status_code, 200)
+            return len(queries)
+
+        self.assertEqual(count_queries(1), count_queries(300))
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 5 + 301)
+
+    def test_scan_during_import_is_kept(self):
+        test = self
+
+        class ScannedMidImport(StockImport):
+            def existing_stock(self, lines):
+                stock = super().existing_stock(lines)
+                # A till sells two pairs after the import read the stock
+                test.scan([{"ean": "4006381333931", "size": "EU 40", "delta": -2}])
+                return stock
+
+        rows = [{"Item Name": "Scan Runner", "Color": "Scan Blue", "Qty": "3", "Size EU": "40"}]
+        ScannedMidImport(self.partner, list(rows[0])).process_chunk(rows)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 5 - 2 + 3)
+
+    def test_ean_unique_per_partner(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PartnerProduct.objects.create(partner=self.partner, product=self.variant.product, color=Color.objects.create(color="Scan Red", hex_code="#FF0000"), eanc="4006381333931")
+        response = self.client.patch(
+            f"/api/products/partner/{self.variant.product_id}/add/",
+            {"price": 10, "color": "Scan Green", "sizes": {"EU 41": 1}, "eanc": "4006381333931"}, format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["error"], "This EAN is already used by another of your products.")
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    """/metrics is closed unless a scrape token is configured."""
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_unset_token_hides_endpoint(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_token_required(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
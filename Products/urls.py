@@ -7,7 +7,9 @@ urlpatterns = [
     path('',ProductListView.as_view()),
     path('<int:id>/',ProductDetailView.as_view()),
     path("count/", ProductsCountView.as_view(), name="products_count"),
+    path("facets/", ProductFacetsView.as_view(), name="products_facets"),
     path('favorites/', FavoriteUpdateView.as_view(), name='favorite-add-remove'),
+    path('match/batch/', MatchBatchView.as_view(), name='match_batch'),
     path("footscans/", FootScanListCreateView.as_view(), name="foot_scan_list_create"),
     path('qna-match/', ProductQnAFilterAPIView.as_view(), name='answer-autocomplete'),
     path('suggestions/<int:product_id>/', SuggestedProductsView.as_view(), name='product_suggestions'),
@@ -16,6 +18,9 @@ urlpatterns = [
     path('partner/<int:product_id>/', SingleProductForPartnerView.as_view(), name='partner_product_detail'),
     path('partner/<int:product_id>/<str:action>/', ApprovedPartnerProductUpdateView.as_view(), name='approved_partner_product_update'),
     path('partner/upload/', FileUploadPartnerProductView.as_view(), name='partner_product_upload'),
+    path('partner/upload/<int:job_id>/', ImportJobStatusView.as_view(), name='partner_product_upload_status'),
+    path('partner/upload/<int:job_id>/report/', ImportJobReportView.as_view(), name='partner_product_upload_report'),
+    path('partner/scan/', BarcodeScanView.as_view(), name='partner_barcode_scan'),
     path('partner/add-local/', AddLocalOnlyPartnerProduct.as_view(), name='add_local_product'),
     path('partner/accessories/', AccessoriesAPIView.as_view(), name='accessories'),
 ]
@@ -1,4 +1,14 @@
 from .utils import *
+from .matching import active_scoring, match_products
+from .match_sql import match_score_expression
+from .search import ProductSearchFilter
+from .facets import cached_facet_counts
+from .detail_cache import USER_FIELDS, cached_product_detail, product_match_result
+from .ranking import decode_cursor, encode_cursor, score_rank, stream_top_k
+from .barcodes import apply_barcode_scans, ean_in_use
+from .stock_import import UploadFormatError, file_sha256, upload_format
+from .tasks import PRODUCT_FIELDS, run_import_job
+import os
 import re
 import csv
 import openpyxl
@@ -6,15 +16,28 @@ from .models import *
 from io import BytesIO
 from .serializers import *
 from core.permission import *
+from core.pagination import KeysetPaginationMixin
+from core.renderers import ORJSONRenderer
+from core.conditional import ConditionalGetMixin
+from core.fieldsets import SparseFieldsetViewMixin
+from core.versioning import product_scope
 from datetime import datetime
 from openpyxl import Workbook
-from django.db.models import Q, F
+from django.db.models import Q, F, Exists, OuterRef, Subquery, FloatField
+from django.db.models.functions import Coalesce
 from decimal import Decimal
 from rest_framework import filters
 from rest_framework.response import Response
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.db import IntegrityError, transaction
+from django.http import FileResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from openpyxl.styles import Font, PatternFill, Alignment
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.pagination import PageNumberPagination, BasePagination
+import django_filters
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, generics, views, status
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -25,122 +48,226 @@ class CustomLimitPagination(PageNumberPagination):
     max_page_size = 50
 
 
-class ProductListView(generics.ListAPIView):
+class MatchCursorPagination(BasePagination):
+    """
+    Cursor pagination for match-ranked listings (opt in with ?cursor=).
+    The opaque cursor carries the (score, id) of the last row sent so the
+    next page resumes right after it: a keyset filter on the materialized
+    match_score when the queryset has one, otherwise a bounded top-K stream.
+    """
+    page_size = 10
+    page_size_query_param = 'limit'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            after = decode_cursor(request.query_params.get(self.cursor_query_param))
+        except ValueError:
+            raise NotFound("Invalid cursor.")
+
+        if 'match_score' in queryset.query.annotations:
+            # Ordered by (-match_score, -pk) in SQL, resume strictly below the cursor
+            if after:
+                (score, *_), pk = after
+                queryset = queryset.filter(Q(match_score__lt=score) | Q(match_score=score, pk__lt=pk))
+            rows = [
+                ((row['match_score'],), row['pk'], row) if isinstance(row, dict) else ((row.match_score,), row.pk, row)
+                for row in queryset[:page_size + 1]
+            ]
+        else:
+            rank = getattr(view, 'rank_key', score_rank)
+            rows, _ = stream_top_k(view.get_scan(), queryset, page_size + 1, after, rank=rank)
+
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = encode_cursor(*rows[-1][:2])
+        return [pp for _, _, pp in rows]
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+
+def filter_product_listings(params):
+    """ProductListing rows matching the catalog filters in the query parameters."""
+    queryset = ProductListing.objects.all()
+
+    # --- Brand filter ---
+    brand = params.get("brandName")
+    if brand:
+        queryset = queryset.filter(brand_name__iexact=brand)
+    else:
+        # No brand requested, exclude Imotana by default
+        queryset = queryset.exclude(brand_name__iexact="imotana")
+
+    # --- Sub category filter ---
+    sub = params.get("sub_category")
+    if sub:
+        queryset = queryset.filter(sub_category_slug=sub)
+
+    # --- Gender filter ---
+    gender = params.get("gender")
+    if gender:
+        queryset = queryset.filter(gender=gender)
+
+    # --- Variant filters: size, color, partner ---
+    variants = PartnerProduct.objects.filter(product=OuterRef('product'), is_active=True, online=True)
+    size_id = params.get("size_id")
+    color_id = params.get("color_id")
+    partner_id = params.get("partner_id")
+    if size_id:
+        variants = variants.filter(size_quantities__size_id=size_id)
+    if color_id:
+        variants = variants.filter(color_id=color_id)
+    if partner_id:
+        variants = variants.filter(partner_id=partner_id)
+    if size_id or color_id or partner_id:
+        queryset = queryset.filter(Exists(variants))
+    return queryset
+
+
+class ProductListingFilter(django_filters.FilterSet):
+    """Keeps the query parameter names of the PartnerProduct based listing."""
+    product__sub_category__slug = django_filters.CharFilter(field_name='sub_category_slug')
+    product__gender = django_filters.CharFilter(field_name='gender')
+    product__brand = django_filters.NumberFilter(field_name='brand')
+
+    class Meta:
+        model = ProductListing
+        fields = []
+
+
+class ProductListView(ConditionalGetMixin, SparseFieldsetViewMixin, KeysetPaginationMixin, generics.ListAPIView):
     """
     Multi-vendor product listing.
-    Shows products from PartnerProduct with partner-specific prices, sizes, and colors.
+    Reads the denormalized ProductListing table: one row per product with the
+    lowest online price, colors and primary image across all partners.
+    ?fields= / ?omit= skip the scoring and favourites behind match_data and
+    favourite when the client does not render them.
     """
-    serializer_class = PartnerProductListSerializer
+    serializer_class = ProductListingSerializer
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 6  # scan, favourites, count, page, match scores
     pagination_class = CustomLimitPagination    
 
     # enable filters + search
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    search_fields = ['product__name', 'product__description', 'product__brand__name']
-    filterset_fields = ['product__sub_category__slug', 'product__gender', 'product__brand']
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter]
+    filterset_class = ProductListingFilter
 
     def get_queryset(self):
         """
-        Build the queryset from PartnerProduct for multi-vendor system.
+        Build the queryset from ProductListing.
         Apply filters and optional match score sorting.
         """
-        # Get only active partner products
-        queryset = PartnerProduct.objects.filter(
-            is_active=True,
-            product__is_active=True
-        ).select_related(
-            'product', 'product__brand', 'product__sub_category',
-            'partner'
-        ).prefetch_related('product__images', 'size_quantities__size', 'color')
-        
-        # --- Brand filter ---
-        brand = self.request.query_params.get("brandName")
-        if brand:
-            queryset = queryset.filter(product__brand__name__iexact=brand)
-        else:
-            # No brand requested, exclude Imotana by default
-            queryset = queryset.exclude(product__brand__name__iexact="imotana")
-
-        # --- Sub category filter ---
-        sub = self.request.query_params.get("sub_category")
-        if sub:
-            queryset = queryset.filter(product__sub_category__slug=sub)
-
-        # --- Gender filter ---
-        gender = self.request.query_params.get("gender")
-        if gender:
-            queryset = queryset.filter(product__gender=gender)
-
-        # --- Size filter ---
-        size_id = self.request.query_params.get("size_id")
-        if size_id:
-            queryset = queryset.filter(size__id=size_id)
-
-        # --- Color filter ---
-        color_id = self.request.query_params.get("color_id")
-        if color_id:
-            queryset = queryset.filter(color_id=color_id)
-
-        # --- Partner filter ---
-        partner_id = self.request.query_params.get("partner_id")
-        if partner_id:
-            queryset = queryset.filter(partner_id=partner_id)
+        queryset = filter_product_listings(self.request.query_params)
 
         # --- Match sorting ---
         match = self.request.query_params.get("match")
-        scan = FootScan.objects.filter(user=self.request.user).first()
-
-        if match and match.lower() == "true" and scan:
-            partner_products = list(queryset)
-            partner_products.sort(
-                key=lambda pp: pp.product.match_with_scan(scan).get("score", 0),
-                reverse=True  # higher score first
-            )
-            return partner_products
+        scan = self.get_scan() if match and match.lower() == "true" else None
 
-        # Default: order by latest (descending id)
-        queryset = queryset.order_by('-id')
-
-        # --- Filter to show only one variant per unique product to "merge" them globally ---
-        from django.db.models import OuterRef, Subquery
-        first_variant_sq = PartnerProduct.objects.filter(
-            product=OuterRef('product'),
-            is_active=True,
-            online=True,
-            product__is_active=True
-        ).order_by('price', 'id').values('id')[:1]
-        
-        queryset = queryset.filter(id=Subquery(first_variant_sq))
-
-        return queryset
+        if scan:
+            # Rank in SQL so the database can ORDER BY score and LIMIT the
+            # page: materialized MatchScore rows first, computed in the query
+            # for products the background re-score has not reached yet
+            score_sq = MatchScore.objects.filter(
+                foot_scan=scan,
+                product=OuterRef('product'),
+                model_version=active_scoring().version,
+            ).values('score')[:1]
+            return queryset.annotate(
+                match_score=Coalesce(Subquery(score_sq), match_score_expression(scan), output_field=FloatField())
+            ).order_by('-match_score', '-pk')
+
+        # Default: order by latest (descending product id)
+        return queryset.order_by('-pk')
 
     def list(self, request, *args, **kwargs):
         """
-        Apply DRF search + filter backends even when get_queryset() returns a list.
+        Page over .values() rows of the filtered listing and build the
+        response dicts directly, see listing_rows().
         """
-        queryset = self.get_queryset()
-
-        # Apply search and filters manually
-        if not isinstance(queryset, list):
-            queryset = self.filter_queryset(queryset)
-
-        # Handle pagination
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = self.filter_queryset(self.get_queryset())
+        fields = ['pk', *LISTING_ROW_FIELDS, *queryset.query.annotations]
+        if self.wants_field('match_data') and self.get_scan() and 'match_score' not in queryset.query.annotations:
+            # What score_rows() needs of the Product, read in the same query
+            fields += [f"product__{name}" for name in PRODUCT_FIELDS[1:]]
+        rows = queryset.values(*fields)
+
+        page = self.paginate_queryset(rows)
+        if page is None:
+            page = list(rows)
+        if self.wants_field('match_data'):
+            self.score_rows(page)
+        data = listing_rows(page, self.get_serializer_context(), self.get_sparse_fields())
+        if self.paginator is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    @property
+    def paginator(self):
+        """Match listings switch to (score, id) cursors when ?cursor= is sent."""
+        if not hasattr(self, '_paginator'):
+            match = self.request.query_params.get("match")
+            if match and match.lower() == "true" and "cursor" in self.request.query_params:
+                self._paginator = MatchCursorPagination()
+        return super().paginator
+
+    def get_version_scopes(self, request, *args, **kwargs):
+        return ['catalog']
+
+    def get_validator_parts(self, request, *args, **kwargs):
+        return [active_scoring().version]
+
+    def get_scan(self):
+        if not hasattr(self, "_scan"):
+            self._scan = FootScan.objects.filter(user=self.request.user).first()
+        return self._scan
+
+    def score_rows(self, rows):
+        """Batch-score the rows about to be serialized, reusing materialized scores."""
+        scan = self.get_scan()
+        if not scan:
+            return
+        rows = list(rows)
+        if rows and all(row.get("match_score") is not None for row in rows):
+            self.match_scores = {row["product_id"]: {"score": row["match_score"]} for row in rows}
+        else:
+            products = [
+                Product.from_db(Product.objects.db, PRODUCT_FIELDS, [row["product_id"], *(row[f"product__{name}"] for name in PRODUCT_FIELDS[1:])])
+                for row in rows
+            ]
+            self.match_scores = match_products(scan, products)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         match = self.request.query_params.get("match")
-        scan = FootScan.objects.filter(user=self.request.user).first()
+        scan = self.get_scan() if self.wants_field("match_data") else None
         context["scan"] = scan
         context["match"] = match and match.lower() == "true"
+        context["match_scores"] = getattr(self, "match_scores", None)
         # Pre-fetch favorite IDs to avoid N+1 queries in serializer
-        if self.request.user.is_authenticated:
+        if self.request.user.is_authenticated and self.wants_field("favourite"):
             favorite_ids = Favorite.objects.filter(user=self.request.user).values_list('products__id', flat=True)
             context["favorite_ids"] = set(favorite_ids)
         else:
@@ -149,39 +276,62 @@ class ProductListView(generics.ListAPIView):
 
 
 class ProductsCountView(views.APIView):
-    """Count available partner products (multi-vendor)"""
+    """Count listed products (multi-vendor)"""
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
         sub = request.query_params.get("sub_category")
         gender = request.query_params.get("gender")
 
-        queryset = PartnerProduct.objects.filter(
-            is_active=True,
-            product__is_active=True
-        )
+        queryset = ProductListing.objects.all()
         
         if sub:
-            queryset = queryset.filter(product__sub_category__slug=sub)
+            queryset = queryset.filter(sub_category_slug=sub)
         
         if gender:
-            queryset = queryset.filter(product__gender=gender)
+            queryset = queryset.filter(gender=gender)
         
         count = queryset.count()
 
         return Response({"count": count}, status=200)
 
 
-class ProductDetailView(generics.RetrieveAPIView):
+class ProductFacetsView(generics.GenericAPIView):
+    """
+    Product counts per brand, gender, sub category, color, width and
+    in-stock EU size for the current listing filters, so the app can label
+    every filter chip from one request. Accepts ProductListView's filters.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 1  # one grouped count query on a cache miss
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter]
+    filterset_class = ProductListingFilter
+
+    def get_queryset(self):
+        return filter_product_listings(self.request.query_params)
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(cached_facet_counts(queryset, request.query_params), status=200)
+
+
+class ProductDetailView(ConditionalGetMixin, SparseFieldsetViewMixin, generics.RetrieveAPIView):
     """
     Multi-vendor product detail view.
     Retrieves a specific PartnerProduct with partner-specific price, size, color.
     """
     serializer_class = PartnerProductDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 15  # cold detail cache; a hit costs the scan and favourites only
     # Lookup by PRODUCT ID, not PartnerProduct ID
     lookup_field = 'id'
 
+    def get_version_scopes(self, request, *args, **kwargs):
+        return [product_scope(kwargs.get('id'))]
+
+    def get_validator_parts(self, request, *args, **kwargs):
+        return [active_scoring().version]
+
     def get_object(self):
         # Find ANY active partner product for this product ID to use as entry point
         # The serializer handles global aggregation
@@ -199,12 +349,50 @@ class ProductDetailView(generics.RetrieveAPIView):
             
         return obj
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Serve the shared part of the payload from the product detail cache
+        and merge the user's favourite and match data into it.
+        """
+        product_id = self.kwargs.get('id')
+        shared = cached_product_detail(product_id, self.load_shared_detail)
+        if shared is None:
+            from django.http import Http404
+            raise Http404("Product not found or not available.")
+
+        context = self.get_serializer_context()
+        overlay = {}
+        if self.wants_field("match_data"):
+            overlay["match_data"] = size_score_map(product_match_result(context['scan'], product_id, shared["fit_version"]))
+        if self.wants_field("favourite"):
+            overlay["favourite"] = product_id in context["favorite_ids"]
+        data = {**shared["data"], **overlay}
+        fields = self.get_sparse_fields()
+        if fields is None:
+            fields = self.serializer_class.Meta.fields
+        return Response({field: data[field] for field in fields})
+
+    def load_shared_detail(self):
+        obj = PartnerProduct.objects.filter(
+            product__id=self.kwargs.get('id'),
+            is_active=True,
+            product__is_active=True
+        ).select_related('product__brand', 'product__sub_category').first()
+        if not obj:
+            return None
+        # No request or scan in the context: the user fields are merged in later
+        data = self.serializer_class(obj, context={}).data
+        return {
+            "data": {field: value for field, value in data.items() if field not in USER_FIELDS},
+            "fit_version": obj.product.fit_version,
+        }
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        scan = FootScan.objects.filter(user=self.request.user).first()
+        scan = FootScan.objects.filter(user=self.request.user).first() if self.wants_field("match_data") else None
         context['scan'] = scan
         # Pre-fetch favorite IDs to avoid N+1 queries in serializer
-        if self.request.user.is_authenticated:
+        if self.request.user.is_authenticated and self.wants_field("favourite"):
             favorite_ids = Favorite.objects.filter(user=self.request.user).values_list('products__id', flat=True)
             context["favorite_ids"] = set(favorite_ids)
         else:
@@ -257,7 +445,55 @@ class FavoriteUpdateView(views.APIView):
         return Response({"message": message}, status=status.HTTP_200_OK)
 
 
-class SuggestedProductsView(generics.ListAPIView):
+class MatchBatchView(views.APIView):
+    """
+    Match scores for a grid of products in one round trip.
+    POST {"product_ids": [...]} -> score and top sizes per product for the
+    caller's foot scan, batch-loaded and served through the match cache.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 3  # scan, products with fit profiles
+    max_products = 300
+
+    def post(self, request, *args, **kwargs):
+        product_ids = request.data.get('product_ids')
+        if not isinstance(product_ids, list) or not product_ids:
+            return Response({"error": "product_ids must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(product_ids) > self.max_products:
+            return Response(
+                {"error": f"At most {self.max_products} product_ids per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            product_ids = list(dict.fromkeys(int(pid) for pid in product_ids))
+        except (TypeError, ValueError):
+            return Response({"error": "product_ids must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        scan = FootScan.objects.filter(user=request.user).first()
+        if not scan:
+            return Response({"error": "No foot scan data available."}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = Product.objects.filter(id__in=product_ids, is_active=True).only(
+            'id', 'width', 'toe_box', 'fit_version', 'fit_profile'
+        )
+        scores = match_products(scan, products)
+
+        results = []
+        not_found = []
+        for product_id in product_ids:
+            result = scores.get(product_id)
+            if result is None:
+                not_found.append(product_id)
+                continue
+            results.append({
+                "product_id": product_id,
+                "score": result["score"],
+                "recommended_sizes": result["recommended_sizes"],
+            })
+        return Response({"results": results, "not_found": not_found}, status=status.HTTP_200_OK)
+
+
+class SuggestedProductsView(SparseFieldsetViewMixin, generics.ListAPIView):
     """
     Suggest similar partner products based on a given partner product.
     Multi-vendor system: returns PartnerProducts with partner-specific pricing.
@@ -282,8 +518,8 @@ class SuggestedProductsView(generics.ListAPIView):
         except PartnerProduct.DoesNotExist:
             return PartnerProduct.objects.none()
 
-        # Get all SizeTable IDs linked to this product via sizes ManyToMany
-        size_table_ids = product.sizes.values_list('id', flat=True)
+        # Get all SizeTable IDs linked to this product via its images
+        size_table_ids = SizeTable.objects.filter(product_images__product=product).values_list('id', flat=True)
 
         # Prepare base queryset - find similar PartnerProducts
         queryset = PartnerProduct.objects.filter(
@@ -291,40 +527,47 @@ class SuggestedProductsView(generics.ListAPIView):
             product__is_active=True,
             product__sub_category=product.sub_category,
             product__gender=product.gender,
-            product__sizes__id__in=size_table_ids,  # match same size tables
+            product__images__sizes__id__in=size_table_ids,  # match same size tables
         ).exclude(
             id=partner_product_id
         ).select_related(
             'product', 'product__brand', 'product__sub_category',
             'partner', 'color'
-        ).prefetch_related('product__images', 'size_quantities__size').distinct()
+        ).distinct()
 
         # Add scan-based ranking (if exists)
-        scan = FootScan.objects.filter(user=self.request.user).first()
+        scan = self.get_scan()
 
         if scan:
             foot_width_cat = scan.width_category()
             foot_toe_box = scan.toe_box_category()
 
-            partner_products_list = list(queryset)
-            partner_products_list.sort(
-                key=lambda pp: (
-                    abs(getattr(pp.product, "width", 0) - foot_width_cat),
-                    0 if getattr(pp.product, "toe_box", None) == foot_toe_box else 1,
-                    -pp.product.match_with_scan(scan).get("score", 0),
+            # Closest width, then same toe box, then best score (higher ranks first)
+            def rank(pp, result):
+                return (
+                    -abs(getattr(pp.product, "width", 0) - foot_width_cat),
+                    0 if getattr(pp.product, "toe_box", None) == foot_toe_box else -1,
+                    result.get("score", 0),
                 )
-            )
-            return partner_products_list[:20]  # Top 20 matches
+
+            # Stream candidates and keep only the top 20 matches in memory
+            rows, self.match_scores = stream_top_k(scan, queryset, 20, rank=rank)
+            return [pp for _, _, pp in rows]
 
         return queryset[:20]
 
+    def get_scan(self):
+        if not hasattr(self, "_scan"):
+            self._scan = FootScan.objects.filter(user=self.request.user).first()
+        return self._scan
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        scan = FootScan.objects.filter(user=self.request.user).first()
-        context["scan"] = scan
+        context["scan"] = self.get_scan()
         context["match"] = True
+        context["match_scores"] = getattr(self, "match_scores", None)
         # Pre-fetch favorite IDs to optimize serializer
-        if self.request.user.is_authenticated:
+        if self.request.user.is_authenticated and self.wants_field("favourite"):
             favorite_ids = Favorite.objects.filter(user=self.request.user).values_list('products__id', flat=True)
             context["favorite_ids"] = set(favorite_ids)
         else:
@@ -395,7 +638,7 @@ class ProductQnAFilterAPIView(views.APIView):
         ).filter(combined_query).select_related(
             'product', 'product__brand', 'product__sub_category',
             'partner'
-        ).prefetch_related('product__images', 'size_quantities__size', 'color').distinct()
+        ).distinct()
         
         # Final check
         if not queryset.exists():
@@ -424,7 +667,7 @@ class ProductQnAFilterAPIView(views.APIView):
         return paginator.get_paginated_response(serializer.data)
 
 
-class AllProductsForPartnerView(generics.ListAPIView):
+class AllProductsForPartnerView(KeysetPaginationMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated, IsPartner]
     pagination_class = CustomLimitPagination
     serializer_class = ProductSerializer
@@ -659,6 +902,8 @@ class ApprovedPartnerProductUpdateView(views.APIView):
             # Check if already exists for this specific color
             if PartnerProduct.objects.filter(partner=request.user, product=product, color_id=color_id).exists():
                 return Response({"error": "This color variant already exists."}, status=status.HTTP_400_BAD_REQUEST)
+            if ean_in_use(PartnerProduct, request.user, eanc):
+                return Response({"error": "This EAN is already used by another of your products."}, status=status.HTTP_400_BAD_REQUEST)
 
             partner_product = PartnerProduct.objects.create(
                 partner=request.user,
@@ -724,6 +969,8 @@ class ApprovedPartnerProductUpdateView(views.APIView):
                 partner_product.price = request.data.get('price')
             
             if 'eanc' in request.data:
+                if ean_in_use(PartnerProduct, request.user, request.data.get('eanc'), exclude_pk=partner_product.pk):
+                    return Response({"error": "This EAN is already used by another of your products."}, status=status.HTTP_400_BAD_REQUEST)
                 partner_product.eanc = request.data.get('eanc')
             
             if 'local' in request.data:
@@ -910,98 +1157,26 @@ class ApprovedPartnerProductUpdateView(views.APIView):
 
 class FileUploadPartnerProductView(views.APIView):
     """
-    View to upload and read data from Excel or CSV files for partner products.
+    Upload an Excel or CSV stock file for partner products. The file is
+    stored and processed in the background by run_import_job; the response
+    is 202 with the id of the import job to poll. Uploading a file with the
+    same content for the same warehouse again returns the existing job
+    instead of importing twice, or resumes it if it failed.
     """
     permission_classes = [permissions.IsAuthenticated, IsPartner]
     parser_classes = (MultiPartParser, FormParser)
 
-    def find_column(self, headers, patterns):
-        for pattern in patterns:
-            for header in headers:
-                if re.search(pattern, str(header), re.IGNORECASE):
-                    return header
-        return None
-
     def post(self, request, *args, **kwargs):
         file = request.FILES.get('file')
         if not file:
             return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
 
-        filename = file.name
-        data = []
-
-        if filename.endswith('.csv'):
-            try:
-                # Read CSV file
-                decoded_file = file.read().decode('utf-8').splitlines()
-                reader = csv.DictReader(decoded_file)
-                for row in reader:
-                    data.append(row)
-            except Exception as e:
-                return Response({"error": f"Error reading CSV: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        elif filename.endswith('.xlsx') or filename.endswith('.xls'):
-            try:
-                # Read Excel file
-                workbook = openpyxl.load_workbook(file, data_only=True)
-                sheet = workbook.active
-                
-                # Get headers from the first row
-                headers = [cell.value for cell in sheet[1]]
-                
-                # Iterate through rows starting from the second row
-                for row in sheet.iter_rows(min_row=2, values_only=True):
-                    # Create a dictionary for each row mapping headers to values
-                    row_data = dict(zip(headers, row))
-                    data.append(row_data)
-            except Exception as e:
-                return Response({"error": f"Error reading Excel: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            return Response({"error": "Unsupported file format. Please upload CSV or XLSX."}, status=status.HTTP_400_BAD_REQUEST)
-
-        return self.process_uploaded_data(request, data)
-
-    def process_uploaded_data(self, request, data):
-        if not data:
-            return Response({"error": "No data found in file"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload_format(file.name)
+        except UploadFormatError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         partner = request.user
-        headers = list(data[0].keys())
-
-        # Column patterns for mapping different manufacturer formats
-        col_patterns = {
-            'item_name': [r'item[_\s]?name', r'product[_\s]?name', r'^name$', r'^item$'],
-            'color_name': [r'color[_\s]?name', r'^color$', r'variant', r'shade'],
-            'price': [r'amount[_\s]?incl[_\s]?vat', r'selling[_\s]?price', r'^price$', r'^amount$'],
-            'buy_price': [r'buy[_\s]?price', r'purchase[_\s]?price', r'cost[_\s]?price', r'^cost$', r'buying[_\s]?price'],
-            'ean': [r'^ean$', r'^eanc$', r'barcode', r'upc', r'article[_\s]?no'],
-            'quantity': [r'^qty$', r'^quantity$', r'stock', r'inventory', r'amount'],
-            'size_eu': [r'size[_\s]?eu', r'^eu[_\s]?size$', r'^eu$', r'sizes[_\s]?eu'],
-            'size_usm': [r'size[_\s]?usm', r'size[_\s]?us[_\s]?m', r'usm'],
-            'size_usw': [r'size[_\s]?usw', r'size[_\s]?us[_\s]?w', r'usw'],
-            'size_us': [r'size[_\s]?us', r'^us[_\s]?size$', r'^us$'],
-        }
-
-        # Resolved column names found in the uploaded file
-        cols = {key: self.find_column(headers, patterns) for key, patterns in col_patterns.items()}
-        
-        # Summary Tracking
-        summary = {
-            "total_rows": len(data),
-            "matched_products": 0,
-            "created_products": 0,
-            "new_partner_products": 0,
-            "updated_partner_products": 0,
-            "size_updates": 0,
-            "color_updates": 0,
-            "local_only_count": 0,
-            "skipped_rows": 0
-        }
-        skipped_details = []
-        
-        # Cache for performance
-        product_cache = {}
-        
         # Get Warehouse if provided
         warehouse_id = request.data.get('warehouse_id')
         warehouse = None
@@ -1012,237 +1187,98 @@ class FileUploadPartnerProductView(views.APIView):
             except:
                 pass
 
-        for row in data:
-            item_name = row.get(cols['item_name']) if cols['item_name'] else None
-            if not item_name:
-                summary["skipped_rows"] += 1
-                skipped_details.append({"row": row, "reason": "Missing item name column or value"})
-                continue
-            
-            item_name = str(item_name).strip()
-            is_local_only = False
-            
-            # --- 1. Resolve Product ---
-            product = product_cache.get(item_name)
-            if not product:
-                product = Product.objects.filter(name__iexact=item_name).first()
-                if not product:
-                    product = Product.objects.filter(name__icontains=item_name).first()
-                
-                if product:
-                    product_cache[item_name] = product
-                else:
-                    # Product not found -> Create a "Local" product
-                    is_local_only = True
-                    try:
-                        local_brand, _ = Brand.objects.get_or_create(name="Local")
-                        local_cat, _ = Category.objects.get_or_create(name="Local", defaults={'slug': 'local-cat'})
-                        local_subcat, _ = SubCategory.objects.get_or_create(
-                            name="Local", 
-                            category=local_cat, 
-                            defaults={'slug': 'local-subcat'}
-                        )
-                        
-                        product = Product.objects.create(
-                            name=item_name,
-                            brand=local_brand,
-                            main_category=local_cat,
-                            sub_category=local_subcat,
-                            description=f"Auto-generated local product for {item_name}",
-                            gender="unisex",
-                            is_active=False # Keep it inactive for global search maybe?
-                        )
-                        product_cache[item_name] = product
-                        summary["created_products"] += 1
-                    except Exception as e:
-                        summary["skipped_rows"] += 1
-                        skipped_details.append({"item": item_name, "reason": f"Failed to create local product: {str(e)}"})
-                        continue
-            
-            if not is_local_only:
-                summary["matched_products"] += 1
-
-            # --- 2. Resolve Color ---
-            color_name = row.get(cols['color_name']) if cols['color_name'] else None
-            color_id_val = row.get('color_id')
-            image_id_val = row.get('image_id')
-            
-            color_obj = None
-            
-            # Try to match via existing product images first (Online mode)
-            if color_name:
-                target_color = Color.objects.filter(color__iexact=str(color_name).strip()).first()
-                if target_color and ProductImage.objects.filter(product=product, color=target_color).exists():
-                    color_obj = target_color
-            
-            if not color_obj and image_id_val:
-                img = ProductImage.objects.filter(id=image_id_val, product=product).select_related('color').first()
-                if img and img.color:
-                    color_obj = img.color
-            
-            # If still not found, color does not match product's global catalog -> mark as local only
-            if not color_obj:
-                is_local_only = True
-                if color_name:
-                    color_obj, _ = Color.objects.get_or_create(
-                        color=str(color_name).strip(),
-                        defaults={'hex_code': '#CCCCCC'} # Default grey for local colors
+        file_hash = file_sha256(file)
+        jobs = ImportJob.objects.filter(partner=partner, warehouse=warehouse, file_hash=file_hash)
+        job = jobs.exclude(status=ImportJob.Status.FAILED).first()
+        reused = job is not None
+        resumed = False
+
+        if not reused:
+            job = jobs.filter(status=ImportJob.Status.FAILED).first()
+            if job is None:
+                job = ImportJob(partner=partner, warehouse=warehouse, file_name=file.name, file_hash=file_hash)
+                job.file.save(file.name, file, save=False)
+            try:
+                with transaction.atomic():
+                    if job.pk:
+                        # The chunks the failed run committed stay imported, it resumes after them
+                        resumed = queued = bool(ImportJob.objects.filter(pk=job.pk, status=ImportJob.Status.FAILED).update(
+                            status=ImportJob.Status.PENDING, error='', finished_at=None,
+                        ))
+                        job.refresh_from_db()
+                    else:
+                        job.save()
+                        queued = True
+            except IntegrityError:
+                if not job.pk:
+                    job.file.delete(save=False)
+                queued = False
+            if queued:
+                job_id = job.id
+                transaction.on_commit(lambda: run_import_job.delay(job_id))
+            else:
+                # A concurrent upload of the same file got its job in first
+                job, reused = jobs.first(), True
+                if job is None:
+                    return Response(
+                        {"error": "This file is being uploaded at the same time, try again."},
+                        status=status.HTTP_409_CONFLICT
                     )
-                elif color_id_val:
-                    color_obj = Color.objects.filter(id=color_id_val).first()
 
-            if not color_obj:
-                # Still no color? Pick a default or skip
-                summary["skipped_rows"] += 1
-                skipped_details.append({"item": item_name, "reason": "No valid color found and no color name provided"})
-                continue
+        if resumed:
+            message = "Failed import of this file resumed"
+        else:
+            message = "File already uploaded" if reused else "File queued for processing"
+        return Response({
+            "message": message,
+            "job_id": job.id,
+            "status": job.status,
+            "reused": reused,
+            "resumed": resumed,
+            "status_url": request.build_absolute_uri(reverse('partner_product_upload_status', args=[job.id])),
+        }, status=status.HTTP_202_ACCEPTED)
 
-            # --- 3. Resolve/Create PartnerProduct ---
-            price_str = row.get(cols['price']) if cols['price'] else '0'
-            price = self.clean_price(price_str)
-            
-            buy_price_str = row.get(cols['buy_price']) if cols['buy_price'] else '0'
-            buy_price = self.clean_price(buy_price_str)
-            
-            partner_product, created = PartnerProduct.objects.get_or_create(
-                partner=partner,
-                product=product,
-                color=color_obj,
-                defaults={
-                    'price': price,
-                    'buy_price': buy_price,
-                    'online': not is_local_only,
-                    'local': True,
-                    'is_active': True
-                }
-            )
-            
-            if created:
-                summary["new_partner_products"] += 1
-            else:
-                summary["updated_partner_products"] += 1
-                partner_product.price = price
-                partner_product.buy_price = buy_price
-                # If it was already online=False, keep it. If now it's newly local, set it.
-                if is_local_only:
-                    partner_product.online = False
-                partner_product.save()
 
-            if is_local_only:
-                summary["local_only_count"] += 1
+class ImportJobStatusView(generics.RetrieveAPIView):
+    """Progress, summary counters and skipped rows of one of the partner's stock uploads."""
+    permission_classes = [permissions.IsAuthenticated, IsPartner]
+    serializer_class = ImportJobSerializer
+    lookup_url_kwarg = 'job_id'
 
-            summary["color_updates"] += 1
+    def get_queryset(self):
+        return ImportJob.objects.filter(partner=self.request.user)
 
-            if warehouse:
-                warehouse.product.add(partner_product)
-            
-            ean_val = row.get(cols['ean']) if cols['ean'] else None
-            if ean_val:
-                partner_product.eanc = str(ean_val).strip()
-                partner_product.save()
 
-            # --- 4. Resolve Sizes ---
-            relevant_types = ['EU']
-            if product.gender == 'male':
-                relevant_types.append('USM')
-            elif product.gender == 'female':
-                relevant_types.append('USW')
-            else: # unisex or others
-                relevant_types.extend(['USM', 'USW'])
-
-            # Dymanic size columns based on regex mapping
-            size_mapping = [
-                (cols['size_eu'], 'EU'),
-                (cols['size_usm'], 'USM'),
-                (cols['size_usw'], 'USW'),
-                (cols['size_us'], 'USM'),
-                (cols['size_us'], 'USW'),
-            ]
-            size_cols = [(c, t) for c, t in size_mapping if c]
-            
-            quantity = 0
-            try:
-                quantity_val = row.get(cols['quantity']) if cols['quantity'] else 0
-                quantity = int(quantity_val) if quantity_val is not None else 0
-            except:
-                pass
+class ImportJobReportView(views.APIView):
+    """Download the CSV report of skipped rows of a finished stock upload."""
+    permission_classes = [permissions.IsAuthenticated, IsPartner]
 
-            processed_columns_in_row = set()
-            for col, s_type in size_cols:
-                if s_type not in relevant_types:
-                    continue
-                
-                if col in processed_columns_in_row:
-                    continue
-
-                val = str(row.get(col))
-                if val and val != 'None' and val.strip():
-                    # Try to find size linked to product tables first
-                    matching_size = Size.objects.filter(
-                        table__products=product,
-                        type=s_type,
-                        value=val
-                    ).first()
-                    
-                    if not matching_size:
-                        matching_size = Size.objects.filter(type=s_type, value=val).first()
-                        
-                        if not matching_size:
-                            brand = product.brand
-                            size_table, _ = SizeTable.objects.get_or_create(brand=brand, name="Local Sizes")
-                            matching_size = Size.objects.create(
-                                table=size_table,
-                                type=s_type,
-                                value=val,
-                                insole_min_mm=0, 
-                                insole_max_mm=0
-                            )
-                        
-                        if partner_product.online:
-                            partner_product.online = False
-                            partner_product.save()
-
-                    if matching_size:
-                        processed_columns_in_row.add(col) # Mark this column as "done" for this row
-                        if quantity > 0:
-                            pps, pps_created = PartnerProductSize.objects.get_or_create(
-                                partner_product=partner_product,
-                                size=matching_size,
-                                defaults={'quantity': quantity}
-                            )
-                            if not pps_created:
-                                # Add to existing quantity instead of overwriting
-                                pps.quantity += quantity 
-                                pps.save()
-                            summary["size_updates"] += 1
+    def get(self, request, job_id):
+        job = get_object_or_404(ImportJob, id=job_id, partner=request.user)
+        if not job.report:
+            return Response({"error": "Report is not ready yet", "status": job.status}, status=status.HTTP_409_CONFLICT)
+        return FileResponse(job.report.open('rb'), as_attachment=True, filename=os.path.basename(job.report.name))
 
-        return Response({
-            "message": "File processed with automated column mapping",
-            "summary": summary,
-            "debug": {
-                "matched_columns": cols,
-                "skipped_details": skipped_details[:50]
-            }
-        }, status=status.HTTP_200_OK)
 
+class BarcodeScanView(views.APIView):
+    """
+    Stock changes from barcode scanners at the till or the receiving dock.
+    POST {"scans": [{"ean": "...", "size": "EU 42", "delta": -1}, ...]} applies
+    the batch in one transaction, see apply_barcode_scans(); scans that
+    cannot be applied come back in "rejected" without failing the others.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsPartner]
+    max_scans = 1000
 
+    def post(self, request, *args, **kwargs):
+        scans = request.data.get('scans')
+        if not isinstance(scans, list) or not scans:
+            return Response({"error": "scans must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(scans) > self.max_scans:
+            return Response({"error": f"At most {self.max_scans} scans per request."}, status=status.HTTP_400_BAD_REQUEST)
 
-    def clean_price(self, price_str):
-        if not price_str: return Decimal('0.00')
-        # Remove currency symbols and spaces
-        cleaned = "".join(c for c in str(price_str) if c.isdigit() or c in '.,')
-        if not cleaned: return Decimal('0.00')
-        
-        # Consistent decimal separator
-        if ',' in cleaned and '.' in cleaned:
-            cleaned = cleaned.replace(',', '')
-        elif ',' in cleaned:
-            cleaned = cleaned.replace(',', '.')
-        
-        try:
-            return Decimal(cleaned)
-        except:
-            return Decimal('0.00')
+        results, rejected = apply_barcode_scans(request.user, scans)
+        return Response({"results": results, "rejected": rejected}, status=status.HTTP_200_OK)
 
 
 class AddLocalOnlyPartnerProduct(views.APIView):
@@ -1288,6 +1324,10 @@ class AddLocalOnlyPartnerProduct(views.APIView):
             if not color_obj:
                 color_obj = Color.objects.create(color=color_input, hex_code="#CCCCCC")
             
+            variant = PartnerProduct.objects.filter(partner=request.user, product=product, color=color_obj).first()
+            if ean_in_use(PartnerProduct, request.user, eanc, exclude_pk=variant.pk if variant else None):
+                return Response({"error": "This EAN is already used by another of your products."}, status=status.HTTP_400_BAD_REQUEST)
+
             # 4. Create single PartnerProduct variant
             partner_product, pp_created = PartnerProduct.objects.get_or_create(
                 partner=request.user,
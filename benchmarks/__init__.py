@@ -0,0 +1 @@
+"""Fit-matching benchmarks, see benchmarks/run.py."""
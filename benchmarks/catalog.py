@@ -0,0 +1,150 @@
+"""
+Seeded synthetic catalog for the fit-matching benchmarks.
+
+Everything is written with bulk_create, so no signals (and no Celery tasks)
+fire while seeding; fit profiles and the size index are built at the end
+the same way the signals would.
+"""
+import random
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from Brands.models import Brand
+from Others.models import FootScan
+from Products.models import (
+    Category, SubCategory, Color, SizeTable, Size, Product, ProductImage,
+    PartnerProduct, PartnerProductSize, Width, ToeBox,
+)
+from Products.matching import refresh_fit_profiles
+from Products.size_index import bump_size_index
+
+User = get_user_model()
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000}
+BATCH_SIZE = 2000
+
+PARIS_POINT_MM = 20 / 3  # one EU size step
+COLORS = [
+    ('black', '#000000'), ('white', '#FFFFFF'), ('red', '#FF0000'), ('blue', '#0000FF'),
+    ('green', '#008000'), ('grey', '#808080'), ('brown', '#8B4513'), ('beige', '#F5F5DC'),
+]
+# Size systems as offsets from EU; insole ranges follow the EU Paris point
+SIZE_RUNS = {
+    'EU': [(str(eu), eu) for eu in range(35, 49)],
+    'USM': [(str(us), us + 33) for us in range(4, 15)],
+    'USW': [(str(us), us + 31) for us in range(5, 13)],
+}
+
+
+def insole_range(eu_size, offset):
+    """Insole length range (mm) of an EU size, shifted by a brand/table offset."""
+    center = (eu_size - 2) * PARIS_POINT_MM + offset
+    return round(center - 3), round(center + 3)
+
+
+def _bulk(model, objects):
+    return model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+
+
+def generate_catalog(products=1_000, seed=42):
+    """
+    Create brands, size tables (EU/USM/USW), products with two colour images,
+    partner variants with stock per size, and a customer with a foot scan.
+    Returns a dict with the customer, the partner and a sample product id.
+    """
+    rnd = random.Random(seed)
+
+    category, _ = Category.objects.get_or_create(slug='bench-shoes', defaults={'name': 'Bench shoes'})
+    sub_category, _ = SubCategory.objects.get_or_create(
+        slug='bench-sneaker', defaults={'name': 'Bench sneaker', 'category': category}
+    )
+    colors = _bulk(Color, [Color(color=f'bench-{name}', hex_code=hex_code) for name, hex_code in COLORS])
+
+    partners = _bulk(User, [
+        User(email=f'bench-partner-{i}@example.com', role='partner', is_active=True,
+             lat=48 + rnd.random(), lng=11 + rnd.random())
+        for i in range(max(2, products // 2000))
+    ])
+    customer = User(email='bench-customer@example.com', role='customer', is_active=True)
+    customer.save()
+    length = Decimal(rnd.randint(230, 290))
+    FootScan.objects.bulk_create([FootScan(
+        user=customer,
+        left_length=length, right_length=length - rnd.randint(0, 4),
+        left_width=(length * Decimal('0.40')).quantize(Decimal('0.01')),
+        right_width=(length * Decimal('0.39')).quantize(Decimal('0.01')),
+    )])
+
+    brands = _bulk(Brand, [Brand(name=f'Bench brand {i}') for i in range(max(5, products // 200))])
+    tables = _bulk(SizeTable, [
+        SizeTable(brand=brand, name=name) for brand in brands for name in ('Standard', 'Wide')
+    ])
+    sizes = []
+    for table in tables:
+        offset = rnd.uniform(-4, 4)
+        for size_type, run in SIZE_RUNS.items():
+            for value, eu_size in run:
+                min_mm, max_mm = insole_range(eu_size, offset)
+                sizes.append(Size(table=table, type=size_type, value=value,
+                                  insole_min_mm=min_mm, insole_max_mm=max_mm))
+    sizes = _bulk(Size, sizes)
+
+    tables_by_brand = {}
+    for table in tables:
+        tables_by_brand.setdefault(table.brand_id, []).append(table)
+    sizes_by_table = {}
+    for size in sizes:
+        sizes_by_table.setdefault(size.table_id, []).append(size)
+
+    catalog = _bulk(Product, [
+        Product(
+            name=f'Bench shoe {i}', brand=rnd.choice(brands), description='Synthetic benchmark product',
+            main_category=category, sub_category=sub_category,
+            gender=rnd.choice(['male', 'female', 'unisex']),
+            width=rnd.choice(Width.values), toe_box=rnd.choice(ToeBox.values),
+        )
+        for i in range(products)
+    ])
+
+    # Two colour images per product, each linked to one or both brand tables
+    images = []
+    for product in catalog:
+        for color in rnd.sample(colors, 2):
+            images.append(ProductImage(product=product, image='products/bench.png', color=color))
+    images = _bulk(ProductImage, images)
+
+    links, variants, image_tables = [], [], {}
+    for image in images:
+        brand_tables = tables_by_brand[image.product.brand_id]
+        linked = rnd.sample(brand_tables, rnd.randint(1, len(brand_tables)))
+        image_tables[image.id] = linked
+        for table in linked:
+            links.append(ProductImage.sizes.through(productimage_id=image.id, sizetable_id=table.id))
+        price = Decimal(rnd.randint(4000, 20000)) / 100
+        variants.append(PartnerProduct(
+            product=image.product, partner=rnd.choice(partners), color=image.color,
+            buy_price=(price * Decimal('0.6')).quantize(Decimal('0.01')), price=price,
+            eanc=f'{rnd.randrange(10 ** 12, 10 ** 13)}',
+        ))
+    _bulk(ProductImage.sizes.through, links)
+    variants = _bulk(PartnerProduct, variants)
+
+    stock = []
+    for image, variant in zip(images, variants):
+        eu_sizes = [s for table in image_tables[image.id] for s in sizes_by_table[table.id] if s.type == 'EU']
+        for size in rnd.sample(eu_sizes, min(6, len(eu_sizes))):
+            stock.append(PartnerProductSize(
+                partner_product=variant, size=size, color=variant.color, quantity=rnd.randint(0, 8)
+            ))
+    _bulk(PartnerProductSize, stock)
+
+    product_ids = [product.id for product in catalog]
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        refresh_fit_profiles(product_ids[start:start + BATCH_SIZE])
+    bump_size_index()
+
+    return {
+        'customer': customer,
+        'partner': partners[0],
+        'product_id': catalog[len(catalog) // 2].id,
+        'partner_product_id': variants[len(variants) // 2].id,
+    }
@@ -0,0 +1,180 @@
+"""
+Fit-matching benchmarks.
+
+    python -m benchmarks.run --scale 10k --repeat 5 --output bench-10k.json
+    python -m benchmarks.run --compare bench-main.json bench-branch.json
+
+The catalog is generated in a throwaway test database (the configured
+database is never touched) and caches are swapped for a local memory cache,
+so the first repetition of every case runs cold and the rest warm.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(call, repeat):
+    """Run `call` `repeat` times; wall time and SQL queries per run, peak memory overall."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    runs = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            call()
+            elapsed = time.perf_counter() - started
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        runs.append({'wall_ms': round(elapsed * 1000, 2), 'queries': len(queries)})
+
+    wall = [run['wall_ms'] for run in runs]
+    return {
+        'cold_ms': wall[0],
+        'warm_median_ms': round(statistics.median(wall[1:]), 2) if len(wall) > 1 else None,
+        'queries': runs[0]['queries'],
+        'warm_queries': runs[-1]['queries'],
+        'peak_memory_kb': round(peak / 1024, 1),
+        'runs': runs,
+    }
+
+
+def build_cases(seeded):
+    from rest_framework.test import APIClient
+    from Others.models import FootScan
+    from Products.models import Product
+
+    client = APIClient()
+    client.force_authenticate(seeded['customer'])
+    scan = FootScan.objects.get(user=seeded['customer'])
+    product_id = seeded['product_id']
+
+    def request(url):
+        def call():
+            response = client.get(url)
+            assert response.status_code == 200, f"{url} returned {response.status_code}"
+        return call
+
+    def match_with_scan():
+        Product.objects.get(pk=product_id).match_with_scan(scan)
+
+    return {
+        'match_with_scan': match_with_scan,
+        'product_list_match': request('/api/products/?match=true&limit=20'),
+        'product_list_match_cursor': request('/api/products/?match=true&cursor=&limit=20'),
+        'suggested_products': request(f"/api/products/suggestions/{seeded['partner_product_id']}/"),
+        'product_detail': request(f'/api/products/{product_id}/'),
+    }
+
+
+def run(scale, repeat, seed, only=None):
+    from django.core.cache import cache
+    from django.test.utils import override_settings, setup_databases, teardown_databases
+    from benchmarks.catalog import SCALES, generate_catalog
+    from Products.match_cache import match_cache
+
+    products = SCALES[scale]
+    with override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ALLOWED_HOSTS=['*'],
+    ):
+        databases = setup_databases(verbosity=0, interactive=False)
+        try:
+            started = time.perf_counter()
+            seeded = generate_catalog(products, seed=seed)
+            seed_seconds = time.perf_counter() - started
+
+            results = {}
+            for name, call in build_cases(seeded).items():
+                if only and name not in only:
+                    continue
+                cache.clear()
+                match_cache.clear_local()
+                results[name] = measure(call, repeat)
+                print(f"{name:28} cold {results[name]['cold_ms']:>9} ms  "
+                      f"warm {results[name]['warm_median_ms']} ms  "
+                      f"queries {results[name]['queries']}  "
+                      f"peak {results[name]['peak_memory_kb']} KB", file=sys.stderr)
+        finally:
+            teardown_databases(databases, verbosity=0)
+
+    from django.db import connection
+    return {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'scale': scale,
+        'products': products,
+        'seed': seed,
+        'repeat': repeat,
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'seed_seconds': round(seed_seconds, 2),
+        'results': results,
+    }
+
+
+def compare(baseline_path, current_path):
+    """Print per-case deltas between two reports."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    print(f"{baseline.get('commit')} -> {current.get('commit')} ({current.get('scale')})")
+    for name, now in current['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            print(f"{name:28} new")
+            continue
+        for metric in ('cold_ms', 'warm_median_ms', 'queries', 'peak_memory_kb'):
+            old, new = before.get(metric), now.get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{name:28} {metric:16} {old:>10} -> {new:>10}  {change}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=['1k', '10k', '100k'], default='1k')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--case', action='append', help="Only run the named case (repeatable)")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+    django.setup()
+
+    report = run(args.scale, args.repeat, args.seed, only=args.case)
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == '__main__':
+    main()
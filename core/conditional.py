@@ -0,0 +1,65 @@
+import hashlib
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from .versioning import favorites_scope, get_versions, scan_scope
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET for read endpoints. The strong ETag and Last-Modified
+    come from the version scopes the view declares (core.versioning) and
+    the request path, never from the body, so a matching If-None-Match gets
+    its 304 before any query or serializer runs.
+
+    Views return their scopes from get_version_scopes() and any other input
+    of the body (e.g. the scoring version) from get_validator_parts().
+    With user_overlay the user's favourites and foot scan are part of the
+    validators, so per-user fields never go stale.
+    """
+    user_overlay = True
+
+    def get_version_scopes(self, request, *args, **kwargs):
+        return []
+
+    def get_validator_parts(self, request, *args, **kwargs):
+        return []
+
+    def get_validators(self, request, *args, **kwargs):
+        scopes = list(self.get_version_scopes(request, *args, **kwargs))
+        if self.user_overlay and request.user.is_authenticated:
+            scopes += [favorites_scope(request.user.pk), scan_scope(request.user.pk)]
+        versions = get_versions(scopes)
+        if not versions:
+            return None, None
+
+        parts = [
+            type(self).__name__,
+            request.get_full_path(),
+            *(f"{scope}={versions[scope]}" for scope in scopes),
+            *(str(part) for part in self.get_validator_parts(request, *args, **kwargs)),
+        ]
+        etag = quote_etag(hashlib.sha1('|'.join(parts).encode()).hexdigest())
+        last_modified = max(versions.values()) // 1_000_000_000
+        return etag, last_modified
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, *args, **kwargs)
+        if etag:
+            # Only the ETag decides: Last-Modified has one-second resolution
+            # and would hide a second change within the same second
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return self.set_validators(not_modified, etag, last_modified)
+
+        response = super().get(request, *args, **kwargs)
+        if etag and response.status_code == 200:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Clients and proxies must revalidate, and never share a user's copy
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
+        return response
@@ -0,0 +1,80 @@
+FIELDS_QUERY_PARAM = 'fields'
+OMIT_QUERY_PARAM = 'omit'
+
+
+def _requested(params, param, prefix):
+    value = params.get(param)
+    if value is None:
+        return None
+    names = (name.strip() for name in value.split(','))
+    return [name[len(prefix):] for name in names if name.startswith(prefix) and len(name) > len(prefix)]
+
+
+def sparse_fields(params, available, prefix=''):
+    """
+    Names of `available` to render for ?fields=a,b (only these) and
+    ?omit=c,d (all but these), in declared order, or None to render all.
+    Nested serializers pass their dotted path as `prefix`, e.g. "items.":
+    ?fields=id,items.price keeps only price inside items and
+    ?omit=items.product_image drops only that. Unknown names are ignored.
+    """
+    fields = _requested(params, FIELDS_QUERY_PARAM, prefix)
+    omit = _requested(params, OMIT_QUERY_PARAM, prefix)
+    if not fields and not omit:
+        return None
+
+    selected = list(available)
+    if fields:
+        wanted = {name.split('.')[0] for name in fields}
+        selected = [name for name in selected if name in wanted]
+    if omit:
+        # "items.price" only concerns the nested serializer
+        dropped = {name for name in omit if '.' not in name}
+        selected = [name for name in selected if name not in dropped]
+    return selected
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin rendering only the request's sparse fieldset.
+    Dropped SerializerMethodFields are never called, so the queries behind
+    them never run. Needs the request in the serializer context; without
+    one (e.g. payloads built for a cache) every field is rendered.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None:
+            return fields
+        params = getattr(request, 'query_params', request.GET)
+        selected = sparse_fields(params, fields, self.sparse_prefix())
+        if selected is None:
+            return fields
+        return {name: fields[name] for name in selected}
+
+    def sparse_prefix(self):
+        names = []
+        field = self
+        while field is not None:
+            if field.field_name:
+                names.append(field.field_name)
+            field = field.parent
+        return ''.join(f"{name}." for name in reversed(names))
+
+
+class SparseFieldsetViewMixin:
+    """
+    View side of sparse fieldsets, for views that load data for their
+    serializer up front (scores, favourites, lookups): wants_field() tells
+    whether the client asked for a field of the serializer class.
+    """
+
+    def get_sparse_fields(self):
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = sparse_fields(self.request.query_params, self.get_serializer_class().Meta.fields)
+        return self._sparse_fields
+
+    def wants_field(self, name):
+        selected = self.get_sparse_fields()
+        return selected is None or name in selected
@@ -1,4 +1,12 @@
 # middleware.py
+import time
+import logging
+from django.conf import settings
+from django.db import connection
+from .metrics import QueryRecorder, REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_SQL_TIME
+
+logger = logging.getLogger(__name__)
+
 class FixAuthorizationHeaderMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -7,3 +15,33 @@ class FixAuthorizationHeaderMiddleware:
         if 'HTTP_X_AUTHORIZATION' in request.META and 'HTTP_AUTHORIZATION' not in request.META:
             request.META['HTTP_AUTHORIZATION'] = request.META['HTTP_X_AUTHORIZATION']
         return self.get_response(request)
+
+
+class MetricsMiddleware:
+    """
+    Records per-route latency, SQL query count and SQL time (see
+    core/metrics.py) and logs slow requests with their most repeated SQL.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else '<unmatched>'
+        REQUEST_LATENCY.observe(elapsed, route, request.method, response.status_code)
+        REQUEST_QUERIES.observe(recorder.count, route)
+        REQUEST_SQL_TIME.observe(recorder.duration, route)
+
+        if elapsed >= getattr(settings, 'SLOW_REQUEST_SECONDS', 1.0):
+            repeated = '; '.join(f"{count}x {sql[:200]}" for sql, count in recorder.repeated())
+            logger.warning(
+                f"Slow request {request.method} {request.path} ({route}): {elapsed:.3f}s, "
+                f"{recorder.count} queries in {recorder.duration:.3f}s. Repeated: {repeated or 'none'}"
+            )
+        return response
@@ -0,0 +1,193 @@
+import json
+import base64
+import binascii
+from datetime import date, datetime
+from decimal import Decimal
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_keyset_cursor(values):
+    """Opaque cursor for the position right after a row with these sort values."""
+    raw = json.dumps([_dump_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_keyset_cursor(value, size):
+    """Return the list of sort values or None; raises ValueError on a tampered cursor."""
+    if not value:
+        return None
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return [_load_value(value) for value in values]
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"dec": str(value)}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            parsed = parse_datetime(value["dt"])
+        elif "d" in value:
+            parsed = parse_date(value["d"])
+        elif "dec" in value:
+            parsed = Decimal(value["dec"])
+        else:
+            parsed = None
+        if parsed is None:
+            raise ValueError("Invalid cursor")
+        return parsed
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return value
+    raise ValueError("Invalid cursor")
+
+
+def approximate_count(queryset):
+    """
+    Planner row estimate of the queryset on PostgreSQL (no table scan),
+    an exact COUNT(*) on other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination on stable (sort key, pk) tuples.
+    Pages are fetched with WHERE (sort key, pk) < cursor ... LIMIT n, so
+    deep pages cost the same as the first one and no COUNT(*) runs.
+    The sort keys are the view's `keyset_ordering` or the queryset ordering,
+    with pk appended as the tie-breaker; they must not be NULL.
+    Totals are opt-in with ?total=approx (planner estimate) or ?total=exact.
+    """
+    page_size = 10
+    page_size_query_param = 'limit'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+    total_query_param = 'total'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, queryset, view):
+        ordering = list(getattr(view, 'keyset_ordering', None) or queryset.query.order_by or queryset.model._meta.ordering)
+        ordering = [field for field in ordering if isinstance(field, str)]
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            descending = ordering[-1].startswith('-') if ordering else True
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        ordering = self.get_ordering(queryset, view)
+        try:
+            after = decode_keyset_cursor(request.query_params.get(self.cursor_query_param), len(ordering))
+        except ValueError:
+            raise NotFound("Invalid cursor.")
+
+        self.count = None
+        total = (request.query_params.get(self.total_query_param) or '').lower()
+        if total == 'exact':
+            self.count = queryset.count()
+        elif total == 'approx':
+            self.count = approximate_count(queryset)
+
+        queryset = queryset.order_by(*ordering)
+        if after is not None:
+            queryset = queryset.filter(self.seek_filter(ordering, after))
+        rows = list(queryset[:page_size + 1])
+
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = encode_keyset_cursor([self.sort_value(rows[-1], field) for field in ordering])
+        return rows
+
+    def seek_filter(self, ordering, values):
+        """Rows strictly after `values` in `ordering`: (a < x) OR (a = x AND b < y) ..."""
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f"{name}__{lookup}": values[index]})
+            for previous, value in zip(ordering[:index], values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def sort_value(self, row, field):
+        if isinstance(row, dict):
+            # .values() rows carry the sort keys under their ordering names
+            return row[field.lstrip('-')]
+        value = row
+        for part in field.lstrip('-').split('__'):
+            value = getattr(value, part)
+        return getattr(value, 'pk', value)
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.total_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+
+class KeysetPaginationMixin:
+    """
+    Opt a list endpoint into keyset pagination: requests sending ?cursor=
+    (empty for the first page) get KeysetPagination, all others keep the
+    view's pagination_class. ?limit= works the same in both.
+    """
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.keyset_pagination_class and 'cursor' in self.request.query_params:
+                self._paginator = self.keyset_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
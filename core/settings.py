@@ -26,6 +26,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
@@ -48,6 +49,7 @@ TAILWIND_APP_NAME = 'Accounts   '  # Replace with your app name
 TAILWIND_MODE = 'jit'
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -60,6 +62,11 @@ MIDDLEWARE = [
 ]
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Requests slower than this are logged with their repeated SQL (core.middleware.MetricsMiddleware)
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0))
+# /metrics answers 404 unless this is set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -133,11 +140,24 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
+# Partner stock uploads and their reports; kept out of MEDIA_ROOT (not public)
+# and inside the project mount shared by the web and celery containers
+STOCK_IMPORT_ROOT = BASE_DIR / "stock_imports"
 
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Shared cache (match results etc.), same Redis instance as Celery
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://redis:6379/1'),
+        'KEY_PREFIX': 'feetfirst',
+    }
+}
+
+
 AUTH_USER_MODEL = 'Accounts.User'  
 
 
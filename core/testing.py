@@ -0,0 +1,27 @@
+from collections import Counter
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin that fails when a route runs more SQL queries than the
+    `query_budget` its view declares (or an explicit budget), listing the
+    most repeated statements so the N+1 is obvious from the failure.
+    """
+
+    def assertWithinQueryBudget(self, client, url, budget=None, method='get', **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, **kwargs)
+
+        if budget is None:
+            view_class = getattr(response.resolver_match.func, 'view_class', None)
+            budget = getattr(view_class, 'query_budget', None)
+            if budget is None:
+                self.fail(f"{url} has no query_budget declared on its view")
+
+        if len(queries) > budget:
+            repeated = Counter(query['sql'] for query in queries.captured_queries).most_common(3)
+            details = '\n'.join(f"  {count}x {sql[:300]}" for sql, count in repeated)
+            self.fail(f"{method.upper()} {url} ran {len(queries)} queries, budget is {budget}:\n{details}")
+        return response
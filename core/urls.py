@@ -7,9 +7,11 @@ from Contact.views import ContactListView
 from rest_framework_simplejwt.views import (TokenObtainPairView,TokenRefreshView,)
 from Others.views import *
 from Products.admin import *
+from core.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/users/', include('Accounts.urls')),
     path('api/products/', include('Products.urls')),
     path('api/surveys/', include('Surveys.urls')),
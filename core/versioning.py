@@ -0,0 +1,53 @@
+import time
+import logging
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY_PREFIX = 'version:'
+
+
+def product_scope(product_id):
+    return f"product:{product_id}"
+
+
+def favorites_scope(user_id):
+    return f"favorites:{user_id}"
+
+
+def scan_scope(user_id):
+    return f"scan:{user_id}"
+
+
+def bump_versions(*scopes):
+    """
+    Mark the scopes as changed. A version is the nanosecond timestamp of
+    the last change, so it doubles as the Last-Modified of the scope.
+    """
+    if not scopes:
+        return
+    now = time.time_ns()
+    try:
+        cache.set_many({VERSION_KEY_PREFIX + scope: now for scope in scopes}, timeout=None)
+    except Exception as e:
+        logger.warning(f"Version bump failed for {scopes[:5]}: {e}")
+
+
+def get_versions(scopes):
+    """
+    Current versions of the scopes as {scope: version}, or None when the
+    shared cache is down. Scopes never bumped (or evicted) start at the
+    current time, so nothing cached against an older version matches.
+    """
+    keys = {VERSION_KEY_PREFIX + scope: scope for scope in scopes}
+    try:
+        found = cache.get_many(list(keys))
+        now = time.time_ns()
+        for key in keys:
+            if key not in found:
+                cache.add(key, now, timeout=None)
+                found[key] = cache.get(key, now)
+    except Exception as e:
+        logger.warning(f"Version read failed: {e}")
+        return None
+    return {scope: found[key] for key, scope in keys.items()}